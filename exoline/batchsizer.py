@@ -0,0 +1,87 @@
+'''Adaptive sizing for batched One Platform RPC requests.'''
+import threading
+
+
+class BatchSizer:
+    '''Chooses how many units (calls, or data points for chunked reads)
+    to put in each JSON-RPC request. Sizes are tracked separately for each
+    kind of request, since e.g. an info call costs much less than a read of
+    hundreds of points.
+
+    After each request, call observe() with its size, duration and response
+    size. The next size is the number of units expected to take
+    target_seconds and produce at most target_bytes, growing by no more than
+    a factor of two per request so a single fast response doesn't overshoot.
+    Call timedout() when a request fails because it took too long, which
+    halves the size and keeps later requests of that kind smaller than the
+    one that failed.'''
+
+    # weight of the newest observation in per-unit cost estimates
+    smoothing = 0.5
+
+    def __init__(self,
+                 initial=25,
+                 minimum=1,
+                 maximum=1000,
+                 target_seconds=5.0,
+                 target_bytes=1024 * 1024):
+        self.initial = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_seconds = float(target_seconds)
+        self.target_bytes = float(target_bytes)
+        self._sizes = {}
+        # key -> largest size that hasn't timed out
+        self._ceilings = {}
+        # key -> [seconds per unit, bytes per unit]
+        self._costs = {}
+        self._lock = threading.Lock()
+
+    def _clamp(self, size, key=None):
+        maximum = self._ceilings.get(key, self.maximum)
+        return int(max(self.minimum, min(maximum, size)))
+
+    def size(self, key, initial=None):
+        '''Number of units to put in the next request of kind key.
+        initial overrides the starting size for keys with no observations.'''
+        with self._lock:
+            if key not in self._sizes:
+                return self._clamp(self.initial if initial is None else initial)
+            return self._sizes[key]
+
+    def observe(self, key, units, seconds, nbytes=None):
+        '''Update the size for key after a request of units took seconds and
+        returned a response of nbytes (None if unknown).'''
+        if units <= 0:
+            return
+        with self._lock:
+            current = self._sizes.get(key, units)
+            spu = seconds / units
+            bpu = None if nbytes is None else float(nbytes) / units
+            if key in self._costs:
+                old_spu, old_bpu = self._costs[key]
+                a = self.smoothing
+                spu = a * spu + (1 - a) * old_spu
+                if bpu is None:
+                    bpu = old_bpu
+                elif old_bpu is not None:
+                    bpu = a * bpu + (1 - a) * old_bpu
+            self._costs[key] = [spu, bpu]
+
+            limits = [current * 2]
+            if spu > 0:
+                limits.append(self.target_seconds / spu)
+            if bpu:
+                limits.append(self.target_bytes / bpu)
+            self._sizes[key] = self._clamp(min(limits), key)
+
+    def timedout(self, key, units):
+        '''Shrink the size for key after a request of units timed out.'''
+        with self._lock:
+            current = self._sizes.get(key, units)
+            self._ceilings[key] = self._clamp(3 * units // 4, key)
+            self._sizes[key] = self._clamp(min(current, units) // 2, key)
+            # per-unit cost is at least this high
+            if key in self._costs:
+                spu, bpu = self._costs[key]
+                self._costs[key] = [max(spu, self.target_seconds / max(units, 1)), bpu]
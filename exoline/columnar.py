@@ -0,0 +1,133 @@
+'''Columnar binary output for time series data.
+
+A columnar export is a directory with one flat array file per column and
+a manifest.json describing them:
+
+    manifest.json
+    timestamp.i64    int64 timestamps
+    0.f64            float64 values for a float resource
+    1.i64            int64 values for an integer resource
+    2.str            strings, each a uint32 byte length and UTF-8 bytes
+    2.valid          uint8 per row, 1 if the column has a value in that row
+
+All numbers are little endian. Every array has one entry per row, so
+fixed width arrays can be memory mapped directly (e.g. with numpy.memmap).
+Columns that can be missing from a row (when reading several resources at
+once) have a .valid file, and missing values are written as 0 or the empty
+string. manifest.json is written last, when the export is complete.
+'''
+import os
+import json
+import struct
+
+import six
+
+try:
+    from ..exoline.exocommon import ExoException
+except:
+    from exoline.exocommon import ExoException
+
+# resource format -> (array type, file extension, struct code)
+TYPES = {
+    'integer': ('int64', 'i64', 'q'),
+    'float': ('float64', 'f64', 'd'),
+}
+STRING_TYPE = ('string', 'str', None)
+
+
+class ColumnarWriter:
+    '''Writes rows of timestamp and values to a columnar export directory.
+    columns is a list of dicts with a 'name' and the resource 'format'
+    (integer, float, string, ...). Any other keys, like 'rid', are copied
+    to the manifest. If nullable is False, every row must have a value in
+    every column.'''
+
+    def __init__(self, path, columns, nullable=True, buffersize=4096):
+        self.path = path
+        if not os.path.exists(path):
+            os.makedirs(path)
+        elif os.path.exists(os.path.join(path, 'manifest.json')):
+            raise ExoException('{0} already contains a columnar export'.format(path))
+        self.nullable = nullable
+        self.buffersize = buffersize
+        self.rows = 0
+        self._timestamps = []
+        self._tsfile = open(os.path.join(path, 'timestamp.i64'), 'wb')
+        self.columns = []
+        for i, c in enumerate(columns):
+            typ, ext, code = TYPES.get(c.get('format'), STRING_TYPE)
+            column = dict(c)
+            column.update({'type': typ, 'file': '{0}.{1}'.format(i, ext)})
+            if nullable:
+                column['valid'] = '{0}.valid'.format(i)
+            self.columns.append({
+                'manifest': column,
+                'code': code,
+                'file': open(os.path.join(path, column['file']), 'wb'),
+                'validfile': open(os.path.join(path, column['valid']), 'wb') if nullable else None,
+                'values': [],
+                'valid': bytearray()})
+
+    def _pack(self, column, values):
+        code = column['code']
+        if code is not None:
+            return struct.pack('<{0}{1}'.format(len(values), code), *values)
+        parts = []
+        for v in values:
+            if not isinstance(v, six.string_types):
+                v = json.dumps(v) if v is not None else ''
+            b = v.encode('utf-8')
+            parts.append(struct.pack('<I', len(b)))
+            parts.append(b)
+        return b''.join(parts)
+
+    def _flush(self):
+        if len(self._timestamps) == 0:
+            return
+        self._tsfile.write(struct.pack(
+            '<{0}q'.format(len(self._timestamps)), *self._timestamps))
+        self._timestamps = []
+        for column in self.columns:
+            column['file'].write(self._pack(column, column['values']))
+            column['values'] = []
+            if column['validfile'] is not None:
+                column['validfile'].write(bytes(column['valid']))
+                column['valid'] = bytearray()
+
+    def write(self, timestamp, values):
+        '''Add a row. values has a value (or None) for each column.'''
+        self._timestamps.append(timestamp)
+        for column, v in zip(self.columns, values):
+            if v is None:
+                if not self.nullable:
+                    raise ExoException('missing value at {0}'.format(timestamp))
+                column['valid'].append(0)
+                v = '' if column['code'] is None else 0
+            else:
+                if column['validfile'] is not None:
+                    column['valid'].append(1)
+                if column['code'] == 'd':
+                    v = float(v)
+                elif column['code'] == 'q':
+                    v = int(v)
+            column['values'].append(v)
+        self.rows += 1
+        if len(self._timestamps) >= self.buffersize:
+            self._flush()
+
+    def close(self):
+        '''Flush arrays and write the manifest.'''
+        self._flush()
+        self._tsfile.close()
+        for column in self.columns:
+            column['file'].close()
+            if column['validfile'] is not None:
+                column['validfile'].close()
+        manifest = {
+            'version': 1,
+            'byteorder': 'little',
+            'rows': self.rows,
+            'timestamp': {'type': 'int64', 'file': 'timestamp.i64'},
+            'columns': [c['manifest'] for c in self.columns]}
+        with open(os.path.join(self.path, 'manifest.json'), 'w') as f:
+            f.write(six.text_type(json.dumps(manifest, indent=2)))
@@ -20,6 +20,17 @@ Options:
   -d --debughttp         Turn on debug level logging in pyonep
   --curl                 Show curl calls for requests. Implies --debughttp
   --discreet             Obfuscate RIDs in stdout and stderr
+  --parallel=<num>       Number of RPC connections to use at once for batched
+                         commands and walking client trees. Default is
+                         $EXO_PARALLEL or 1
+  --cachedir=<dir>       Cache time series data in <dir> so reads only fetch
+                         what is new. Default is $EXO_CACHEDIR (no cache)
+  --cachesize=<mb>       Size limit for --cachedir in MB. Default is
+                         $EXO_CACHESIZE or 500
+  --indexdir=<dir>       Directory for the local resource index (see exo
+                         index). Default is $EXO_INDEXDIR or ~/.exoline-index
+  --useindex             Answer search, find and makeShortcuts from the local
+                         index instead of fetching client trees
   -e --clearcache        Invalidate Portals cache after running command
   --portals=<server>     Portals server [default: https://portals.exosite.com]
   -t --vendortoken=<vt>  Vendor token (/admin/home in Portals)
@@ -43,6 +54,8 @@ else:
     import csv
 import platform
 import re
+import shlex
+import socket
 from datetime import datetime
 from datetime import timedelta
 import time
@@ -50,9 +63,12 @@ from pprint import pprint
 from operator import itemgetter
 import logging
 from collections import defaultdict
+from collections import deque
 import copy
 import difflib
+import heapq
 import warnings
+import threading
 
 import six
 from six import StringIO
@@ -85,16 +101,31 @@ try:
     from ..exoline.exocommon import ExoException
     from ..exoline import exocommon
     from ..exoline import serieswriter
+    from ..exoline.batchsizer import BatchSizer
+    from ..exoline import seriescache
+    from ..exoline import columnar
+    from ..exoline import resourcenode
+    from ..exoline import findindex
+    from ..exoline import metaindex
+    from ..exoline import timestamps
 except:
     from exoline import __version__
     from exoline.exocommon import ExoException
     from exoline import exocommon
     from exoline import serieswriter
+    from exoline.batchsizer import BatchSizer
+    from exoline import seriescache
+    from exoline import columnar
+    from exoline import resourcenode
+    from exoline import findindex
+    from exoline import metaindex
+    from exoline import timestamps
 
 DEFAULT_HOST = 'm2.exosite.com'
 DEFAULT_PORT = '80'
 DEFAULT_PORT_HTTPS = '443'
 DEFAULT_CONFIG = '~/.exoline'
+DEFAULT_INDEXDIR = '~/.exoline-index'
 SCRIPT_LIMIT_BYTES = 16 * 1024
 
 PERF_DATA = []
@@ -114,13 +145,18 @@ Command options:
     --tz=<TZ>                Olson TZ name
     --sort=<order>           asc or desc [default: desc]
     --selection=all|autowindow|givenwindow  downsample method [default: all]
-    --format=csv|raw         output format [default: csv]
+    --format=csv|raw|columnar
+                             output format [default: csv]
+    --output=<dir>           directory to write for --format=columnar
     --timeformat=unix|human|iso8601|excel
                              unix timestamp, human-readable, or spreadsheet-
                              compatible? [default: human]
     --header=name|rid        include a header row
-    --chunksize=<size>       [default: 212] break read into requests of
-                             length <size>, printing data as it is received.
+    --chunksize=<size>       break read into requests of length <size>,
+                             printing data as it is received. By default,
+                             request length adapts to the connection.
+    --shards=<n>             read up to <n> time windows at once, for long
+                             reads [default: 1]
     {{ helpoption }}
 
     If <rid> is omitted, reads all datasources and datarules under <cik>.
@@ -131,15 +167,38 @@ Command options:
         '''Write data at the current time.\n\nUsage:
     exo [options] write <cik> [<rid>] --value=<value>
     exo [options] write <cik> [<rid>] -
+    exo [options] write <cik> (--set=<rid=value> ...)
+    exo [options] write <cik> --ndjson -
+    exo [options] write --ndjson -
 
 The - form takes the value to write from stdin. For example:
 
-    $ echo '42' | exo write 8f21f0189b9acdc82f7ec28dc0c54ccdf8bc5ade myDataport -'''),
+    $ echo '42' | exo write 8f21f0189b9acdc82f7ec28dc0c54ccdf8bc5ade myDataport -
+
+The --set and --ndjson forms write to many resources at once, several writes to a
+request. --set takes <rid>=<value> pairs, where <rid> is a RID or alias, and the value is
+everything after the first =. For example:
+
+    $ exo write myClient --set=mode=auto --set=interval=60
+
+With --ndjson, each line of stdin is a JSON object with the resource in "rid" and the value
+in "value", and the client in "cik" (a CIK or shortcut). "cik" may be left out of lines
+for <cik>, if it's passed. Values that aren't strings are written as JSON. For example:
+
+    {"cik": "device1", "rid": "interval", "value": 60}
+
+A failed write is reported without stopping the others.
+
+Command options:
+    --set=<rid=value>  write value to a resource
+    --ndjson           read resources and values to write from stdin as JSON lines
+    '''),
     ('record',
         '''Write data at a specified time.\n\nUsage:
     exo [options] record <cik> [<rid>...] [-]
     exo [options] record <cik> [<rid>] (--value=<timestamp,value> ...)
     exo [options] record <cik> [<rid>] --interval=<seconds> ((--value=<value> ...) | -)
+    exo [options] record --fanout [-]
 
     Can take a CSV file on STDIN and record the values to dataports.  The file must have the
     first column to be unix timestamps for each row.  The remaining columns are data to be
@@ -152,10 +211,23 @@ The - form takes the value to write from stdin. For example:
     Will take the CSV file, my.csv, that has four columns. Record that data into the dataports
     with aliases dpA, dpB, and dpC on the shortcut aCIK.
 
+    With --fanout, the CSV has a header row that says where each column is recorded, so
+    one file can load many clients. The first header is ignored (it's over the timestamp
+    column) and the rest are <cik>:<rid>, where <cik> is a CIK or shortcut (or
+    <cik>:c<client-rid> for a client of it) and <rid> is a RID or alias. Columns of the
+    same client are recorded together, and empty cells are skipped. For example:
+    $ exo --parallel=8 record --fanout - < fleet.csv
+    Where fleet.csv starts with:
+    timestamp,device1:temperature,device1:humidity,device2:temperature
+
 
 Command options:
     --interval generates timestamps at a regular interval into the past.
     --chunksize=<lines>       [default: 212] break record into requests of length <lines>
+    --fanout                  read the client and resource of each column from a header row
+
+    CSV rows are recorded as they're read, with a request for every <lines> rows. Use
+    the global --parallel option to send several requests at once.
 
     '''),
     ('create',
@@ -321,6 +393,10 @@ Command options:
     --show=<shows>           Things to show on match (default: cik)
     --match=<matches>        List of --match x=y,z=w to match on (supported operations: ^ (not), >, <, =)
 
+    Matches are checked against every key in the info of each descendant,
+    including nested keys like status and keys in JSON meta like model.
+    < and > compare numbers.
+
 Example:
     $ exo find $CIK --match "status=activated,model=$CLIENT_MODEL"
     7893635162b84f78e4475c2d6383645659545344
@@ -452,7 +528,37 @@ Command options:
      create (clone) functionality, which is more full featured.
      https://github.com/exosite/docs/tree/master/rpc#create-clone
 
-     Use the clone command except if you need to copy a device to another portal.''')
+     Use the clone command except if you need to copy a device to another portal.'''),
+    ('batch', '''Run many commands in one process, reusing connections\n\nUsage:
+    exo [options] batch [<file>] [--stoponerror]
+
+Command options:
+    --stoponerror  Stop at the first command that fails
+
+    Reads exo commands from <file>, or from stdin if <file> is omitted, one per
+    line, and runs them one after another. Lines are split like a shell would
+    (quotes group words), and may start with "exo". Blank lines and lines
+    starting with # are skipped. The options passed to batch apply to every
+    command, and a line may add its own before the command name.
+
+    Commands run in this process, so Python start-up, plugin loading and the
+    config file are paid for once, and commands with the same connection
+    options share an RPC connection. After each command, a line like this is
+    printed with the number of its line and its exit code:
+
+    # line 3 exit 0
+
+    A command that raises an unexpected error (e.g. a network error) is
+    reported on stderr and counts as failed, with exit code 1. The exit code
+    of batch is 1 if any command failed. When commands are read from stdin,
+    they can't read stdin themselves. If stdin is a terminal, batch shows a
+    prompt.
+
+    For example:
+    $ exo batch commands.txt
+    Where commands.txt has:
+    write myClient temperature --value=21.5
+    read myClient temperature --limit=10''')
     ])
 
 # shared sections of documentation
@@ -587,6 +693,33 @@ else:
         plugins.append(p)
         cmd_doc[p.command()] = aliases.__doc__
 
+        # cache plugin
+        try:
+            from ..exoline.plugins import cache
+        except:
+            from exoline.plugins import cache
+        p = cache.Plugin()
+        plugins.append(p)
+        cmd_doc[p.command()] = cache.__doc__
+
+        # restore plugin
+        try:
+            from ..exoline.plugins import restore
+        except:
+            from exoline.plugins import restore
+        p = restore.Plugin()
+        plugins.append(p)
+        cmd_doc[p.command()] = restore.__doc__
+
+        # index plugin
+        try:
+            from ..exoline.plugins import index
+        except:
+            from exoline.plugins import index
+        p = index.Plugin()
+        plugins.append(p)
+        cmd_doc[p.command()] = index.__doc__
+
         # meta plugin
         try:
             from ..exoline.plugins import meta
@@ -611,21 +744,48 @@ for k in cmd_doc:
 
 from exoline.exoconfig import ExoConfig
 exoconfig = ExoConfig(os.getenv('EXO_CONFIG', DEFAULT_CONFIG))
+# While batch runs commands, configs by path and (ExoRPC, Provision) by
+# connection options, so commands can share them. None otherwise.
+batch_reuse = None
 class ExolineOnepV1(onep.OnepV1):
     '''Subclass that re-adds deprecated commands needed for devices created
     in Portals before the commands were deprecated.'''
 
+    def __init__(self, *args, **kwargs):
+        onep.OnepV1.__init__(self, *args, **kwargs)
+        # PERF_DATA entry for the most recent request
+        self.last_perf = None
+        self._response_bytes = None
+        # note the size of each response body for PERF_DATA
+        http = getattr(self, 'onephttp', None)
+        if http is not None and hasattr(http, 'request'):
+            request = http.request
+            def sized_request(*args, **kwargs):
+                body, response = request(*args, **kwargs)
+                try:
+                    self._response_bytes = len(body)
+                except TypeError:
+                    pass
+                return body, response
+            http.request = sized_request
+
     def _callJsonRPC(self, cik, callrequests, returnreq=False, notimeout=False):
         '''Time all calls to _callJsonRPC'''
         try:
             ts = time.time()
             procedures = [cr['procedure'] for cr in callrequests]
+            self._response_bytes = None
             r = onep.OnepV1._callJsonRPC(self, cik, callrequests, returnreq, notimeout=notimeout)
         except:
             raise
         finally:
             te = time.time()
-            PERF_DATA.append({'cik': cik, 'procedures': procedures, 'seconds': te-ts})
+            self.last_perf = {'cik': cik,
+                              'procedures': procedures,
+                              'seconds': te-ts,
+                              'calls': len(callrequests),
+                              'bytes': self._response_bytes}
+            PERF_DATA.append(self.last_perf)
         return r
 
     def comment(self, cik, rid, visibility, comment, defer=False):
@@ -637,6 +797,18 @@ class ExoRPC():
     Raises exceptions on error and provides some reasonable defaults.'''
     regex_rid = re.compile("[0-9a-fA-F]{40}")
     regex_tweeid = re.compile("rid\.[0-9a-fA-F]{5}")
+    # procedures that may be sent again if a request fails partway. Not
+    # record or write, since the platform may have applied the failed
+    # request and the points would be written twice.
+    repeatable_procedures = set(['info', 'listing', 'lookup', 'read', 'usage', 'flush'])
+    # times a request that timed out may be split in half and resent
+    max_splits = 3
+    # points read into the cache at a time
+    cache_pagesize = 10000
+    # cached time ranges are only marked complete up to this many seconds
+    # before now, since points may still arrive late with earlier
+    # timestamps (from devices, other writers or clock differences)
+    cache_settle = 600
 
     class RPCException(Exception):
         def __init__(self, *args):
@@ -662,21 +834,160 @@ class ExoRPC():
                  verbose=True,
                  logrequests=False,
                  user_agent=None,
-                 curldebug=False):
+                 curldebug=False,
+                 parallel=1,
+                 cache=None,
+                 indexdir=None,
+                 useindex=False):
 
         if port is None:
             port = DEFAULT_PORT_HTTPS if https else DEFAULT_PORT
         if user_agent is None:
             user_agent = "Exoline {0}".format(__version__)
-        self.exo = ExolineOnepV1(
-            host=host,
-            port=port,
-            httptimeout=httptimeout,
-            https=https,
-            agent=user_agent,
-            reuseconnection=True,
-            logrequests=logrequests,
-            curldebug=curldebug)
+        # arguments for each pyonep connection. Only one is used
+        # unless parallel is greater than 1.
+        self._onep_args = {
+            'host': host,
+            'port': port,
+            'httptimeout': httptimeout,
+            'https': https,
+            'agent': user_agent,
+            'reuseconnection': True,
+            'logrequests': logrequests,
+            'curldebug': curldebug}
+        self.parallel = parallel
+        self._connections = [ExolineOnepV1(**self._onep_args)]
+        # connections not currently checked out by a worker thread
+        self._idle_connections = []
+        self._connection_lock = threading.Lock()
+        self._local = threading.local()
+        # SeriesCache for reads, or None
+        self.cache = cache
+        # local MetaIndex directory, opened by _metaindex when it's needed.
+        # If useindex is True, read-only commands use it instead of
+        # fetching client trees.
+        self.indexdir = DEFAULT_INDEXDIR if indexdir is None else indexdir
+        self.useindex = useindex
+        self._index = None
+        # aim for requests that take a fraction of the HTTP timeout
+        self.batchsizer = BatchSizer(
+            target_seconds=min(5.0, float(httptimeout) / 4))
+        # sizes chunked reads by number of points rather than calls
+        self.readsizer = BatchSizer(
+            initial=212,
+            maximum=50000,
+            target_seconds=min(5.0, float(httptimeout) / 4))
+
+    @property
+    def exo(self):
+        '''pyonep connection for the calling thread. Worker threads started
+        by _imap_parallel each have their own keep-alive connection, since
+        pyonep connections and deferred calls may not be shared between
+        threads.'''
+        return getattr(self._local, 'exo', self._connections[0])
+
+    def _checkout_connection(self):
+        with self._connection_lock:
+            if len(self._idle_connections) > 0:
+                return self._idle_connections.pop()
+            exo = ExolineOnepV1(**self._onep_args)
+            self._connections.append(exo)
+            return exo
+
+    def _checkin_connection(self, exo):
+        with self._connection_lock:
+            self._idle_connections.append(exo)
+
+    def loggedrequests(self):
+        '''Requests logged by all connections (see logrequests)'''
+        return list(itertools.chain(
+            *[exo.loggedrequests() for exo in self._connections]))
+
+    def _imap_parallel(self, fn, items, workers=None):
+        '''Generate fn(item) for each item in items, in order, with up to
+        workers calls to fn (default: self.parallel) running at once. Each
+        worker thread has its own connection, so fn may make RPC calls
+        through self as usual. At most 2 * workers results are buffered
+        ahead of the consumer. If fn raises, the exception is re-raised
+        when its result would have been generated.
+
+        Calls made from inside a worker thread run inline, so nested use
+        does not multiply the number of connections.'''
+        if workers is None:
+            workers = self.parallel
+        if (workers <= 1 or hasattr(self._local, 'exo') or
+                (type(items) is list and len(items) <= 1)):
+            for item in items:
+                yield fn(item)
+            return
+
+        items = enumerate(items)
+        cond = threading.Condition()
+        results = {}
+        # taken - number of items handed to workers
+        # next - index of the next result to generate
+        # end - number of items, once known
+        state = {'taken': 0, 'next': 0, 'end': None, 'stop': False}
+        window = 2 * workers
+
+        def work():
+            exo = self._checkout_connection()
+            self._local.exo = exo
+            try:
+                while True:
+                    with cond:
+                        while (not state['stop'] and state['end'] is None and
+                               state['taken'] - state['next'] >= window):
+                            cond.wait()
+                        if state['stop'] or state['end'] is not None:
+                            return
+                        try:
+                            i, item = six.next(items)
+                        except StopIteration:
+                            state['end'] = state['taken']
+                            cond.notify_all()
+                            return
+                        except Exception:
+                            results[state['taken']] = (False, sys.exc_info())
+                            state['end'] = state['taken'] + 1
+                            cond.notify_all()
+                            return
+                        state['taken'] += 1
+                    try:
+                        result = (True, fn(item))
+                    except Exception:
+                        result = (False, sys.exc_info())
+                    with cond:
+                        results[i] = result
+                        cond.notify_all()
+            finally:
+                del self._local.exo
+                self._checkin_connection(exo)
+
+        threads = [threading.Thread(target=work) for w in range(workers)]
+        for t in threads:
+            t.daemon = True
+            t.start()
+        try:
+            while True:
+                with cond:
+                    while (state['next'] not in results and
+                           (state['end'] is None or state['next'] < state['end'])):
+                        # wait with a timeout so KeyboardInterrupt gets through
+                        cond.wait(1)
+                    if state['next'] not in results:
+                        break
+                    ok, result = results.pop(state['next'])
+                    state['next'] += 1
+                    cond.notify_all()
+                if ok:
+                    yield result
+                else:
+                    six.reraise(*result)
+        finally:
+            with cond:
+                state['stop'] = True
+                cond.notify_all()
 
     def _raise_for_response(self, isok, response, call=None):
         if not isok:
@@ -709,11 +1020,27 @@ class ExoRPC():
             raise Exception("_exomult: unexpected type for auth " + str(auth))
         assert(not self.exo.has_deferred(auth))
 
-    def _exomult(self, auth, commands):
-        '''Takes a list of onep commands with cik omitted, e.g.:
-            [['info', {alias: ""}], ['listing', ['dataport'], {}, {'alias': ''}]'''
-        if len(commands) == 0:
-            return []
+    def _batchkey(self, commands):
+        '''Kind of request commands make, for self.batchsizer'''
+        return tuple(sorted(set([c[0] for c in commands])))
+
+    def _is_timeout(self, ex):
+        '''Return True if ex, a JsonRPCRequestException, is for a request
+           that timed out. pyonep wraps the socket error, so look at the
+           exception it was raised while handling, or else the message.'''
+        cause = getattr(ex, '__cause__', None) or getattr(ex, '__context__', None)
+        if isinstance(cause, socket.timeout):
+            return True
+        return 'timed out' in str(ex).lower()
+
+    def _send_commands(self, auth, commands, perf=None, splits=0):
+        '''Send commands in a single request and return pyonep's
+           (call, isok, response) for each. If the request times out and
+           the commands are all safe to repeat, split them in half and send
+           each half, up to self.max_splits times. Other request errors are
+           raised right away. Request timings are passed to
+           self.batchsizer, and if perf is a list the PERF_DATA entry for
+           each request is appended to it.'''
         self._check_exomult(auth)
         for c in commands:
             if type(c) is not list:
@@ -721,7 +1048,36 @@ class ExoRPC():
             method = getattr(self.exo, c[0])
             method(auth, *c[1:], defer=True)
         assert(self.exo.has_deferred(auth))
-        r = self.exo.send_deferred(auth)
+        exo = self.exo
+        key = self._batchkey(commands)
+        try:
+            r = exo.send_deferred(auth)
+        except pyonep.exceptions.JsonRPCRequestException as ex:
+            if exo.has_deferred(auth):
+                exo.deferred.reset(auth)
+            if not self._is_timeout(ex):
+                # e.g. connection refused, which smaller requests won't fix
+                raise
+            self.batchsizer.timedout(key, len(commands))
+            if (len(commands) < 2 or splits >= self.max_splits or
+                    not all([c[0] in self.repeatable_procedures for c in commands])):
+                raise
+            half = len(commands) // 2
+            return (self._send_commands(auth, commands[:half], perf=perf, splits=splits + 1) +
+                    self._send_commands(auth, commands[half:], perf=perf, splits=splits + 1))
+        stat = exo.last_perf
+        if stat is not None:
+            self.batchsizer.observe(key, len(commands), stat['seconds'], stat['bytes'])
+            if perf is not None:
+                perf.append(stat)
+        return r
+
+    def _exomult(self, auth, commands):
+        '''Takes a list of onep commands with cik omitted, e.g.:
+            [['info', {alias: ""}], ['listing', ['dataport'], {}, {'alias': ''}]'''
+        if len(commands) == 0:
+            return []
+        r = self._send_commands(auth, commands)
         responses = self._raise_for_deferred(r)
         return responses
 
@@ -732,16 +1088,21 @@ class ExoRPC():
            raise exceptions, though.'''
         if len(commands) == 0:
             return []
-        self._check_exomult(auth)
-        for c in commands:
-            if type(c) is not list:
-                raise Exception("_exomult: found invalid command " + str(c))
-            method = getattr(self.exo, c[0])
-            method(auth, *c[1:], defer=True)
-        r = self.exo.send_deferred(auth)
-        results = map(self._undo_pyonep_response_mangling, r)
+        r = self._send_commands(auth, commands)
+        results = [self._undo_pyonep_response_mangling(resp) for resp in r]
         return results
 
+    def _exomult_batched(self, auth, commands):
+        '''Like _exomult, but splits commands across as many requests as
+           needed to keep each one fast (see _exobatch).'''
+        responses = []
+        for command, r in zip(commands, self._exobatch(
+                auth, [{'commands': [c]} for c in commands])):
+            if r[0]['status'] != 'ok':
+                self._raise_for_response(False, r[0]['status'], call=command)
+            responses.append(r[0]['result'])
+        return responses
+
     def _undo_pyonep_response_mangling(self, pyonep_response):
         '''pyonep mixes RPC responses up, setting isok to status=='ok'
            and response to either response or the status if status is not 'ok'.
@@ -752,29 +1113,62 @@ class ExoRPC():
         else:
             return {'status': r}
 
-    def _exobatch(self, auth, commands, batchsize=25):
+    def _commandchunks(self, commands, batchsize=None):
+        '''Break a list of commandsets into chunks to send a request each,
+           to prevent timeout. Chunks have at most batchsize commandsets,
+           or if batchsize is None, about as many commands as
+           self.batchsizer suggests. Sizes are looked up as each chunk is
+           taken, so they reflect requests completed so far.'''
+        l = list(commands)
+        if batchsize is not None:
+            for i in range(0, len(l), batchsize):
+                yield l[i:i+batchsize]
+            return
+        i = 0
+        while i < len(l):
+            size = self.batchsizer.size(self._batchkey(l[i]['commands']))
+            chunk = [l[i]]
+            count = len(l[i]['commands'])
+            i += 1
+            while i < len(l) and count + len(l[i]['commands']) <= size:
+                chunk.append(l[i])
+                count += len(l[i]['commands'])
+                i += 1
+            yield chunk
+
+    def _exobatch(self, auth, commands, batchsize=None, chunkerrors=False):
         '''Performs a set of commands, breaking them into batches of at most batchsize
-           to prevent timeout.
+           to prevent timeout. Up to self.parallel batches are sent at once,
+           each over its own connection.
              auth - either a cik or an auth dict
              commands - a list of commandset objects like this:
                       {'commands': [['info', rid, options]],
                        'callback': lambda(commandset, result)}
              batchsize - the maximum number of commands/command objects to include
-                       in each RPC request.
+                       in each RPC request. If None, batches are sized by
+                       self.batchsizer, based on how long recent requests
+                       took.
            Returns a list of responses in the form {'status': !'ok'} on failure or
                 {'status': 'ok', 'result': result}
-           If any overall failures occur, an exception is raised.'''
-        # break calls into chunks to prevent timeout
-        def chunks(l, n):
-            '''Yield successive n-sized chunks from l.'''
-            for i in range(0, len(l), n):
-                yield l[i:i+n]
-        for commandchunk in chunks(commands, batchsize):
+           Responses are generated and callbacks are called in the order of
+           commands, whatever order the batches complete in.
+           If any overall failures occur, an exception is raised, unless
+           chunkerrors is True, in which case each command in a request that
+           failed gets the response {'status': <exception message>} and the
+           other requests still return their results.'''
+        commandchunks = self._commandchunks(commands, batchsize)
+        def send(commandchunk):
             cmds = []
             for commandset in commandchunk:
                 cmds = cmds + commandset['commands']
             #sys.stderr.write('_exomult_with_responses with {0} commands.\n'.format(len(cmds)))
-            cmd_responses = self._exomult_with_responses(auth, cmds)
+            try:
+                return commandchunk, self._exomult_with_responses(auth, cmds)
+            except Exception as ex:
+                if not chunkerrors:
+                    raise
+                return commandchunk, [{'status': str(ex)} for c in cmds]
+        for commandchunk, cmd_responses in self._imap_parallel(send, commandchunks):
             result_index = 0
             # stitch the flattened result list into command sets
             # and call the command set callbacks
@@ -787,6 +1181,45 @@ class ExoRPC():
                     commandset['callback'](commandset, commandset_responses)
                 yield commandset_responses
 
+    def _exobatch_auths(self, commands, chunkerrors=False):
+        '''Like _exobatch, but for commandsets with different auths.
+           commands is a list of (auth, commandset). Commandsets with the
+           same auth are sent several to a request, and up to
+           self.parallel requests are sent at once, whatever their auth.
+           Returns a list of the responses for each commandset, in the
+           order of commands. Callbacks are not called.'''
+        def authkey(a):
+            if isinstance(a, string_types):
+                a = {'cik': a}
+            return json.dumps(a, sort_keys=True)
+        groups = OrderedDict()
+        for i, (auth, commandset) in enumerate(commands):
+            groups.setdefault(authkey(auth), (auth, []))[1].append(
+                {'commands': commandset['commands'], 'index': i})
+        def commandchunks():
+            for auth, commandsets in groups.values():
+                for commandchunk in self._commandchunks(commandsets):
+                    yield auth, commandchunk
+        def send(item):
+            auth, commandchunk = item
+            cmds = []
+            for commandset in commandchunk:
+                cmds = cmds + commandset['commands']
+            try:
+                return commandchunk, self._exomult_with_responses(auth, cmds)
+            except Exception as ex:
+                if not chunkerrors:
+                    raise
+                return commandchunk, [{'status': str(ex)} for c in cmds]
+        responses = [None] * len(commands)
+        for commandchunk, cmd_responses in self._imap_parallel(send, commandchunks()):
+            result_index = 0
+            for commandset in commandchunk:
+                n = len(commandset['commands'])
+                responses[commandset['index']] = cmd_responses[result_index:result_index + n]
+                result_index += n
+        return responses
+
     def wait(self, auth, rid, since=None, timeout=None):
         '''Returns timedout, point. If timedout is True,
         point is None'''
@@ -824,6 +1257,9 @@ class ExoRPC():
              starttime=None,
              endtime=None,
              selection='all'):
+        if self.cache is not None and selection == 'all':
+            return [[t, v[0]] for t, v in self.readmult(
+                cik, [rid], limit, sort, starttime, endtime)]
         options = self._readoptions(limit, sort, starttime, endtime, selection)
         isok, response = self.exo.read(
             cik,
@@ -845,119 +1281,85 @@ class ExoRPC():
         self._raise_for_response(isok, response)
         return response
 
-    def find(self, cik, matches, shows, verbose=False):
-        showcik = False
+    def find(self, cik, matches, shows, verbose=False, index=None):
+        '''Print the shows of cik's descendants that match all of matches
+        (see exo find). To run several queries on the same client, pass
+        index, a findindex.FindIndex from _findindex.'''
         if "cik" in shows:
             shows = shows.replace("cik", "key")
         if verbose:
             print("Matching {0} and showing {1}".format(matches, shows))
-        matchers = {}
-        for matchval in matches.split(","):
-            data = re.findall(r"(.*?)([=<>^])(.*)", matchval)
-            for d in data:
-                if len(d) == 3:
-                    matchers[d[0]] = (d[2], d[1])
+        conditions = findindex.parse_matches(matches)
 
         shows = [s.strip() for s in shows.split(",")]
         if verbose:
             print("Showing: {0}".format(shows))
-            print("Matching: {0}".format(matchers))
-
-        data = self._infotree_fast(cik)
-
-        display_data = []
+            print("Matching: {0}".format(conditions))
 
-
-        def compare(valueA, comp, valueB):
-            if verbose:
-                print(valueA, comp, valueB)
-            if comp == "^":
-                return valueA != valueB
-            elif comp == ">":
-                try:
-                    return float(valueA) > float(valueB)
-                except:
-                    return False
-            elif comp == "<":
-                try:
-                    return float(valueA) < float(valueB)
-                except:
-                    return False
-            elif comp == "=":
-                return valueA == valueB
-            return False
-
-        def match_node(node, level=0, parents=None):
-            if not parents:
-                parents = []
-            results = {'__matches':[], '__shows':[], "__children":[], "__output":[]}
-            if type(node) == type({}):
-                for k,v in node.iteritems():
-                    #print "\t"*level, k
-                    if type(v) == type({}):
-                        res = match_node(v, level+1, parents+[k])
-                        results['__shows'].extend(res['__shows'])
-                        results['__matches'].extend(res['__matches'])
-                        results['__children'].extend(res['__children'])
-                        results['__output'].extend(res['__output'])
-
-                    if k in shows:
-                        #print "Show: ", k, v
-                        results['__shows'].append((k,v, level, parents))
-                    if k in matchers:
-                        value, comparison = matchers.get(k)
-                        result = compare(v, comparison, value)
-                        if result:
-                            if verbose:
-                                print("Match: {0} {1}".format(k, v))
-                            results['__matches'].append( (k,v,level, parents))
-                    if k == "meta":
-                        try:
-                            jv = json.loads(v)
-                            if type(jv) == type({}):
-                                res = match_node(jv, level)
-                                results['__shows'].extend(res['__shows'])
-                                results['__matches'].extend(res['__matches'])
-                                results['__children'].extend(res['__children'])
-                                results['__output'].extend(res['__output'])
-
-                        except:
-                            if verbose:
-                                print("Bad meta: {0}".format(v))
-
-                children = node.get('children', [])
-                for child in children:
-                    res = match_node(child, level+1, [])
-                    match_keys = set(r[0] for r in res['__matches'])
-                    if all(k in match_keys for k in matchers.keys()):
-                        results['__output'].append( res['__shows'] )
-
-            if type(node) == type([]):
-                for l in node:
-                    res = match_node(l, level+1)
-                    results['__shows'].extend(res['__shows'])
-                    results['__matches'].extend(res['__matches'])
-                    results['__children'].extend(res['__children'])
-                    results['__output'].extend(res['__output'])
-
-            if type(node) == type(""):
-                pass
-
-            return results
+        if index is None:
+            index = self._findindex(cik)
+        if verbose:
+            for condition, count in index.plan(conditions):
+                print("Plan: {0} {1}".format(
+                    ''.join(condition),
+                    'filter' if count is None else '{0} matches'.format(count)))
 
         output = []
-        for d in match_node(data)['__output']:
+        for nodeid in index.query(conditions):
+            # tab delimited values, in the order of shows
             out = []
-            # Loop through so we get the correct order from our input shows
             for show in shows:
-                for e in d:
-                    if e[0] == show:
-                        out.append(str(e[1]))
+                for value in index.values(nodeid, show):
+                    out.append(six.text_type(value))
             output.append("\t".join(out))
         print("\n".join(output))
 
+    def _findindex(self, cik):
+        '''Return a findindex.FindIndex of the descendants of cik, from the
+        local index with --useindex'''
+        if self.useindex:
+            return findindex.FindIndex.from_tree(self._infotree(cik, useindex=True))
+        return findindex.FindIndex.from_tree(self._infotree_fast(cik))
+
+    def _mergereads(self, reads, sort):
+        '''Generate combined rows from reads, a list of iterables of
+        [timestamp, value] points, each already in sort order ('asc' or
+        'desc'). Rows are [timestamp, [value0, value1, ...]] where values
+        are in the order of reads, and None for reads without a point at
+        that timestamp. Rows are generated in sort order, as they are
+        merged.'''
+        sign = -1 if sort == 'desc' else 1
+        # heap of [sort key, read index, value, iterator]. read index
+        # breaks ties so iterators are never compared.
+        heap = []
+        for i, read in enumerate(reads):
+            it = iter(read)
+            for point in it:
+                heap.append([sign * point[0], i, point[1], it])
+                break
+        heapq.heapify(heap)
+        nreads = len(reads)
+        while heap:
+            key = heap[0][0]
+            values = [None] * nreads
+            advanced = []
+            # pop every read's point at this timestamp before advancing
+            # any of them, so a read with repeated timestamps still
+            # contributes one point per row
+            while heap and heap[0][0] == key:
+                entry = heapq.heappop(heap)
+                values[entry[1]] = entry[2]
+                advanced.append(entry)
+            yield [sign * key, values]
+            for entry in advanced:
+                it = entry[3]
+                for point in it:
+                    entry[0] = sign * point[0]
+                    entry[2] = point[1]
+                    heapq.heappush(heap, entry)
+                    break
 
-    def _combinereads(self, reads, sort):
+    def _combinereads(self, reads, sort='desc'):
         '''
         >>> exo = ExoRPC()
         >>> exo._combinereads([[[2, 'a'], [1, 'b']]])
@@ -966,50 +1368,12 @@ class ExoRPC():
         [[3, ['a', 77]], [2, ['b', None]], [1, [None, 78]]]
         >>> exo._combinereads([[[5, 'a'], [4, 'b']], [[2, 'd'], [1, 'e']]])
         [[5, ['a', None]], [4, ['b', None]], [2, [None, 'd']], [1, [None, 'e']]]
+        >>> exo._combinereads([[[1, 'a'], [2, 'b']], [[1, 77], [3, 78]]], 'asc')
+        [[1, ['a', 77]], [2, ['b', None]], [3, [None, 78]]]
         >>> exo._combinereads([])
         []
         '''
-        if len(reads) == 0:
-            return []
-        else:
-            combined = []
-
-            # indexes into each list indicating the next
-            # unprocessed value
-            curi = [len(l) - 1 for l in reads]
-            #print(reads)
-
-            # loop until we've processed every element
-            while curi != [-1] * len(curi):
-                # minimum timestamp from unprocessed entries
-                timestamp = min([reads[i][ci] for i, ci in enumerate(curi) if ci is not -1],
-                        key=itemgetter(0))[0]
-
-                # list of points we haven't processed in each read result
-                # (or None, if all have been processed)
-                unprocessed = [r[i] if i > -1 else None for i, r in zip(curi, reads)]
-
-                # list of values corresponding to timestamp t
-                values = [None if p is None or p[0] != timestamp else p[1]
-                        for p in unprocessed]
-
-                #print('curi {}, values {}, unprocessed: {}'.format(curi, values, unprocessed))
-
-                # add to combined results
-                combined.append([timestamp, values])
-
-                # update curi based on which values were processed
-                for i, v in enumerate(values):
-                    if v is not None:
-                        curi[i] -= 1
-
-            if sort == 'desc':
-                reverse = True
-            else:
-                reverse = False
-
-            combined.sort(key=itemgetter(0), reverse=reverse)
-            return combined
+        return list(self._mergereads(reads, sort))
 
     def readmult(self,
                  cik,
@@ -1019,76 +1383,491 @@ class ExoRPC():
                  starttime=None,
                  endtime=None,
                  selection='all',
-                 chunksize=212,
-                 progress=lambda count: None):
+                 chunksize=None,
+                 progress=lambda count: None,
+                 shards=1,
+                 usecache=True):
         '''Generates multiple rids and returns combined timestamped data like this:
                [12314, [1, 77, 'a']
                [12315, [2, 78, None]]
            Where 1, 77, 'a' is the order rids were passed, and None represents
-           no data in that dataport for that timestamp.'''
+           no data in that dataport for that timestamp. limit is the
+           maximum number of points to read from each rid.
+
+           Reads of more than chunksize points are made in chunks of that
+           many points per rid, paging through each rid separately so
+           that rids with little data don't cost extra requests for the
+           others. If chunksize is None, chunks are sized by
+           self.readsizer to keep each request fast.
+
+           If shards is greater than 1, long reads are split into
+           consecutive time windows and up to shards windows are read at
+           once (see _readmult_sharded). Rows are generated in the same
+           order either way.
+
+           If self.cache is set, points are served from it and only
+           the time ranges it doesn't have are read (see _readmult_cached).
+           Pass usecache=False to skip the cache.'''
+        if usecache and self.cache is not None and selection == 'all':
+            for r in self._readmult_cached(cik,
+                                           rids,
+                                           limit,
+                                           sort,
+                                           starttime,
+                                           endtime,
+                                           chunksize,
+                                           progress,
+                                           shards):
+                yield r
+            return
+
         options = self._readoptions(limit, sort, starttime, endtime, selection)
 
+        # readsizer counts points across all rids read in a request
+        pointskey = ('read', 'points')
+        nrids = max(1, len(rids))
+        def nextchunksize():
+            return max(1, self.readsizer.size(
+                pointskey, initial=212 * nrids) // nrids)
+        adaptive = chunksize is None
+        if adaptive:
+            chunksize = nextchunksize()
+
+        if shards > 1 and limit > chunksize and selection == 'all':
+            for r in self._readmult_sharded(
+                    cik,
+                    rids,
+                    limit,
+                    sort,
+                    starttime,
+                    endtime,
+                    None if adaptive else chunksize,
+                    shards,
+                    progress):
+                yield r
+            return
+
         count = [0]
-        def _read(cik, rids, options):
-            responses = self._exomult(cik, [['read', rid, options] for rid in rids])
+        def _read(cik, rids, optionslist):
+            if len(rids) == 0:
+                return []
+            perf = []
+            responses = self._raise_for_deferred(self._send_commands(
+                cik,
+                [['read', rid, o] for rid, o in zip(rids, optionslist)],
+                perf=perf))
+            if adaptive and len(perf) > 0:
+                nbytes = [p['bytes'] for p in perf]
+                self.readsizer.observe(
+                    pointskey,
+                    sum([o['limit'] for o in optionslist]),
+                    sum([p['seconds'] for p in perf]),
+                    None if None in nbytes else sum(nbytes))
             count[0] += len(responses)
             progress(count[0])
-            return self._combinereads(responses, options['sort'])
+            return responses
 
-        if limit <= chunksize :
-            for r in _read(cik, rids, options):
+        # downsampled reads pick points from the whole window, so
+        # they can't be split into chunks
+        if limit <= chunksize or selection != 'all':
+            for r in self._mergereads(_read(cik, rids, [options] * len(rids)), sort):
                 yield r
-        else:
-            # Read chunks by limit.
-            maxLimit = options['limit']
-            if 'sort' in options and options['sort'] == 'desc':
-                # descending
-                if 'endtime' in options:
-                    nextStart = options['endtime']
+            return
+
+        # each rid has a cursor with points read but not yet merged,
+        # the number of points left to read, and options for its next read
+        cursors = [{'rid': rid,
+                    'points': deque(),
+                    'remaining': limit,
+                    'options': options.copy(),
+                    'done': False} for rid in rids]
+
+        def refill(cursor):
+            '''Read the next chunk for cursor. Other cursors that are
+            running low are read in the same request.'''
+            pagesize = nextchunksize() if adaptive else chunksize
+            batch = [cursor] + [c for c in cursors
+                                if c is not cursor and not c['done'] and
+                                len(c['points']) < pagesize // 2]
+            if adaptive:
+                # rids not in this request leave more points for the others
+                pagesize = max(1, pagesize * nrids // len(batch))
+            optionslist = []
+            for c in batch:
+                o = c['options'].copy()
+                o['limit'] = min(pagesize, c['remaining'])
+                optionslist.append(o)
+            responses = _read(cik, [c['rid'] for c in batch], optionslist)
+            for c, o, points in zip(batch, optionslist, responses):
+                c['points'].extend(points)
+                c['remaining'] -= len(points)
+                if len(points) < o['limit'] or c['remaining'] <= 0:
+                    c['done'] = True
+                elif sort == 'desc':
+                    c['options']['endtime'] = points[-1][0] - 1
                 else:
-                    nextStart = ExoUtilities.parse_ts_tuple(datetime.now().timetuple())
-                while True:
-                    chunkOpt = options.copy()
-                    chunkOpt['endtime'] = nextStart
-                    chunkOpt['limit'] = chunksize
-                    res = _read(cik, rids, chunkOpt);
-                    if len(res) == 0:
-                        break
-                    maxLimit = maxLimit - len(res)
-                    if maxLimit <= 0:
-                        break;
-                    #save oldest
-                    nextStart = res[-1][0] - 1
-                    for r in res:
-                        yield r
+                    c['options']['starttime'] = points[-1][0] + 1
+
+        def stream(cursor):
+            while True:
+                while cursor['points']:
+                    yield cursor['points'].popleft()
+                if cursor['done']:
+                    return
+                refill(cursor)
+
+        for r in self._mergereads([stream(c) for c in cursors], sort):
+            yield r
+
+    def _readmult_sharded(self,
+                          cik,
+                          rids,
+                          limit,
+                          sort,
+                          starttime,
+                          endtime,
+                          chunksize,
+                          shards,
+                          progress,
+                          windowpoints=100000,
+                          probepoints=1000):
+        '''Generate readmult rows by reading consecutive time windows
+           between starttime and endtime (or the first and last points, if
+           they're None), with up to shards windows being read at once.
+           Each window is read with its own per-rid cursors, and windows
+           are generated in sort order. Window length is adjusted as
+           windows are read so each has around windowpoints rows, which
+           keeps memory use bounded since only a few windows are held at
+           a time. The first windows are sized from the first probepoints
+           points of each rid, read along with the range. Each rid is
+           limited to limit points, as in readmult.'''
+        bounds = {'selection': 'all'}
+        if starttime is not None:
+            bounds['starttime'] = int(starttime)
+        if endtime is not None:
+            bounds['endtime'] = int(endtime)
+        # find the first and last points in range, reading the first
+        # probepoints points in sort order to see how dense the data is
+        ends = []
+        for s, n in [(sort, probepoints), ('asc' if sort == 'desc' else 'desc', 1)]:
+            o = bounds.copy()
+            o.update({'limit': n, 'sort': s})
+            ends += [['read', rid, o] for rid in rids]
+        responses = self._exomult_batched(cik, ends)
+        points = [p for r in responses for p in r]
+        if len(points) == 0:
+            return
+        first = min([p[0] for p in points])
+        last = max([p[0] for p in points])
+
+        # points per second, over all rids
+        rate = 0.0
+        for probe in responses[:len(rids)]:
+            if len(probe) == probepoints:
+                rate += float(len(probe)) / (abs(probe[-1][0] - probe[0][0]) + 1)
+            else:
+                rate += float(len(probe)) / (last - first + 1)
+        # seconds per window, updated as windows are read
+        span = (last - first + 1) // (shards * 4)
+        if rate > 0:
+            span = min(span, int(windowpoints / rate))
+        state = {'span': max(1, span)}
+
+        def windows():
+            '''Generate (start, end) windows in sort order. Windows are
+            taken by _imap_parallel as workers become free, so each one's
+            length is based on the windows read so far.'''
+            if sort == 'desc':
+                end = last
+                while end >= first:
+                    start = max(first, end - state['span'] + 1)
+                    yield start, end
+                    end = start - 1
+            else:
+                start = first
+                while start <= last:
+                    end = min(last, start + state['span'] - 1)
+                    yield start, end
+                    start = end + 1
+
+        def readwindow(window):
+            rows = list(self.readmult(cik,
+                                      rids,
+                                      limit,
+                                      sort=sort,
+                                      starttime=window[0],
+                                      endtime=window[1],
+                                      chunksize=chunksize,
+                                      usecache=False))
+            # at most double the span, in case sparse data is followed
+            # by dense data
+            seconds = window[1] - window[0] + 1
+            if len(rows) > 0:
+                state['span'] = max(1, min(seconds * 2, seconds * windowpoints // len(rows)))
             else:
-                # ascending
-                if 'starttime' in options:
-                    nextStart = options['starttime']
+                state['span'] = seconds * 2
+            return rows
+
+        counts = [0] * len(rids)
+        for i, rows in enumerate(self._imap_parallel(readwindow, windows(), workers=shards)):
+            progress(i + 1)
+            for t, values in rows:
+                # later windows don't know how many points earlier
+                # windows had, so apply the per-rid limit here
+                keep = False
+                for j, v in enumerate(values):
+                    if v is not None:
+                        if counts[j] < limit:
+                            counts[j] += 1
+                            keep = True
+                        else:
+                            values[j] = None
+                if keep:
+                    yield [t, values]
+            if min(counts) >= limit:
+                break
+
+    def _readmult_cached(self,
+                         cik,
+                         rids,
+                         limit,
+                         sort,
+                         starttime,
+                         endtime,
+                         chunksize,
+                         progress,
+                         shards):
+        '''Generate readmult rows from self.cache, first reading whatever
+           the cache is missing. For each rid, the time range is walked in
+           sort order: complete ranges in the cache count toward limit, and
+           gaps are read from the platform until limit points are found.
+           Gaps are recorded as complete up to the last point read (or
+           the whole gap, if it had fewer points than asked for), but never
+           past self.cache_settle seconds before now, so the next read
+           picks up points that arrive late. Points written by others
+           further in the past than that aren't seen until the series is
+           cleared from the cache. Up to self.parallel rids are filled at
+           once.'''
+        now = int(time.time())
+        settled = now - self.cache_settle
+        start = 0 if starttime is None else int(starttime)
+        end = now if endtime is None else int(endtime)
+        cache = self.cache
+        series = [cache.series(cik, rid) for rid in rids]
+
+        def addpage(sid, page, edge):
+            '''Add page, points read in sort order after edge, to the cache
+            and return the edge for the next page.'''
+            if sort == 'desc':
+                cache.add(sid, page, page[-1][0], edge)
+                return page[-1][0] - 1
+            cache.add(sid, page, edge, page[-1][0])
+            return page[-1][0] + 1
+
+        def fill(i):
+            rid = rids[i]
+            need = limit
+            segments = cache.segments(series[i], start, end)
+            if sort == 'desc':
+                segments.reverse()
+            for s, e, complete in segments:
+                if need <= 0:
+                    break
+                if complete:
+                    need -= cache.count(series[i], s, e)
+                    continue
+                # add the gap to the cache a page at a time, so long
+                # series aren't held in memory
+                edge = e if sort == 'desc' else s
+                page = []
+                count = 0
+                last = None
+                for t, v in self.readmult(
+                        cik,
+                        [rid],
+                        need,
+                        sort=sort,
+                        starttime=s,
+                        endtime=e,
+                        chunksize=chunksize,
+                        shards=shards,
+                        usecache=False):
+                    page.append([t, v[0]])
+                    if len(page) >= self.cache_pagesize:
+                        edge = addpage(series[i], page, edge)
+                        page = []
+                    count += 1
+                    last = t
+                if len(page) > 0:
+                    edge = addpage(series[i], page, edge)
+                need -= count
+                if need > 0 or count == 0:
+                    # read everything in the gap
+                    if sort == 'desc':
+                        cache.add(series[i], [], s, edge)
+                    else:
+                        cache.add(series[i], [], edge, e)
+                    s, e = s, min(e, settled)
+                elif sort == 'desc':
+                    s, e = last, min(e, settled)
                 else:
-                    nextStart = 0
-                while True:
-                    chunkOpt = options.copy()
-                    chunkOpt['starttime'] = nextStart
-                    chunkOpt['limit'] = chunksize
-                    res = _read(cik, rids, chunkOpt);
-                    if len(res) == 0:
-                        break
-                    maxLimit = maxLimit - len(res)
-                    if maxLimit <= 0:
-                        break
-                    #save oldest
-                    nextStart = res[-1][0] + 1
-                    for r in res:
-                        yield r
+                    s, e = s, min(last, settled)
+                cache.complete(series[i], s, e)
+            return i
+
+        for i in self._imap_parallel(fill, list(range(len(rids)))):
+            progress(i + 1)
+        cache.evict(keep=series)
+
+        for r in self._mergereads(
+                [cache.points(sid, start, end, sort, limit) for sid in series],
+                sort):
+            yield r
 
     def write(self, cik, rid, value):
         isok, response = self.exo.write(cik, rid, value)
         self._raise_for_response(isok, response)
+        if self.cache is not None:
+            # the platform's clock may put the point in a complete range
+            self.cache.clear(cik, rid)
+
+    def _write_batched(self, writes):
+        '''Write values to many resources. writes is a list of (auth, rid,
+        value). Writes with the same auth are sent several to a request
+        (see _exobatch), in order, and up to self.parallel requests are
+        sent at once, whatever their auth. Returns a response for each
+        write, in the order of writes, in the form {'status': 'ok'} or
+        {'status': <error>}, so one failed write doesn't stop the others.
+        If a whole request fails, each of its writes gets the error.'''
+        if self.cache is not None:
+            # the platform's clock may put points in complete ranges
+            for auth, rid, value in writes:
+                self.cache.clear(auth, rid)
+        commands = [(auth, {'commands': [['write', rid, value, {}]]})
+                    for auth, rid, value in writes]
+        return [r[0] for r in self._exobatch_auths(commands, chunkerrors=True)]
 
     def record(self, cik, rid, entries):
         isok, response = self.exo.record(cik, rid, entries, {})
         self._raise_for_response_record(isok, response)
+        if self.cache is not None:
+            # points may have gone into ranges the cache has as complete
+            self.cache.clear(cik, rid)
+
+    def _record_batched(self, cik, series, chunksize=1000, progress=None):
+        '''Record points to resources of the client cik. series is an
+        iterable of (rid, points), where points is an iterable of
+        [timestamp, value]. Points are split into record calls of up to
+        chunksize points, and the calls are sent several to a request
+        (see _exobatch), with up to self.parallel requests at once. If
+        progress is passed, it's called with the rid and the number of
+        points recorded to it so far after each window of requests is
+        sent.'''
+        window = []
+        counts = defaultdict(int)
+        def send():
+            for responses in self._exobatch(cik, window):
+                status = responses[0]['status']
+                self._raise_for_response_record(
+                    status == 'ok', responses[0].get('result', status))
+            for commandset in window:
+                rid = commandset['commands'][0][1]
+                counts[rid] += len(commandset['commands'][0][2])
+                if progress is not None:
+                    progress(rid, counts[rid])
+            del window[:]
+        for rid, points in series:
+            if self.cache is not None:
+                # points may go into ranges the cache has as complete
+                self.cache.clear(cik, rid)
+            entries = []
+            for point in points:
+                entries.append(point)
+                if len(entries) == chunksize:
+                    window.append({'commands': [['record', rid, entries, {}]]})
+                    entries = []
+                    # keep enough calls on hand for every connection to
+                    # send a full batch
+                    if len(window) >= 2 * self.parallel * self.batchsizer.size(('record',)):
+                        send()
+            if len(entries) > 0:
+                window.append({'commands': [['record', rid, entries, {}]]})
+        if len(window) > 0:
+            send()
+
+    def _record_rows(self, cik, rids, rows, chunksize, progress=None):
+        '''Record rows to resources of the client cik. rows is an iterable
+        of (timestamp, values), where values has a value (or None to skip
+        it) for each of rids. Rows are taken chunksize at a time, and each
+        chunk is recorded in one request with a record call for each rid.
+        Up to self.parallel requests are sent at once, so rows are read
+        as earlier ones are recorded rather than all up front. If progress
+        is passed, it's called with the number of rows recorded so far
+        after each chunk. Returns the number of rows recorded.'''
+        return self._record_columns([(cik, rid) for rid in rids], rows, chunksize, progress)
+
+    def _record_columns(self, columns, rows, chunksize, progress=None):
+        '''Like _record_rows, but each column has its own auth. columns is
+        a list of (auth, rid), and each chunk of rows is recorded with a
+        request per auth, sent concurrently with up to self.parallel
+        requests at once.'''
+        def authkey(a):
+            if isinstance(a, string_types):
+                a = {'cik': a}
+            return json.dumps(a, sort_keys=True)
+        # column indexes for each auth
+        groups = OrderedDict()
+        for i, (auth, rid) in enumerate(columns):
+            groups.setdefault(authkey(auth), (auth, []))[1].append(i)
+        if self.cache is not None:
+            # points may go into ranges the cache has as complete
+            for auth, rid in columns:
+                self.cache.clear(auth, rid)
+        def requests():
+            '''Generate (rows, auth, commands) for each request. rows is the
+            number of rows in a chunk, for its last request, and 0 for the
+            others.'''
+            def chunk(entries, count):
+                commandsets = []
+                for auth, indexes in groups.values():
+                    commands = [['record', columns[i][1], entries[i], {}]
+                                for i in indexes if len(entries[i]) > 0]
+                    if len(commands) > 0:
+                        commandsets.append([0, auth, commands])
+                if len(commandsets) == 0:
+                    commandsets.append([0, None, []])
+                commandsets[-1][0] = count
+                return commandsets
+            entries = [[] for column in columns]
+            count = 0
+            for timestamp, values in rows:
+                for column, value in zip(entries, values):
+                    if value is not None:
+                        column.append([timestamp, value])
+                count += 1
+                if count >= chunksize:
+                    for r in chunk(entries, count):
+                        yield r
+                    entries = [[] for column in columns]
+                    count = 0
+            if count > 0:
+                for r in chunk(entries, count):
+                    yield r
+        def send(request):
+            count, auth, commands = request
+            if len(commands) > 0:
+                for response in self._exomult_with_responses(auth, commands):
+                    status = response['status']
+                    self._raise_for_response_record(
+                        status == 'ok', response.get('result', status))
+            return count
+        total = 0
+        for count in self._imap_parallel(send, requests()):
+            if count > 0:
+                total += count
+                if progress is not None:
+                    progress(total)
+        return total
 
     def create(self, cik, type, desc, name=None):
         if name is not None:
@@ -1214,7 +1993,7 @@ class ExoRPC():
         if read_options is not None:
             # add reads for readable resource types
             read_commands += [['read', rid, read_options] for rid in readable_rids]
-        responses = self._exomult(auth, info_commands + read_commands)
+        responses = self._exomult_batched(auth, info_commands + read_commands)
         # From the return values make a dict of dicts
         # use ordered dicts in case someone cares about order in the output
         response_index = 0
@@ -1265,7 +2044,10 @@ class ExoRPC():
         if len(options) > 0:
             args.append(options)
         cmds = [['flush', rid] + args for rid in rids]
-        self._exomult(cik, cmds)
+        self._exomult_batched(cik, cmds)
+        if self.cache is not None:
+            for rid in rids:
+                self.cache.clear(cik, rid)
 
     def usage(self, cik, rid, metrics, start, end):
         for metric in metrics:
@@ -1601,128 +2383,174 @@ class ExoRPC():
                 '' if len(opt) == 0 else '({0})'.format(', '.join(
                     ['{0}: {1}'.format(k, v) for k, v in iteritems(opt)]))))
 
-    def tree(self, auth, aliases=None, cli_args={}, spacer='', level=0, info_options={}):
-        '''Print a tree of entities in OneP'''
+    def tree(self, auth, cli_args={}, lookahead=500):
+        '''Print a tree of entities in OneP. The tree is printed as it's
+        fetched. Nodes are fetched about lookahead at a time, choosing the
+        clients whose children are printed soonest, so output starts after
+        a few requests and the number of requests depends on the depth of
+        the tree more than the number of clients.'''
         max_level = int(cli_args['--level'])
-        # print root node
-        isroot = len(spacer) == 0
         if isinstance(auth, six.string_types):
             cik = auth
         elif type(auth) is dict:
             cik = auth['cik']
-            rid = auth['client_id']
         else:
             raise ExoException('Unexpected auth type ' + str(type(auth)))
-        if isroot:
-            # usage and counts are slow, so omit them if we don't need them
-            exclude = ['usage', 'counts']
-            info_options = self.make_info_options(exclude=exclude)
-            rid, info = self._exomult(auth,
-                                      [['lookup', 'alias', ''],
-                                       ['info', {'alias': ''}, info_options]])
-            # info doesn't contain key
-            info['key'] = cik
-            aliases = info['aliases']
-            root_aliases = 'see parent'
-            self._print_node(rid,
-                             info,
-                             root_aliases,
-                             cli_args,
-                             spacer,
-                             True)
-            if max_level == 0:
-                return
-            level += 1
+        # usage and counts are slow, so omit them if we don't need them
+        exclude = ['usage', 'counts']
+        should_read = '--values' in cli_args and cli_args['--values']
+        fetchargs = {'options': self.make_info_options(exclude=exclude),
+                     'level': None if max_level == -1 else max_level,
+                     'listing_options': {'owned': True},
+                     'shares': True,
+                     'read_options': {'limit': 1} if should_read else None}
+
+        root = self._treenode_root(auth)
+        self._fetch_treenodes(auth, [root], **fetchargs)
 
+        # print root node
+        info = root['tree']['info']
+        if 'error' in info and len(info) == 1:
+            self._raise_for_response(False, info['error']['status'])
+        # info doesn't contain key
+        info['key'] = cik
+        self._print_node(root['tree']['rid'],
+                         info,
+                         'see parent',
+                         cli_args,
+                         '',
+                         True)
+        if max_level == 0:
+            return
+
+        # clients whose children haven't been fetched, by the position
+        # they're printed in
+        waiting = []
+        counter = itertools.count()
+        def arrange(node, position):
+            '''Put the fetched children of node in the order they're printed,
+            and queue theirs to be fetched.'''
+            node['printorder'] = self._tree_order(node['childnodes'])
+            for i, child in enumerate(node['printorder']):
+                child['childnodes'] = self._treenode_children(child)
+                if len(child['childnodes']) == 0:
+                    child['printorder'] = []
+                else:
+                    heapq.heappush(waiting, (position + (i,), six.next(counter), child))
+        def fetch():
+            '''Fetch the children of the clients printed soonest'''
+            batch = []
+            owners = []
+            while len(waiting) > 0 and len(batch) < lookahead:
+                position, _, owner = heapq.heappop(waiting)
+                owners.append((position, owner))
+                batch.extend(owner['childnodes'])
+            self._fetch_treenodes(auth, batch, **fetchargs)
+            for position, owner in owners:
+                arrange(owner, position)
+
+        root['childnodes'] = self._treenode_children(root)
+        heapq.heappush(waiting, ((), six.next(counter), root))
+        for _ in self._print_tree_children(root, cli_args, ''):
+            fetch()
+
+    def _tree_order(self, nodes):
+        '''Sort nodes for printing in a tree: nodes whose info couldn't be
+        read, then by type and name.'''
         types = ['dataport', 'datarule', 'dispatch', 'client']
-        try:
-            should_read = '--values' in cli_args and cli_args['--values']
-
-            #_listing_with_info() output looks like this
-            # {'client': {'<rid0>':<info0>, '<rid1>':<info1>},
-            #  'dataport': {'<rid2>':<info2>}}
-            listing = self._listing_with_info(auth,
-                types=types,
-                info_options=info_options,
-                listing_options={'owned': True},
-                read_options={'limit': 1} if should_read else None)
-            # mark as not shares
-            for t in types:
-                for info in listing[t].values():
-                    info['listing_option'] = 'owned'
-            # add annotations for shares
-            listing_shares = self._listing_with_info(auth,
-                types=types,
-                info_options=info_options,
-                listing_options={'activated': True},
-                read_options={'limit': 1} if should_read else None)
-            # mark as shares and add to listing
-            for t in types:
-                for rid, info in listing_shares[t].items():
-                    info['listing_option'] = 'activated'
-                    # skip any shares that are in the same listing
-                    if rid not in listing[t]:
-                        listing[t][rid] = info
-        except pyonep.exceptions.OnePlatformException:
-            self._print_tree_line(
-                spacer +
-                "  └─listing for {0} failed. info['basic']['status'] is \
-probably not valid.".format(cik))
-        except ExoRPC.RPCException as ex:
-            if str(ex).startswith('locked ('):
+        failed = []
+        bytype = OrderedDict([(t, []) for t in types])
+        for node in nodes:
+            info = node['tree']['info']
+            if 'error' in info and len(info) == 1:
+                failed.append(node)
+            else:
+                bytype[node['tree']['type']].append(node)
+        ordered = failed
+        for t in types:
+            ordered.extend(sorted(bytype[t], key=lambda n: n['tree']['info']['description']['name'].lower()))
+        return ordered
+
+    def _print_tree_children(self, node, cli_args, spacer):
+        '''Print the children of a client node, and recursively their
+        children, below the node's line in the tree. This is a generator
+        that yields whenever it needs children that haven't been fetched
+        yet (see tree).'''
+        while 'printorder' not in node:
+            yield node
+        tree = node['tree']
+        auth = node['clientauth']
+        children = tree.get('children')
+        if children is None:
+            return
+        aliases = tree['info'].get('aliases', {})
+        if type(children) is not list:
+            status = children['error']['status']
+            if status == 'locked':
                 self._print_tree_line(
                     spacer +
                     "  └─{0} is locked".format(json.dumps(auth)))
             else:
                 self._print_tree_line(
                     spacer +
-                    "  └─RPC error for {0}: {1}".format(json.dumps(auth), ex))
-        else:
-            # calculate the maximum length of various things for all children,
-            # so we can make things line up in the output.
-            maxlen = {}
-            namelengths = [len(l[1]['description']['name']) for typ in types for l in iteritems(listing[typ])]
-            maxlen['name'] = 0 if len(namelengths) == 0 else max(namelengths)
-
-            typelengths = [len(l[1]['basic']['type']) for typ in types for l in iteritems(listing[typ])]
-            maxlen['type'] = 0 if len(typelengths) == 0 else max(typelengths)
-
-            formatlengths = [len(l[1]['description']['format'])
-                             for typ in types
-                             for l in iteritems(listing[typ])
-                             if 'format' in l[1]['description']]
-            maxlen['format'] = 0 if len(formatlengths) == 0 else max(formatlengths)
-
-            # print everything
-            for t_idx, t in enumerate(types):
-                typelisting = OrderedDict(sorted(iteritems(listing[t]), key=lambda x: x[1]['description']['name'].lower()))
-                islast_nonempty_type = (t_idx == len(types) - 1) or (all(len(listing[typ]) == 0 for typ in types[t_idx + 1:]))
-                for rid_idx, rid in enumerate(typelisting):
-                    info = typelisting[rid]
-                    islastoftype = rid_idx == len(typelisting) - 1
-                    islast = islast_nonempty_type and islastoftype
-                    if platform.system() != 'Windows':
-                        if islast:
-                            child_spacer = spacer + '    '
-                            own_spacer   = spacer + '  └─'
-                        else:
-                            child_spacer = spacer + '  │ '
-                            own_spacer   = spacer + '  ├─'
-                    else:
-                        # Windows executable
-                        if islast:
-                            child_spacer = spacer + '    '
-                            own_spacer   = spacer + '  +-'
-                        else:
-                            child_spacer = spacer + '  | '
-                            own_spacer   = spacer + '  +-'
+                    "  └─RPC error for {0}: {1}".format(json.dumps(auth), status))
+            return
 
-                    if t == 'client':
-                        self._print_node(rid, info, aliases, cli_args, own_spacer, islast, maxlen)
-                        if max_level == -1 or level < max_level:
-                            self.tree({'cik': cik, 'client_id': rid}, info['aliases'], cli_args, child_spacer, level=level + 1, info_options=info_options)
-                    else:
-                        self._print_node(rid, info, aliases, cli_args, own_spacer, islast, maxlen, values=info['read'] if 'read' in info else None)
+        printed = []
+        for child in node['printorder']:
+            info = child['tree']['info']
+            if 'error' in info and len(info) == 1:
+                self._print_tree_line(
+                    spacer +
+                    "  ├─RPC error for {0}: {1}".format(child['tree']['rid'], info['error']['status']))
+                continue
+            info['listing_option'] = 'activated' if child['tree'].get('share', False) else 'owned'
+            if type(child['tree'].get('read')) is list:
+                info['read'] = child['tree']['read']
+            printed.append(child)
+        infos = [c['tree']['info'] for c in printed]
+
+        # calculate the maximum length of various things for all children,
+        # so we can make things line up in the output.
+        maxlen = {}
+        namelengths = [len(info['description']['name']) for info in infos]
+        maxlen['name'] = 0 if len(namelengths) == 0 else max(namelengths)
+
+        typelengths = [len(info['basic']['type']) for info in infos]
+        maxlen['type'] = 0 if len(typelengths) == 0 else max(typelengths)
+
+        formatlengths = [len(info['description']['format'])
+                         for info in infos
+                         if 'format' in info['description']]
+        maxlen['format'] = 0 if len(formatlengths) == 0 else max(formatlengths)
+
+        # print everything
+        for child_idx, child in enumerate(printed):
+            rid = child['tree']['rid']
+            info = child['tree']['info']
+            islast = child_idx == len(printed) - 1
+            if platform.system() != 'Windows':
+                if islast:
+                    child_spacer = spacer + '    '
+                    own_spacer   = spacer + '  └─'
+                else:
+                    child_spacer = spacer + '  │ '
+                    own_spacer   = spacer + '  ├─'
+            else:
+                # Windows executable
+                if islast:
+                    child_spacer = spacer + '    '
+                    own_spacer   = spacer + '  +-'
+                else:
+                    child_spacer = spacer + '  | '
+                    own_spacer   = spacer + '  +-'
+
+            if child['tree']['type'] == 'client':
+                self._print_node(rid, info, aliases, cli_args, own_spacer, islast, maxlen)
+                for waiting in self._print_tree_children(child, cli_args, child_spacer):
+                    yield waiting
+            else:
+                self._print_node(rid, info, aliases, cli_args, own_spacer, islast, maxlen, values=info['read'] if 'read' in info else None)
 
     def drop_all_children(self, cik):
         isok, listing = self.exo.listing(
@@ -2041,34 +2869,77 @@ probably not valid.".format(cik))
         return self.record(cik, rid, tvalues)
 
 
-    def _create_from_infotree(self, parentcik, infotree):
-        '''Create a copy of infotree under parentcik'''
-        info_to_copy = infotree['info']
-        typ = info_to_copy['basic']['type']
-        rid = self.create(parentcik, typ, info_to_copy['description'])
-        if 'comments' in info_to_copy and len(info_to_copy['comments']) > 0:
-            commands = [['comment', rid, c[0], c[1]] for c in info_to_copy['comments']]
-            self._exomult(parentcik, commands)
+    def _create_tree(self, parentcik, infotree, ridmap=None):
+        '''Create a copy of infotree under parentcik, batching calls for
+        the children of each client (see _create_children). If ridmap is
+        passed, it is filled in with {rid: (owner cik, new rid)} for each
+        resource in infotree. Returns the RID of the copy and its CIK, or
+        None if it's not a client.'''
+        info = infotree['info']
+        typ = info['basic']['type']
+        # description may be a resourcenode.PartView
+        rid = self.create(parentcik, typ, dict(info['description']))
+        if ridmap is not None:
+            ridmap[infotree['rid']] = (parentcik, rid)
+        commands = [['comment', rid, c[0], c[1]] for c in info.get('comments', [])]
         if typ == 'client':
-            # look up new CIK
-            cik = self.info(parentcik, rid)['key']
-            children = infotree['info']['children']
-            aliases_to_create = {}
-            for child in children:
-                newrid, _ = self._create_from_infotree(cik, child)
-                if child['rid'] in infotree['info']['aliases']:
-                    aliases_to_create[newrid] = infotree['info']['aliases'][child['rid']]
-
-            # add aliases in one request
-            self._exomult(
-                cik,
-                list(itertools.chain(*[[['map', r, alias]
-                                     for alias in aliases_to_create[r]]
-                                     for r in aliases_to_create])))
+            # look up new CIK along with the comments
+            commands.append(['info', rid, {'key': True}])
+        responses = self._exomult_batched(parentcik, commands)
+        if typ == 'client':
+            cik = responses[-1]['key']
+            self._create_children(cik, infotree, ridmap=ridmap)
             return rid, cik
         else:
             return rid, None
 
+    def _create_children(self, cik, infotree, ridmap=None):
+        '''Create copies of the descendants of client infotree under cik,
+        a level of the tree at a time. The children of each client at a
+        level are created together (see _create_client_children), and up
+        to self.parallel clients are done at once, so the number of
+        rounds of requests depends on the depth of the tree rather than
+        the number of resources.'''
+        level = [(cik, infotree)]
+        while len(level) > 0:
+            nextlevel = []
+            for clients in self._imap_parallel(
+                    lambda c: self._create_client_children(c[0], c[1], ridmap=ridmap),
+                    level):
+                nextlevel.extend(clients)
+            level = nextlevel
+
+    def _create_client_children(self, cik, infotree, ridmap=None):
+        '''Create copies of the children of client infotree under cik.
+        All the children are created in one request, and then their
+        comments and aliases are added and the CIKs of child clients are
+        looked up in another. (Requests may be split if they're large, see
+        _exobatch.) Returns a list of (cik, infotree) for the new child
+        clients.'''
+        children = infotree['info'].get('children', [])
+        if len(children) == 0:
+            return []
+        rids = self._exomult_batched(
+            cik,
+            [['create', c['info']['basic']['type'], dict(c['info']['description'])]
+             for c in children])
+        aliases = infotree['info'].get('aliases', {})
+        commands = []
+        keyindex = {}
+        for i, (child, rid) in enumerate(zip(children, rids)):
+            if ridmap is not None:
+                ridmap[child['rid']] = (cik, rid)
+            for visibility, text in child['info'].get('comments', []):
+                commands.append(['comment', rid, visibility, text])
+            for alias in aliases.get(child['rid'], []):
+                commands.append(['map', rid, alias])
+            if child['info']['basic']['type'] == 'client':
+                keyindex[i] = len(commands)
+                commands.append(['info', rid, {'key': True}])
+        responses = self._exomult_batched(cik, commands)
+        return [(responses[keyindex[i]]['key'], child)
+                for i, child in enumerate(children) if i in keyindex]
+
     def _counttypes(self, infotree, counts=defaultdict(int)):
         '''Return a dictionary with the count of each type of resource in the
         tree. For example, {'client': 2, 'dataport': 1, 'dispatch':1}'''
@@ -2092,10 +2963,19 @@ probably not valid.".format(cik))
                     raise ExoException('''Copy does not yet support resources that use the "subscribe" feature, as RID {0} in the source client does.\nIf you're just copying a device into the same portal consider using the clone command.'''.format(rid));
                 return rid
             destcik = exoconfig.lookup_shortcut(destcik)
-            infotree = self._infotree(cik, options={}, nodeidfn=check_for_unsupported)
+            infotree = self._infotree(cik, options={}, nodeidfn=check_for_unsupported, compact=True)
+
+        self._check_room(destcik, infotree)
 
+        cprid, cpcik = self._create_tree(destcik, infotree)
+
+        return cprid, cpcik
+
+    def _check_room(self, destcik, infotree):
+        '''Raise ExoException if creating a copy of infotree under
+        destcik would go over destcik's limits.'''
         # check counts
-        counts = self._counttypes(infotree)
+        counts = self._counttypes(infotree, counts=defaultdict(int))
         destinfo = self.info(destcik, options={'description': True, 'counts': True})
 
         noroom = ''
@@ -2111,10 +2991,6 @@ probably not valid.".format(cik))
         if len(noroom) > 0:
             raise ExoException('Copy would violate parent limits:\n{0}'.format(noroom))
 
-        cprid, cpcik = self._create_from_infotree(destcik, infotree)
-
-        return cprid, cpcik
-
     def _remove(self, dct, keypaths):
         '''Remove keypaths from dictionary.
         >>> ex = ExoRPC()
@@ -2161,100 +3037,282 @@ probably not valid.".format(cik))
 
     def _infotree_fast(self,
                        auth,
+                       rid=None,
+                       restype='client',
                        nodeidfn=lambda rid, info: rid,
                        options={},
                        level=None,
                        listing_options={},
-                       visit=lambda tree, level, parentRID: None):
+                       visit=lambda tree, level, parentRID: None,
+                       errorfn=lambda auth, msg: None,
+                       raiseExceptions=False,
+                       shares=False,
+                       read_options=None):
         '''Faster version of _infotree that uses the new listing and breadth
-           first traversal to reduce the number of RPC calls.'''
-        rootnode = {'tree': {'type': 'client'}, 'par': None}
-        #if rid is not None:
-        #    # nodeidfn here?
-        #    rootnode['tree']['rid'] = rid
-        level = 0
-        gen = [rootnode]
-        nextgen = []
-        def callback(commandset, result):
-            # add the commandset results to the node
-            node = commandset['node']
-            tree = node['tree']
-            info_idx = 0
-            listing_idx = 1
-            lookup_idx = 2
-
-            # set node info
-            if result[info_idx]['status'] != 'ok':
-                tree['info'] = {'error': result[info_idx]}
-            else:
-                tree['info'] = result[info_idx]['result']
-
-            # lookup is only done for the root node when rid is not known
-            if len(result) == lookup_idx + 1:
-                # this would not be OK
-                assert(result[lookup_idx]['status'] == 'ok')
-                tree['rid'] = result[lookup_idx]['result']
-
-            tree['rid'] = nodeidfn(tree['rid'], tree['info'])
+           first traversal to reduce the number of RPC calls. Each level of
+           the tree is fetched with one batch of info and listing calls for
+           all of its nodes (see _exobatch), so the number of round trips
+           depends on the depth of the tree rather than the number of
+           clients. Returns a tree of nodes like this:
+
+               {'rid': <rid>, 'type': 'client', 'info': <info>,
+                'children': [{'rid': <rid>, 'type': 'dataport', 'info': <info>},
+                             ...]}
+
+             rid, restype - the resource to start from, if not auth's client
+             nodeidfn - called with the RID and info of each node, returns
+                        the value to put in the node's 'rid'
+             level - number of levels of children to get, or None for all
+             visit - called with each node, its level and the 'rid' of its
+                     parent once the node's info and children are set
+             errorfn - called with the auth for a client and an error
+                       message if its listing fails
+             raiseExceptions - if True, raise ExoRPC.RPCException when info
+                       fails for any node. Otherwise the node's info is set
+                       to {'error': <response>}. If a listing fails, the
+                       node's children are set to {'error': <response>}.
+             shares - also list resources each client has activated shares
+                      of. Their nodes have 'share': True, and their info is
+                      read with the auth of the client that activated them.
+                      Shared clients' children are listed with the auth
+                      {'cik': <cik>, 'client_id': <rid>}, and the
+                      resources under them are read with the auth of
+                      their parent.
+             read_options - if not None, read each dataport and datarule
+                      with these options and put the points in the node's
+                      'read' (or {'error': <response>} if the read fails).'''
+        rootnode = None
+        for node in self._iter_treenodes(auth,
+                                         rid=rid,
+                                         restype=restype,
+                                         nodeidfn=nodeidfn,
+                                         options=options,
+                                         level=level,
+                                         listing_options=listing_options,
+                                         errorfn=errorfn,
+                                         raiseExceptions=raiseExceptions,
+                                         shares=shares,
+                                         read_options=read_options):
+            if rootnode is None:
+                rootnode = node
+            visit(node['tree'], node['depth'], node['par'])
+        return rootnode['tree']
 
-            # set node listing
-            if tree['type'] == 'client':
-                if result[listing_idx]['status'] != 'ok':
-                    tree['children'] = {'error': result[listing_idx]}
-                else:
-                    children = []
-                    r = result[listing_idx]['result']
-                    for typ in r.keys():
-                        for rid in r[typ]:
-                            children.append({'rid': rid, 'type': typ})
-                    tree['children'] = children
+    def _iter_treenodes(self, auth, rid=None, restype='client', lookahead=None, **fetchargs):
+        '''Generate the nodes of a tree breadth first as they're fetched
+        (see _treenode_root and _fetch_treenodes), starting with the root.
+        Nodes are fetched lookahead at a time, or a level at a time if
+        lookahead is None, so the first nodes are generated after a few
+        requests. A node's children are fetched after it's generated, so
+        stopping early skips the rest of the tree. fetchargs are as for
+        _fetch_treenodes.'''
+        queue = deque([self._treenode_root(auth, rid=rid, restype=restype)])
+        while len(queue) > 0:
+            count = len(queue) if lookahead is None else min(lookahead, len(queue))
+            batch = [queue.popleft() for _ in range(count)]
+            self._fetch_treenodes(auth, batch, **fetchargs)
+            for node in batch:
+                yield node
+                queue.extend(self._treenode_children(node))
+
+    def _treenode_root(self, auth, rid=None, restype='client'):
+        '''Make the node to start a _fetch_treenodes walk from. Nodes wrap
+        the node in the returned tree (node['tree']) with what's needed to
+        fetch it.'''
+        if isinstance(auth, string_types):
+            cikauth = {'cik': auth}
+        else:
+            cikauth = auth
+        node = {'tree': {'type': restype},
+                'par': None,
+                'realrid': rid,
+                'depth': 0,
+                # auth to fetch the node with, if not the walk's auth
+                'auth': None,
+                # auth that acts as this node, if it's a client
+                'clientauth': auth if rid is None else {'cik': cikauth['cik'], 'client_id': rid},
+                'cik': cikauth['cik']}
+        if rid is not None:
+            node['tree']['rid'] = rid
+        return node
+
+    def _treenode_children(self, node):
+        '''Make nodes for the children of a node that has been fetched by
+        _fetch_treenodes.'''
+        children = node['tree'].get('children')
+        if type(children) is not list:
+            return []
+        # resources under a share aren't owned by the walk's client, so
+        # they're read with the auth of their parent
+        inshare = node['auth'] is not None or node['tree'].get('share', False)
+        nodes = []
+        for child_tree in children:
+            share = child_tree.get('share', False)
+            nodes.append({'tree': child_tree,
+                          'par': node['tree']['rid'],
+                          'realrid': child_tree['rid'],
+                          'depth': node['depth'] + 1,
+                          'auth': node['clientauth'] if share or inshare else None,
+                          'clientauth': {'cik': node['cik'], 'client_id': child_tree['rid']},
+                          'cik': node['cik']})
+        return nodes
+
+    def _fetch_treenodes(self,
+                         auth,
+                         nodes,
+                         nodeidfn=lambda rid, info: rid,
+                         options={},
+                         level=None,
+                         listing_options={},
+                         errorfn=lambda auth, msg: None,
+                         raiseExceptions=False,
+                         shares=False,
+                         read_options=None):
+        '''Get info, listings and reads for nodes (from _treenode_root or
+        _treenode_children) in one batch of requests (see _exobatch), and
+        fill in their trees. Parameters are as for _infotree_fast.'''
+        types = ['client', 'dataport', 'datarule', 'dispatch']
+
+        def lists(node):
+            return (node['tree']['type'] == 'client' and
+                    (level is None or node['depth'] < level))
+
+        def listings(rid):
+            commands = [['listing', types, listing_options, rid]]
+            if shares:
+                commands.append(['listing', types, {'activated': True}, rid])
+            return commands
 
         def commandset(node):
-            rid = node['tree']['rid'] if 'rid' in node['tree'] else {'alias': ''}
-            types = ['client', 'dataport', 'datarule', 'dispatch']
-            commands = [
-                ['info', rid, options]
-            ]
-            if node['tree']['type'] == 'client':
-                commands.append(['listing', types, listing_options, rid])
-            if 'rid' not in node['tree']:
+            tree = node['tree']
+            rid = node['realrid'] if node['realrid'] is not None else {'alias': ''}
+            commands = [['info', rid, options]]
+            node['listings'] = []
+            if lists(node) and not tree.get('share', False):
+                listingcommands = listings(rid)
+                node['listings'] = list(range(len(commands), len(commands) + len(listingcommands)))
+                commands.extend(listingcommands)
+            if read_options is not None and tree['type'] in ['dataport', 'datarule']:
+                node['readidx'] = len(commands)
+                commands.append(['read', rid, read_options])
+            if node['realrid'] is None:
+                node['lookupidx'] = len(commands)
                 commands.append(['lookup', 'aliased', ''])
-            return {'node': node,
-                    'commands': commands,
-                    'callback': callback}
-
-        while len(gen) > 0:
-            # set up commandsets with callbacks that modify the nodes in gen
-            commands = map(commandset, gen)
+            return {'commands': commands}
 
-            # get info, listing, etc. for each node at this level
-            results = self._exobatch(auth, commands)
-            results = list(results)
-
-            # now the nodes are populated, so build up the next generation
-            for node in gen:
-                visit(node['tree'], level, node['par']);
-                if 'children' in node['tree']:
-                    for child_tree in node['tree']['children']:
-                        nextgen.append({'tree': child_tree, 'par': node['tree']['rid']})
-
-            gen = nextgen
-            nextgen = []
-            level += 1
+        def populate(node, result):
+            tree = node['tree']
+            # lookup is only done for the root node when rid is not known
+            if 'lookupidx' in node:
+                r = result[node['lookupidx']]
+                if r['status'] == 'ok':
+                    node['realrid'] = tree['rid'] = r['result']
+                else:
+                    # only when the whole request failed, in which case
+                    # info failed too
+                    tree.setdefault('rid', None)
 
-        return rootnode['tree']
+            # set node info
+            if result[0]['status'] != 'ok':
+                if raiseExceptions:
+                    self._raise_for_response(False, result[0]['status'],
+                                             call=['info', node['realrid'], options])
+                tree['info'] = {'error': result[0]}
+            else:
+                tree['info'] = result[0]['result']
+
+            if tree['rid'] is not None:
+                tree['rid'] = nodeidfn(tree['rid'], tree['info'])
+
+            if 'readidx' in node:
+                r = result[node['readidx']]
+                tree['read'] = r['result'] if r['status'] == 'ok' else {'error': r}
+
+            if len(node['listings']) > 0:
+                populate_children(node, [result[i] for i in node['listings']])
+
+        def populate_children(node, result):
+            '''Set node's children from the results of listings()'''
+            children = []
+            seen = set()
+            for i, r in enumerate(result):
+                if r['status'] != 'ok':
+                    errorfn(node['clientauth'], str(r['status']))
+                    children = {'error': r}
+                    break
+                for typ in r['result'].keys():
+                    for childrid in r['result'][typ]:
+                        if childrid in seen:
+                            # skip shares of resources this client owns
+                            continue
+                        seen.add(childrid)
+                        child = {'rid': childrid, 'type': typ}
+                        if i > 0:
+                            child['share'] = True
+                        children.append(child)
+            node['tree']['children'] = children
+
+        # shares are fetched with the auth of the client that activated
+        # them, and shared clients are listed with their own auth, since
+        # the walk's client doesn't own them. Requests for all auths are
+        # sent together.
+        commands = []
+        for node in nodes:
+            callauth = auth if node['auth'] is None else node['auth']
+            commands.append((callauth, commandset(node)))
+        shared = [node for node in nodes if lists(node) and node['tree'].get('share', False)]
+        for node in shared:
+            commands.append((node['clientauth'], {'commands': listings({'alias': ''})}))
+        # unless raising, a request that fails only fails the nodes in it
+        results = self._exobatch_auths(commands, chunkerrors=not raiseExceptions)
+        for node, result in zip(nodes, results):
+            populate(node, result)
+        for node, result in zip(shared, results[len(nodes):]):
+            populate_children(node, result)
+
+    def _nestedtree(self, tree, auth, level=None, raiseExceptions=True):
+        '''Convert a tree from _infotree_fast to the nested shape returned by
+        _infotree, where each node is {'rid': <rid>, 'info': <info>} and a
+        node's children are in info['children'], sorted by RID. Nodes whose
+        info failed become {'exception': ex, 'auth': auth, 'rid': rid}.'''
+        if isinstance(auth, string_types):
+            auth = {'cik': auth}
+        def nest(node, depth):
+            info = node['info']
+            if 'error' in info and len(info) == 1:
+                ex = ExoRPC.RPCException(str(info['error']['status']))
+                if raiseExceptions:
+                    raise ex
+                return {'exception': ex, 'auth': auth, 'rid': node['rid']}
+            if isinstance(info, resourcenode.ResourceNode):
+                # compacted by _infotree
+                nested = info
+            else:
+                nested = {'rid': node['rid'], 'info': info}
+            if level is not None and depth >= level:
+                return nested
+            children = node.get('children', [])
+            if type(children) is not list:
+                # listing failed, which has been passed to errorfn
+                children = []
+            children = [nest(c, depth + 1) for c in children]
+            children.sort(key=lambda x: x['rid'] if 'rid' in x else '')
+            nested['info']['children'] = children
+            return nested
+        return nest(tree, 0)
 
     def _infotree(self,
                   auth,
                   rid=None,
                   restype='client',
-                  resinfo=None,
                   nodeidfn=lambda rid,
                   info: rid,
                   options={},
                   level=None,
                   raiseExceptions=True,
-                  errorfn=lambda auth, msg: None):
+                  errorfn=lambda auth, msg: None,
+                  compact=False,
+                  useindex=False):
         '''Get all info for a cik and its children in a nested dict.
         The basic unit is {'rid': '<rid>', 'info': <info-with-children>},
         where <info-with-children> is just the info object for that node
@@ -2274,79 +3332,145 @@ probably not valid.".format(cik))
                                                 'children': {} } }] } }
 
            As it's building this nested dict, it calls nodeidfn with the rid and info
-           (w/o children) for each node.
-        '''
-        try:
-            # handle passing cik for auth
-            if isinstance(auth, string_types):
-                auth = {'cik': auth}
-            types = ['dataport', 'datarule', 'dispatch', 'client']
-            listing = {}
-            norid = rid is None
-            if norid:
-                rid, resinfo = self._exomult(auth, [
-                    ['lookup', 'aliased', ''],
-                    ['info', {'alias': ''}, options]])
-            else:
-                if resinfo is None:
-                    resinfo = self._exomult(auth, [['info', rid, options]])[0]
+           (w/o children) for each node, in breadth first order.
 
-            myid = nodeidfn(rid, resinfo)
+           The tree is fetched by _infotree_fast, a level at a time.
 
-            if level is not None and level <= 0:
-                return {'rid': myid, 'info': resinfo}
+           If compact is True, nodes are resourcenode.ResourceNodes, which
+           work like the dicts above but take much less memory. Each node
+           is compacted as its level is fetched. Changes to values nested
+           in their info are lost (see resourcenode).
 
-            if restype == 'client':
-                if not norid:
-                    # key is only available to owner (not the resource itself)
-                    auth = {
-                        'cik': auth['cik'],
-                        'client_id': rid
-                    }
-                try:
-                    listing = self._exomult(auth, [['listing', types, {}, {'alias': ''}]])[0]
-                except ExoRPC.RPCException as e:
-                    listing = dict([(t, []) for t in types])
-                    errorfn(auth, str(e))
-                rids = [rid for rid in list(itertools.chain.from_iterable([listing[t] for t in types]))]
-                # break info calls into chunks to prevent timeout
-                chunksize = 20
-                def chunks(l, n):
-                    '''Yield successive n-sized chunks from l.'''
-                    for i in range(0, len(l), n):
-                        yield l[i:i+n]
-                infos = []
-                for ridchunk in chunks(rids, chunksize):
-                    infos += self._exomult(auth, [['info', rid, options] for rid in ridchunk])
-            else:
-                listing = []
-
-            resinfo['children'] = []
-            infoIndex = 0
-            for typ in types:
-                if typ in listing:
-                    ridlist = listing[typ]
-                    for childrid in ridlist:
-                        tr = self._infotree(auth,
-                                            rid=childrid,
-                                            restype=typ,
-                                            resinfo=infos[infoIndex],
-                                            nodeidfn=nodeidfn,
-                                            options=options,
-                                            level=None if level is None else level-1,
-                                            raiseExceptions=raiseExceptions,
-                                            errorfn=errorfn)
-                        infoIndex += 1
-                        resinfo['children'].append(tr)
-            resinfo['children'].sort(key=lambda x: x['rid'] if 'rid' in x else '')
-
-            return {'rid': myid, 'info': resinfo}
+           If useindex is True and --useindex was passed, the tree is read
+           from the local index instead (see _refresh_index). Its info has
+           the options the index stores (see metaindex.MetaIndex).
+        '''
+        if useindex and self.useindex and rid is None:
+            tree = self._metaindex().infotree(auth, nodeidfn=nodeidfn, level=level)
+            if tree is None:
+                raise ExoException(
+                    'Client is not in the local index ({0}). Run exo index refresh <cik> to add it.'.format(
+                        self._metaindex().path))
+            return tree
+        def visit(node, depth, parentRID):
+            info = node['info']
+            if compact and not ('error' in info and len(info) == 1):
+                node['info'] = resourcenode.ResourceNode(node['rid'], info)
+        try:
+            tree = self._infotree_fast(
+                auth,
+                rid=rid,
+                restype=restype,
+                nodeidfn=nodeidfn,
+                options=options,
+                level=level,
+                visit=visit,
+                errorfn=errorfn,
+                raiseExceptions=raiseExceptions)
+            return self._nestedtree(tree, auth, level=level, raiseExceptions=raiseExceptions)
         except Exception as ex:
             if raiseExceptions:
                 six.reraise(Exception, ex)
             else:
                 return {'exception': ex, 'auth': auth, 'rid': rid}
 
+    def _metaindex(self):
+        '''Return the local MetaIndex in self.indexdir, opening it the
+        first time'''
+        if self._index is None:
+            self._index = metaindex.MetaIndex(self.indexdir)
+        return self._index
+
+    def _refresh_index(self, auth, full=False):
+        '''Bring auth's tree in the local index up to date. The modified
+        times of the clients in the index are checked in one batch of
+        requests, and then only the clients that are new or have changed
+        are listed again, a level at a time (see _fetch_treenodes). Clients
+        that haven't changed keep their children from the index. With full,
+        or if auth isn't in the index yet, every client is listed. Returns
+        the number of clients listed.'''
+        index = self._metaindex()
+        options = metaindex.MetaIndex.options
+        root = index.root(auth)
+        stored = {} if full or root is None else index.clients(auth)
+
+        # check which clients have changed
+        changed = set()
+        if len(stored) > 0:
+            rids = list(stored.keys())
+            results = self._exobatch(
+                auth,
+                [{'commands': [['info', {'alias': ''} if rid == root[0] else rid, {'basic': True}]]}
+                 for rid in rids])
+            for rid, result in zip(rids, results):
+                if (result[0]['status'] != 'ok' or
+                        result[0]['result']['basic'].get('modified') != stored[rid]):
+                    changed.add(rid)
+
+        def makenode(rid, parent):
+            node = self._treenode_root(auth, rid=rid)
+            node['par'] = parent
+            return node
+
+        if root is None or root[0] in changed or len(stored) == 0:
+            nodes = [makenode(None, None)]
+            unchanged = []
+        else:
+            nodes = []
+            unchanged = [root[0]]
+        listed = 0
+        while len(nodes) > 0 or len(unchanged) > 0:
+            # look for changes below clients that haven't changed
+            while len(unchanged) > 0:
+                rid = unchanged.pop()
+                for childrid, typ in index.children(auth, rid):
+                    if typ != 'client':
+                        continue
+                    if childrid in changed:
+                        nodes.append(makenode(childrid, rid))
+                    else:
+                        unchanged.append(childrid)
+            if len(nodes) == 0:
+                break
+
+            # list changed clients, and then get info for their children
+            self._fetch_treenodes(auth, nodes, options=options, level=1)
+            childnodes = [self._treenode_children(node) for node in nodes]
+            self._fetch_treenodes(auth, list(itertools.chain(*childnodes)),
+                                  options=options, level=1)
+            listed += len(nodes)
+
+            nextnodes = []
+            for node, children in zip(nodes, childnodes):
+                tree = node['tree']
+                info = tree['info']
+                if 'error' in info and len(info) == 1:
+                    if node['par'] is None:
+                        self._raise_for_response(False, info['error']['status'])
+                    # removed since the index was checked
+                    continue
+                if type(tree.get('children')) is not list:
+                    # listing failed, so keep the children in the index
+                    index.update(auth, tree['rid'], info, parent=node['par'])
+                    continue
+                pairs = []
+                for child in children:
+                    childrid = child['tree']['rid']
+                    childinfo = child['tree']['info']
+                    if 'error' in childinfo and len(childinfo) == 1:
+                        pairs.append((childrid, None))
+                        continue
+                    pairs.append((childrid, childinfo))
+                    if child['tree']['type'] == 'client':
+                        if (childrid not in stored or childrid in changed or
+                                stored[childrid] != childinfo['basic'].get('modified')):
+                            nextnodes.append(makenode(childrid, tree['rid']))
+                        else:
+                            unchanged.append(childrid)
+                index.update(auth, tree['rid'], info, children=pairs, parent=node['par'])
+            nodes = nextnodes
+        return listed
+
     def _difffilter(self, difflines):
         d = difflines
 
@@ -2736,6 +3860,94 @@ def followSeries(er, cik, rid, timeout_milliseconds, printFirst=True):
             yield(None, None)
 
 
+def batch_cmd(er, pop, rpckey, args):
+    '''Batch command. Runs each command with cmd, sharing er and pop (the
+    connections for rpckey) and the config with commands that have the same
+    options.'''
+    global batch_reuse
+    global exoconfig
+    if batch_reuse is not None:
+        raise ExoException("batch can't run another batch")
+    # sys.argv is the global options, batch, and then args['<args>']
+    argv = sys.argv
+    options = argv[1:len(argv) - len(args['<args>']) - 1]
+    def prompted(readline):
+        '''Generate lines from a terminal, prompting for each'''
+        while True:
+            sys.stderr.write('exo> ')
+            sys.stderr.flush()
+            line = readline()
+            if line == '':
+                sys.stderr.write('\n')
+                return
+            yield line
+    commandfile = None
+    if args['<file>'] is None:
+        if hasattr(sys.stdin, 'isatty') and sys.stdin.isatty():
+            lines = prompted(sys.stdin.readline)
+        else:
+            lines = iter(sys.stdin.readline, '')
+        commandstdin = StringIO()
+    else:
+        commandfile = open(args['<file>'])
+        lines = commandfile
+        commandstdin = sys.stdin
+    saved = {'stdin': sys.stdin, 'stdout': sys.stdout, 'stderr': sys.stderr,
+             'exoconfig': exoconfig}
+    batch_reuse = {'config': {args['--config']: exoconfig},
+                   'rpc': {rpckey: (er, pop)}}
+    failed = 0
+    try:
+        for n, line in enumerate(lines):
+            if sys.version_info < (3, 0) and isinstance(line, str):
+                line = line.decode('utf-8')
+            line = line.strip()
+            if len(line) == 0 or line.startswith('#'):
+                continue
+            try:
+                words = shlex.split(line)
+            except ValueError as ex:
+                words = None
+                sys.stderr.write('Line {0}: {1}\n'.format(n + 1, ex))
+            if words is not None and len(words) > 0 and words[0] == 'exo':
+                words = words[1:]
+            if words is None:
+                exitcode = 1
+            else:
+                if commandfile is None:
+                    commandstdin.seek(0)
+                try:
+                    try:
+                        exitcode = cmd(argv=[argv[0]] + options + words, stdin=commandstdin)
+                    finally:
+                        sys.stdin = saved['stdin']
+                        sys.stdout = saved['stdout']
+                        sys.stderr = saved['stderr']
+                        sys.argv = argv
+                        exoconfig = saved['exoconfig']
+                except Exception as ex:
+                    # cmd handles the errors commands raise on purpose, so
+                    # this is e.g. a network error or a bug in a plugin.
+                    # Report it like any other failed command.
+                    if args['--debug']:
+                        import traceback
+                        traceback.print_exc()
+                    sys.stderr.write('Line {0}: {1}: {2}\n'.format(
+                        n + 1, type(ex).__name__, ex))
+                    exitcode = 1
+            print('# line {0} exit {1}'.format(n + 1, exitcode))
+            sys.stdout.flush()
+            if exitcode != 0:
+                failed += 1
+                if args['--stoponerror']:
+                    break
+    finally:
+        batch_reuse = None
+        if commandfile is not None:
+            commandfile.close()
+    return 1 if failed > 0 else 0
+
+
 def read_cmd(er, cik, rids, args):
     '''Read command'''
     if len(rids) == 0:
@@ -2779,10 +3991,24 @@ def read_cmd(er, cik, rids, args):
         'tz': tz
     }
 
-    lw = serieswriter.SeriesWriter(headers, options)
-    if headertype is not None:
-        # write headers
-        lw.write_headers()
+    if fmt == 'columnar':
+        if args['--output'] is None:
+            raise ExoException('--format=columnar requires --output=<dir>')
+        if args['--follow']:
+            raise ExoException('--follow does not support --format=columnar')
+        # value array types come from resource formats
+        infos = er._exomult_batched(
+            cik, [['info', r, {'description': True}] for r in rids])
+        columns = [{'name': h,
+                    'rid': r if isinstance(r, six.string_types) else json.dumps(r),
+                    'format': i['description'].get('format')}
+                   for h, r, i in zip(headers[1:], rids, infos)]
+        lw = columnar.ColumnarWriter(args['--output'], columns, nullable=len(rids) > 1)
+    else:
+        lw = serieswriter.SeriesWriter(headers, options)
+        if headertype is not None:
+            # write headers
+            lw.write_headers()
 
     timeout_milliseconds = 3000
     if args['--follow']:
@@ -2800,7 +4026,15 @@ def read_cmd(er, cik, rids, args):
             if ts is not None and v is not None:
                 lw.write(ts, v)
     else:
-        chunksize = int(args['--chunksize'])
+        chunksize = args['--chunksize']
+        if chunksize is not None:
+            chunksize = int(chunksize)
+        try:
+            shards = int(args['--shards'])
+        except ValueError:
+            shards = 0
+        if shards < 1:
+            raise ExoException('--shards must be a positive integer')
         result = er.readmult(cik,
                              rids,
                              sort=args['--sort'],
@@ -2808,9 +4042,12 @@ def read_cmd(er, cik, rids, args):
                              endtime=end,
                              limit=limit,
                              selection=args['--selection'],
-                             chunksize=chunksize)
+                             chunksize=chunksize,
+                             shards=shards)
         for t, v in result:
             lw.write(t, v)
+        if fmt == 'columnar':
+            lw.close()
 
 
 def plain_print(arg):
@@ -2833,24 +4070,60 @@ def handle_args(cmd, args):
     if port is None:
         port = DEFAULT_PORT_HTTPS if use_https else DEFAULT_PORT
 
-    er = ExoRPC(
-        host=args['--host'],
-        port=port,
-        https=use_https,
-        httptimeout=args['--httptimeout'],
-        logrequests=args['--clearcache'],
-        user_agent=args['--useragent'],
-        curldebug=args['--curl'])
-
-    pop = provision.Provision(
-        host=args['--host'],
-        manage_by_cik=False,
-        port=port,
-        verbose=True,
-        httptimeout=args['--httptimeout'],
-        https=use_https,
-        raise_api_exceptions=True,
-        curldebug=args['--curl'])
+    parallel = args['--parallel']
+    try:
+        parallel = 1 if parallel is None else int(parallel)
+    except ValueError:
+        parallel = 0
+    if parallel < 1:
+        raise ExoException('--parallel must be a positive integer')
+
+    # commands in a batch with the same connection options share
+    # connections. Not with --clearcache, which goes through all the
+    # requests an ExoRPC has made.
+    rpckey = (args['--host'], port, use_https, args['--httptimeout'],
+              args['--useragent'], args['--curl'], parallel,
+              args['--cachedir'], args['--cachesize'], args['--indexdir'],
+              args['--useindex'])
+    reuse = batch_reuse is not None and not args['--clearcache']
+    if reuse and rpckey in batch_reuse['rpc']:
+        er, pop = batch_reuse['rpc'][rpckey]
+    else:
+        cache = None
+        if args['--cachedir'] is not None:
+            cachesize = args['--cachesize']
+            try:
+                cachesize = 500 if cachesize is None else float(cachesize)
+            except ValueError:
+                raise ExoException('--cachesize must be a number of MB')
+            cache = seriescache.SeriesCache(
+                args['--cachedir'],
+                maxbytes=int(cachesize * 1024 * 1024))
+
+        er = ExoRPC(
+            host=args['--host'],
+            port=port,
+            https=use_https,
+            httptimeout=args['--httptimeout'],
+            logrequests=args['--clearcache'],
+            user_agent=args['--useragent'],
+            curldebug=args['--curl'],
+            parallel=parallel,
+            cache=cache,
+            indexdir=args['--indexdir'],
+            useindex=args['--useindex'])
+
+        pop = provision.Provision(
+            host=args['--host'],
+            manage_by_cik=False,
+            port=port,
+            verbose=True,
+            httptimeout=args['--httptimeout'],
+            https=use_https,
+            raise_api_exceptions=True,
+            curldebug=args['--curl'])
+        if reuse:
+            batch_reuse['rpc'][rpckey] = (er, pop)
 
     if cmd in ['ip', 'data']:
         if args['--https'] is True or args['--port'] is not None or args['--debughttp'] is True or args['--curl'] is True:
@@ -2914,7 +4187,43 @@ def handle_args(cmd, args):
         if cmd == 'read':
             read_cmd(er, cik, rids, args)
         elif cmd == 'write':
-            if args['-']:
+            if args['--set'] or args['--ndjson']:
+                writes = []
+                if args['--ndjson']:
+                    for n, line in enumerate(sys.stdin):
+                        if line.strip() == '':
+                            continue
+                        try:
+                            item = json.loads(line)
+                            if 'cik' in item:
+                                auth = exoconfig.lookup_shortcut(item['cik'])
+                            elif cik is not None:
+                                auth = cik
+                            else:
+                                raise ExoException('no "cik", and no <cik> was passed')
+                            rid = item['rid']
+                            value = item['value']
+                        except (ValueError, KeyError, TypeError, ExoException) as ex:
+                            raise ExoException('Bad JSON line {0}: {1}'.format(n + 1, ex))
+                        if not isinstance(value, six.string_types):
+                            value = json.dumps(value)
+                        writes.append((auth, rid_or_alias(rid, auth), value))
+                else:
+                    for pair in args['--set']:
+                        rid, eq, value = pair.partition('=')
+                        if eq == '':
+                            raise ExoException('--set must be <rid>=<value>: ' + pair)
+                        writes.append((cik, rid_or_alias(rid, cik), value))
+                responses = er._write_batched(writes)
+                failed = 0
+                for (auth, rid, value), r in zip(writes, responses):
+                    if r['status'] != 'ok':
+                        failed += 1
+                        sys.stderr.write('Failed to write to {0} of {1}: {2}\n'.format(
+                            json.dumps(rid), json.dumps(auth), r['status']))
+                if failed > 0:
+                    raise ExoException('{0} of {1} writes failed'.format(failed, len(writes)))
+            elif args['-']:
                 val = sys.stdin.read()
                 # remove extra newline
                 if val[-1] == '\n':
@@ -2924,7 +4233,39 @@ def handle_args(cmd, args):
                 er.write(cik, rids[0], args['--value'])
         elif cmd == 'record':
             interval = args['--interval']
-            if interval is None:
+            if args['--fanout']:
+                if sys.version_info < (3, 0):
+                    reader = csv.reader(sys.stdin, encoding='utf-8')
+                else:
+                    reader = csv.reader(sys.stdin)
+                try:
+                    header = six.next(reader)
+                except StopIteration:
+                    raise ExoException('--fanout needs a header row')
+                columns = []
+                for i, spec in enumerate(header[1:]):
+                    # the client part may be <cik>:c<client-rid>
+                    match = re.match('^([^:]+(?::c[^:]+)?):(.+)$', spec.strip())
+                    if match is None:
+                        raise ExoException(
+                            'Header of column {0} is not <cik>:<rid>: {1}'.format(i + 2, spec))
+                    auth = exoconfig.lookup_shortcut(match.group(1))
+                    columns.append((auth, rid_or_alias(match.group(2), auth)))
+                if len(columns) == 0:
+                    raise ExoException('--fanout needs a column to record')
+                chunksize = int(args['--chunksize'])
+                if chunksize < 1:
+                    raise ExoException('--chunksize must be a positive integer')
+                tsparser = timestamps.TimestampParser()
+                def fanoutrows():
+                    for row in reader:
+                        if len(row) == 0:
+                            continue
+                        ts = tsparser.parse(row[0])
+                        values = row[1:len(columns) + 1]
+                        yield ts, [None if v == '' else v for v in values]
+                er._record_columns(columns, fanoutrows(), chunksize)
+            elif interval is None:
                 # split timestamp, value
                 if not args['--value']:
                     headers = ['timestamp'] + [x for x in range(0,len(rids))]
@@ -2932,31 +4273,20 @@ def handle_args(cmd, args):
                         dr = csv.DictReader(sys.stdin, headers, encoding='utf-8')
                     else:
                         dr = csv.DictReader(sys.stdin, headers)
-                    rows = list(dr)
-                    chunkcnt=0
-                    entries=[[] for x in range(0,len(rids))]
-                    for row in rows:
-                        s = row['timestamp']
-                        if s is not None and re.match('^[-+]?[0-9]+$', s) is not None:
-                            ts = int(s)
-                        else:
-                            ts = ExoUtilities.parse_ts(s)
-                        for column in range(0,len(rids)):
-                            value = row[column]
+                    chunksize = int(args['--chunksize'])
+                    if chunksize < 1:
+                        raise ExoException('--chunksize must be a positive integer')
+                    # detects the timestamp format once for the whole CSV
+                    tsparser = timestamps.TimestampParser()
+                    def rows():
+                        # rows are parsed as they're read from stdin, so
+                        # the CSV doesn't need to fit in memory
+                        for row in dr:
+                            ts = tsparser.parse(row['timestamp'])
                             # TODO: How to deal with an empty cell should be a cmdline option.
                             # skip it, or record a default number or empty string?
-                            if value is not None:
-                                entries[column].append([ts, value])
-                        chunkcnt += 1
-                        if chunkcnt > int(args['--chunksize']):
-                            for idx in range(0,len(rids)):
-                                er.record(cik, rids[idx], entries[idx])
-                            chunkcnt = 0
-                            entries=[[] for x in range(0,len(rids))]
-
-                    for idx in range(0,len(rids)):
-                        if len(entries[idx]) > 0:
-                            er.record(cik, rids[idx], entries[idx])
+                            yield ts, [row[column] for column in range(0,len(rids))]
+                    er._record_rows(cik, rids, rows(), chunksize)
 
                 else:
                     entries = []
@@ -3269,6 +4599,8 @@ def handle_args(cmd, args):
                 typ = 'client'
                 code = args['--client']
             er.deactivate(cik, typ, code)
+        elif cmd == 'batch':
+            return batch_cmd(er, pop, rpckey, args)
         elif cmd == 'clone':
             options = {}
             if args['--share'] is not None:
@@ -3326,7 +4658,7 @@ def handle_args(cmd, args):
             return exitcode
     finally:
         if args['--clearcache']:
-            for req in er.exo.loggedrequests():
+            for req in er.loggedrequests():
                 procs = [c['procedure'] for c in req['calls']]
                 # if operation will invalidate the Portals cache...
                 if len([p for p in procs if p in ExoPortals.writeprocs]) > 0:
@@ -3390,7 +4722,12 @@ def cmd(argv=None, stdin=None, stdout=None, stderr=None):
     global exoconfig
     if args['--config'] is None:
         args['--config'] = os.environ.get('EXO_CONFIG', '~/.exoline')
-    exoconfig = ExoConfig(args['--config'])
+    if batch_reuse is None:
+        exoconfig = ExoConfig(args['--config'])
+    else:
+        if args['--config'] not in batch_reuse['config']:
+            batch_reuse['config'][args['--config']] = ExoConfig(args['--config'])
+        exoconfig = batch_reuse['config'][args['--config']]
 
     # get command args
     cmd = args['<command>']
@@ -92,7 +92,7 @@ class ExoConfig:
         Command line always overrides ENV which always overrides configfile.
         '''
         # This ONLY works with options that take a parameter.
-        toMingle = ['host', 'port', 'httptimeout', 'useragent', 'portals', 'vendortoken', 'vendor']
+        toMingle = ['host', 'port', 'httptimeout', 'useragent', 'portals', 'vendortoken', 'vendor', 'parallel', 'cachedir', 'cachesize']
 
         # Precedence: ARGV then ENV then CFG
 
@@ -0,0 +1,186 @@
+'''Attribute index for the find command.
+
+find matches resources on any key in their info, including keys nested in
+dicts (e.g. status in basic) and keys in JSON meta strings. FindIndex
+flattens each resource to (key, value) pairs once, parsing meta as it
+goes, and stores them by key:
+
+    columns[key] = {<node id>: [<value>, ...]}
+
+Queries are lists of (key, operator, value) conditions, all of which must
+match. = and the numeric < and > are answered from per-key indexes that
+are built the first time a key is queried (a dict from value to node ids,
+and node ids sorted by value), starting with the condition that matches
+fewest nodes. ^ (not equal) conditions are checked against the nodes that
+are left. A resource matches a condition if any of its values for the key
+does.
+'''
+from __future__ import unicode_literals
+import re
+import json
+import bisect
+from collections import deque
+
+import six
+
+
+def parse_matches(matches):
+    '''Parse a find --match string like "status=activated,model^x" into a
+    list of (key, operator, value) conditions, one per key.'''
+    conditions = []
+    for matchval in matches.split(','):
+        for key, op, value in re.findall(r"(.*?)([=<>^])(.*)", matchval):
+            conditions = [c for c in conditions if c[0] != key]
+            conditions.append((key, op, value))
+    return conditions
+
+
+def flatten(node):
+    '''Generate (key, value) for each key in node, in nested dicts in
+    node, and in dicts encoded as JSON in meta strings.'''
+    for k, v in six.iteritems(node):
+        if type(v) is dict:
+            for kv in flatten(v):
+                yield kv
+        yield k, v
+        if k == 'meta' and isinstance(v, six.string_types):
+            try:
+                meta = json.loads(v)
+            except ValueError:
+                continue
+            if type(meta) is dict:
+                for kv in flatten(meta):
+                    yield kv
+
+
+def _number(v):
+    '''Return v as a float, or None if it isn't a number'''
+    try:
+        f = float(v)
+    except (TypeError, ValueError):
+        return None
+    # NaN doesn't compare
+    return f if f == f else None
+
+
+class FindIndex(object):
+    '''Flattened attributes of a set of resources, for find queries.'''
+
+    def __init__(self):
+        self.rids = []
+        self.columns = {}
+        # indexes built as keys are queried
+        self._equal = {}
+        self._sorted = {}
+
+    @classmethod
+    def from_tree(cls, tree):
+        '''Make an index of the descendants of tree, a tree from
+        ExoRPC._infotree_fast or ExoRPC._infotree. Nodes are added breadth
+        first.'''
+        index = cls()
+        queue = deque([tree])
+        while len(queue) > 0:
+            node = queue.popleft()
+            if 'children' in node:
+                children = node['children']
+            else:
+                children = node['info'].get('children', [])
+            if type(children) is not list:
+                continue
+            for child in children:
+                index.add(child['rid'], flatten(child))
+                queue.append(child)
+        return index
+
+    def add(self, rid, attributes):
+        '''Add a resource with attributes, an iterable of (key, value).
+        Returns its node id.'''
+        nodeid = len(self.rids)
+        self.rids.append(rid)
+        for k, v in attributes:
+            self.columns.setdefault(k, {}).setdefault(nodeid, []).append(v)
+            self._equal.pop(k, None)
+            self._sorted.pop(k, None)
+        return nodeid
+
+    def values(self, nodeid, key):
+        '''Return the values of key for a node, in the order they were
+        added.'''
+        return self.columns.get(key, {}).get(nodeid, [])
+
+    def _equalindex(self, key):
+        if key not in self._equal:
+            index = {}
+            for nodeid, values in six.iteritems(self.columns.get(key, {})):
+                for v in values:
+                    try:
+                        index.setdefault(v, set()).add(nodeid)
+                    except TypeError:
+                        # unhashable values (lists, dicts) don't equal a
+                        # query value
+                        pass
+            self._equal[key] = index
+        return self._equal[key]
+
+    def _sortedindex(self, key):
+        if key not in self._sorted:
+            entries = []
+            for nodeid, values in six.iteritems(self.columns.get(key, {})):
+                for v in values:
+                    f = _number(v)
+                    if f is not None:
+                        entries.append((f, nodeid))
+            entries.sort()
+            self._sorted[key] = ([f for f, _ in entries], [nodeid for _, nodeid in entries])
+        return self._sorted[key]
+
+    def _lookup(self, condition):
+        '''Return the set of node ids matching an =, < or > condition'''
+        key, op, value = condition
+        if op == '=':
+            return self._equalindex(key).get(value, set())
+        f = _number(value)
+        if f is None:
+            return set()
+        numbers, nodeids = self._sortedindex(key)
+        if op == '>':
+            return set(nodeids[bisect.bisect_right(numbers, f):])
+        else:
+            return set(nodeids[:bisect.bisect_left(numbers, f)])
+
+    def _notequal(self, nodeid, condition):
+        key, _, value = condition
+        return any(v != value for v in self.values(nodeid, key))
+
+    def plan(self, conditions):
+        '''Return the order conditions are applied in, as a list of
+        (condition, number of matching nodes or None). Lookups from
+        indexes go first, fewest matches first. ^ conditions are checked
+        against each node that's left, so their count is None.'''
+        return [(c, None if found is None else len(found))
+                for found, c in self._plan(conditions)]
+
+    def _plan(self, conditions):
+        lookups = [(self._lookup(c), c) for c in conditions if c[1] in '=<>']
+        lookups.sort(key=lambda l: len(l[0]))
+        return lookups + [(None, c) for c in conditions if c[1] == '^']
+
+    def query(self, conditions):
+        '''Return the node ids that match all conditions, in the order
+        they were added.'''
+        matched = None
+        for found, c in self._plan(conditions):
+            if matched is None:
+                if found is None:
+                    # no index lookups, so start from the nodes with the key
+                    matched = set(self.columns.get(c[0], {}).keys())
+                else:
+                    matched = set(found)
+            if found is None:
+                matched = set(n for n in matched if self._notequal(n, c))
+            else:
+                matched = set(n for n in matched if n in found)
+            if len(matched) == 0:
+                break
+        return [] if matched is None else sorted(matched)
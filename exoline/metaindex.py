@@ -0,0 +1,210 @@
+'''Local index of resource metadata for client trees.'''
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+
+class MetaIndex:
+    '''SQLite index of the resources under clients, keyed by the auth (CIK
+    or auth dict) of the client at the root of each tree. For each
+    resource it keeps the parent, type, name, CIK, modified time, meta,
+    aliases (in its parent), a hash of its script if it's a datarule, and
+    its info with description, key, basic and aliases, which is enough to
+    rebuild the tree that _infotree returns with those options.
+
+    ExoRPC._refresh_index keeps the index up to date, fetching only the
+    clients whose modified time has changed.'''
+    filename = 'index.sqlite'
+    # info options stored for each resource
+    options = {'description': True, 'key': True, 'basic': True, 'aliases': True}
+
+    def __init__(self, indexdir):
+        indexdir = os.path.expanduser(indexdir)
+        # the index has CIKs in it, so keep it private to the user
+        if not os.path.exists(indexdir):
+            os.makedirs(indexdir, 0o700)
+        self.path = os.path.join(indexdir, self.filename)
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        os.chmod(self.path, 0o600)
+        with self.lock:
+            with self.db:
+                self.db.execute('''CREATE TABLE IF NOT EXISTS roots (
+                    root TEXT PRIMARY KEY,
+                    rid TEXT NOT NULL,
+                    refreshed REAL NOT NULL)''')
+                # parent is NULL for the root resource
+                self.db.execute('''CREATE TABLE IF NOT EXISTS resources (
+                    root TEXT NOT NULL,
+                    rid TEXT NOT NULL,
+                    parent TEXT,
+                    type TEXT NOT NULL,
+                    name TEXT,
+                    cik TEXT,
+                    modified INTEGER,
+                    meta TEXT,
+                    aliases TEXT NOT NULL,
+                    scripthash TEXT,
+                    info TEXT NOT NULL,
+                    PRIMARY KEY (root, rid))''')
+                self.db.execute('''CREATE INDEX IF NOT EXISTS resources_parent
+                    ON resources (root, parent)''')
+                self.db.execute('''CREATE INDEX IF NOT EXISTS resources_name
+                    ON resources (root, name)''')
+
+    def _key(self, auth):
+        if isinstance(auth, dict):
+            return json.dumps(auth, sort_keys=True)
+        return auth
+
+    def root(self, auth):
+        '''Return (rid, refreshed time) of the root of auth's tree, or None
+        if it's not indexed.'''
+        with self.lock:
+            return self.db.execute(
+                'SELECT rid, refreshed FROM roots WHERE root = ?',
+                (self._key(auth),)).fetchone()
+
+    def clients(self, auth):
+        '''Return {rid: modified} for the clients in auth's tree'''
+        with self.lock:
+            return dict(self.db.execute(
+                '''SELECT rid, modified FROM resources
+                   WHERE root = ? AND type = 'client' ''',
+                (self._key(auth),)).fetchall())
+
+    def count(self, auth):
+        '''Return the number of resources in auth's tree'''
+        with self.lock:
+            return self.db.execute(
+                'SELECT COUNT(*) FROM resources WHERE root = ?',
+                (self._key(auth),)).fetchone()[0]
+
+    def children(self, auth, rid):
+        '''Return [(rid, type)] for the children of rid in auth's tree'''
+        with self.lock:
+            return self.db.execute(
+                'SELECT rid, type FROM resources WHERE root = ? AND parent = ?',
+                (self._key(auth), rid)).fetchall()
+
+    def _row(self, root, rid, parent, info, aliases):
+        description = info.get('description', {})
+        script = description.get('rule', {}).get('script')
+        return (root,
+                rid,
+                parent,
+                info['basic']['type'],
+                description.get('name'),
+                info.get('key'),
+                info['basic'].get('modified'),
+                description.get('meta'),
+                json.dumps(aliases),
+                None if script is None else hashlib.sha1(script.encode('utf-8')).hexdigest(),
+                json.dumps(info))
+
+    def update(self, auth, rid, info, children=None, parent=None, aliases=None):
+        '''Store info for rid in auth's tree. parent is None for the root of
+        the tree. aliases are rid's aliases in its parent, or None to keep
+        the ones in the index. If children is not None, it's
+        a list of (rid, info) for all of rid's children, and any other
+        children that were in the index are removed along with their
+        descendants. A child's info may be None if it couldn't be read, in
+        which case what's in the index for it is kept.'''
+        root = self._key(auth)
+        with self.lock:
+            with self.db:
+                if aliases is None:
+                    row = self.db.execute(
+                        'SELECT aliases FROM resources WHERE root = ? AND rid = ?',
+                        (root, rid)).fetchone()
+                    aliases = [] if row is None else json.loads(row[0])
+                self.db.execute(
+                    'INSERT OR REPLACE INTO resources VALUES (?,?,?,?,?,?,?,?,?,?,?)',
+                    self._row(root, rid, parent, info, aliases))
+                if parent is None:
+                    self.db.execute(
+                        'INSERT OR REPLACE INTO roots VALUES (?, ?, ?)',
+                        (root, rid, time.time()))
+                if children is None:
+                    return
+                keep = set(childrid for childrid, _ in children)
+                removed = [r for r, _ in self.children(auth, rid) if r not in keep]
+                while len(removed) > 0:
+                    r = removed.pop()
+                    removed.extend(c for c, _ in self.children(auth, r))
+                    self.db.execute(
+                        'DELETE FROM resources WHERE root = ? AND rid = ?',
+                        (root, r))
+                childaliases = info.get('aliases', {})
+                for childrid, childinfo in children:
+                    if childinfo is not None:
+                        self.db.execute(
+                            'INSERT OR REPLACE INTO resources VALUES (?,?,?,?,?,?,?,?,?,?,?)',
+                            self._row(root, childrid, rid, childinfo,
+                                      childaliases.get(childrid, [])))
+
+    def infotree(self, auth, nodeidfn=lambda rid, info: rid, level=None):
+        '''Return auth's tree in the shape returned by ExoRPC._infotree, or
+        None if it's not indexed. nodeidfn and level are as for _infotree.'''
+        root = self.root(auth)
+        if root is None:
+            return None
+        with self.lock:
+            rows = self.db.execute(
+                'SELECT rid, parent, info FROM resources WHERE root = ?',
+                (self._key(auth),)).fetchall()
+        infos = {}
+        children = {}
+        for rid, parent, info in rows:
+            infos[rid] = info
+            children.setdefault(parent, []).append(rid)
+        rootrid = root[0]
+        tree = {'rid': rootrid, 'info': json.loads(infos[rootrid])}
+        # breadth first, like _infotree. nodeidfn may change node['rid'],
+        # so the RID is kept with each node.
+        gen = [(tree, rootrid, 0)]
+        childlists = []
+        while len(gen) > 0:
+            nextgen = []
+            for node, rid, depth in gen:
+                node['rid'] = nodeidfn(rid, node['info'])
+            for node, rid, depth in gen:
+                if level is not None and depth >= level:
+                    continue
+                childrids = children.get(rid, [])
+                childnodes = [{'rid': r, 'info': json.loads(infos[r])} for r in childrids]
+                node['info']['children'] = childnodes
+                childlists.append(childnodes)
+                nextgen.extend((c, r, depth + 1) for c, r in zip(childnodes, childrids))
+            gen = nextgen
+        for childnodes in childlists:
+            childnodes.sort(key=lambda x: x['rid'])
+        return tree
+
+    def clear(self, auth=None):
+        '''Remove auth's tree from the index, or all trees if auth is None.
+        Returns the number of resources removed.'''
+        with self.lock:
+            with self.db:
+                if auth is None:
+                    count = self.db.execute('DELETE FROM resources').rowcount
+                    self.db.execute('DELETE FROM roots')
+                else:
+                    root = self._key(auth)
+                    count = self.db.execute(
+                        'DELETE FROM resources WHERE root = ?', (root,)).rowcount
+                    self.db.execute('DELETE FROM roots WHERE root = ?', (root,))
+        return count
+
+    def stats(self):
+        '''Return a dict of index statistics'''
+        with self.lock:
+            roots = self.db.execute('SELECT COUNT(*) FROM roots').fetchone()[0]
+            resources = self.db.execute('SELECT COUNT(*) FROM resources').fetchone()[0]
+        return {'path': self.path,
+                'roots': roots,
+                'resources': resources,
+                'filebytes': os.path.getsize(self.path)}
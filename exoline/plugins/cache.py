@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+'''Show or clear the local time series cache (see --cachedir)
+
+Usage:
+    exo [options] cache stats
+    exo [options] cache clear [<cik>]
+
+Command Options:
+{{ helpoption }}
+
+    clear with <cik> drops only series read with that CIK.
+
+    Series are cleared when exo writes or records to them, and time more
+    than 10 minutes ago is cached as complete. Points written from
+    elsewhere (devices, other hosts, backfills) with older timestamps than
+    that aren't read until the series is cleared.
+'''
+from __future__ import unicode_literals
+import json
+
+import humanize
+
+
+class Plugin():
+    def command(self):
+        return 'cache'
+
+    def run(self, cmd, args, options):
+        rpc = options['rpc']
+        ExoException = options['exception']
+        cache = rpc.cache
+        if cache is None:
+            raise ExoException(
+                'No cache is configured. Pass --cachedir or set $EXO_CACHEDIR.')
+
+        if args['stats']:
+            stats = cache.stats()
+            print('path:      {0}'.format(stats['path']))
+            print('series:    {0}'.format(stats['series']))
+            print('points:    {0}'.format(stats['points']))
+            print('ranges:    {0}'.format(stats['ranges']))
+            print('size:      {0} (limit {1}, file {2})'.format(
+                humanize.naturalsize(stats['bytes']),
+                humanize.naturalsize(stats['maxbytes']),
+                humanize.naturalsize(stats['filebytes'])))
+        elif args['clear']:
+            count = cache.clear(options['cik'])
+            print('cleared {0} series'.format(count))
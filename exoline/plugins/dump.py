@@ -5,7 +5,12 @@ Usage:
     exo [options] dump <cik> <filename>
 
 Command Options:
-    --silent  Don't show search progress
+    --silent                Don't show search progress
+    --resume                Continue an earlier dump to <filename> that
+                            didn't finish
+    --shards=<n>            Read up to <n> time windows of each dataport at
+                            once [default: 1]
+    --format=zip|columnar   Output format [default: zip]
 
 Output file is a zip with this structure:
     dump.json
@@ -13,6 +18,21 @@ Output file is a zip with this structure:
     <type1>.<rid1>.json
     <type2>.<rid2>.json
     ...
+
+With --format=columnar, <filename> is a directory with the same structure,
+except that each time series is a directory of binary arrays instead of a
+JSON file:
+    <type1>.<rid1>/manifest.json
+    <type1>.<rid1>/timestamp.i64
+    <type1>.<rid1>/0.<i64|f64|str>
+
+While dump runs, it keeps track of its progress in <filename>.checkpoint.json,
+and the time series it's reading in <filename>.partial. These are removed
+when the dump finishes. If a dump fails partway through, run it again with
+the --resume option to skip the resources already written and continue the
+one that was being read from its last checkpointed point. Time series are read
+up to the time the first attempt started. With --resume and no checkpoint,
+dump starts from the beginning.
 '''
 from __future__ import unicode_literals
 import os
@@ -25,6 +45,40 @@ import zipfile
 
 import six
 
+from exoline import columnar
+from exoline import resourcenode
+
+
+def write_json_points(f, data, pagesize=10000, count=0, onpage=None):
+    '''Write readmult rows for a single resource to f as a JSON list of
+    [timestamp, value] points, a page of points at a time. The output is
+    the same as json.dumps of the whole list. If count is not 0, f already
+    has the start of a list with count points in it, and data continues it.
+    onpage(count, timestamp) is called after each page is written with the
+    number of points so far and the last timestamp. Returns the number of
+    points in the list.'''
+    if count == 0:
+        f.write(b'[')
+    page = []
+    for d in data:
+        page.append([d[0], d[1][0]])
+        if len(page) == pagesize:
+            count = _write_page(f, page, count, onpage)
+            page = []
+    if len(page) > 0:
+        count = _write_page(f, page, count, onpage)
+    f.write(b']')
+    return count
+
+def _write_page(f, page, count, onpage):
+    # strip the brackets from the page's list
+    s = json.dumps(page)[1:-1]
+    f.write(((', ' if count > 0 else '') + s).encode('utf-8'))
+    count += len(page)
+    if onpage is not None:
+        onpage(count, page[-1][0])
+    return count
+
 class Plugin():
     def command(self):
         return 'dump'
@@ -46,6 +100,82 @@ class Plugin():
             return rid
 
         MAX_POINTS = 100000000
+        filename = args['<filename>']
+        checkpointpath = filename + '.checkpoint.json'
+        partialpath = filename + '.partial'
+        fmt = args['--format']
+        if fmt not in ['zip', 'columnar']:
+            raise ExoException('--format must be zip or columnar')
+        try:
+            shards = int(args['--shards'])
+        except ValueError:
+            shards = 0
+        if shards < 1:
+            raise ExoException('--shards must be a positive integer')
+
+        # pick up where an earlier dump left off
+        checkpoint = None
+        tree = None
+        if args['--resume'] and os.path.exists(checkpointpath):
+            with open(checkpointpath) as f:
+                checkpoint = json.load(f)
+            if checkpoint['cik'] != cik:
+                raise ExoException('{0} is a checkpoint for a different CIK'.format(checkpointpath))
+            if checkpoint['format'] != fmt:
+                raise ExoException('{0} is a checkpoint for --format={1}'.format(
+                    checkpointpath, checkpoint['format']))
+            try:
+                if fmt == 'columnar':
+                    with open(os.path.join(filename, 'infotree.json')) as f:
+                        tree = json.load(f)
+                    written = [n for n in checkpoint['completed']
+                               if os.path.exists(os.path.join(filename, n, 'manifest.json'))]
+                else:
+                    zf = zipfile.ZipFile(filename, 'r')
+                    try:
+                        tree = json.loads(zf.read('infotree.json').decode('utf-8'))
+                        written = [n[:-len('.json')] for n in zf.namelist()]
+                    finally:
+                        zf.close()
+            except (IOError, OSError, KeyError, ValueError, zipfile.BadZipfile) as ex:
+                sys.stderr.write('Unable to resume from {0} ({1}). Starting over.\n'.format(filename, ex))
+                checkpoint = None
+            else:
+                # anything the checkpoint has that didn't make it into the
+                # archive is read again
+                completed = checkpoint['completed']
+                checkpoint['completed'] = dict(
+                    [(n, completed[n]) for n in written if n in completed])
+
+        if checkpoint is None:
+            if fmt == 'columnar' and os.path.exists(filename) and (
+                    not os.path.isdir(filename) or len(os.listdir(filename)) > 0):
+                raise ExoException('{0} exists and is not an empty directory'.format(filename))
+            now = datetime.now()
+            checkpoint = {
+                'cik': cik,
+                'format': fmt,
+                'timestamp': now.isoformat(),
+                'endtime': ExoUtilities.parse_ts_tuple(now.timetuple()),
+                'resources': 0,
+                # resource name -> number of points
+                'completed': {},
+                # progress on the time series in partialpath
+                'partial': None,
+                'errors': []
+            }
+        nowts = checkpoint['endtime']
+        errors = checkpoint['errors']
+
+        def save_checkpoint():
+            tmp = checkpointpath + '.tmp'
+            with open(tmp, 'w') as f:
+                f.write(json.dumps(checkpoint))
+            # rename doesn't replace an existing file on Windows
+            if os.path.exists(checkpointpath):
+                os.remove(checkpointpath)
+            os.rename(tmp, checkpointpath)
+
         progress = {
             'current': 0
         }
@@ -57,26 +187,82 @@ class Plugin():
         def seriesprogress(rid, count):
             sys.stderr.write('\r{0}.json {1}'.format(rid, six.next(spinner)))
             sys.stderr.flush()
+        def dumpZipSeries(dumpzipfile, name, rid):
+            '''Read a time series into partialpath, continuing from the
+            checkpoint if it was partway through this one, and add it to
+            the zip when it's done.'''
+            partial = checkpoint['partial']
+            if (partial is None or partial['name'] != name or
+                    not os.path.exists(partialpath) or
+                    os.path.getsize(partialpath) < partial['bytes']):
+                partial = {'name': name, 'last': None, 'points': 0, 'bytes': 0}
+                f = open(partialpath, 'wb')
+            else:
+                f = open(partialpath, 'r+b')
+                f.truncate(partial['bytes'])
+                f.seek(partial['bytes'])
+            def onpage(count, timestamp):
+                f.flush()
+                checkpoint['partial'] = {
+                    'name': name,
+                    'last': timestamp,
+                    'points': count,
+                    'bytes': f.tell()}
+                save_checkpoint()
+            try:
+                data = rpc.readmult(
+                    cik,
+                    [rid],
+                    MAX_POINTS - partial['points'],
+                    sort='asc',
+                    starttime=None if partial['last'] is None else partial['last'] + 1,
+                    endtime=nowts,
+                    progress=lambda count: seriesprogress(rid, count),
+                    shards=shards)
+                npoints = write_json_points(f, data, count=partial['points'], onpage=onpage)
+            finally:
+                f.close()
+            dumpzipfile.write(partialpath, name + '.json')
+            os.remove(partialpath)
+            return npoints
         def dumpTimeSeries(cik, tree, dumpzipfile):
             resources = [c for c in tree['info']['children'] if c['info']['basic']['type'] in ['dataport', 'datarule']]
             for i, resource in enumerate(resources):
                 progress['current'] += 1
+                name = resource['info']['basic']['type'] + '.' + resource['rid']
+                if name in checkpoint['completed']:
+                    counts['points'] += checkpoint['completed'][name]
+                    continue
                 sys.stderr.write('\r{0}.json'.format(resource['rid']))
                 sys.stderr.flush()
-                data = rpc.readmult(
-                    cik,
-                    [resource['rid']],
-                    MAX_POINTS,
-                    sort='asc',
-                    starttime=None,
-                    endtime=nowts,
-                    progress=lambda count: seriesprogress(resource['rid'], count))
-                # pull out just data for this resource
-                ts = [[d[0], d[1][0]] for d in data]
-                if len(ts) == MAX_POINTS:
+                if fmt == 'columnar':
+                    data = rpc.readmult(
+                        cik,
+                        [resource['rid']],
+                        MAX_POINTS,
+                        sort='asc',
+                        starttime=None,
+                        endtime=nowts,
+                        progress=lambda count: seriesprogress(resource['rid'], count),
+                        shards=shards)
+                    writer = columnar.ColumnarWriter(
+                        os.path.join(filename, name),
+                        [{'name': 'value',
+                          'rid': resource['rid'],
+                          'format': resource['info']['description'].get('format')}],
+                        nullable=False)
+                    for t, values in data:
+                        writer.write(t, values)
+                    writer.close()
+                    npoints = writer.rows
+                else:
+                    npoints = dumpZipSeries(dumpzipfile, name, resource['rid'])
+                if npoints == MAX_POINTS:
                     sys.stderr.write("WARNING: read limit of {0} points for RID {1}\n".format(MAX_POINTS, resource['rid']))
-                dumpzipfile.writestr(resource['info']['basic']['type'] + '.' + resource['rid'] + '.json', json.dumps(ts))
-                counts['points'] += len(ts)
+                counts['points'] += npoints
+                checkpoint['completed'][name] = npoints
+                checkpoint['partial'] = None
+                save_checkpoint()
                 sys.stderr.write('\r{0}.json   \n'.format(resource['rid']))
                 sys.stderr.flush()
 
@@ -84,41 +270,61 @@ class Plugin():
                 if c['info']['basic']['type'] == 'client':
                     dumpTimeSeries(cik, c, dumpzipfile)
 
-        now = datetime.now()
-        nowts = ExoUtilities.parse_ts_tuple(now.timetuple())
-
-        sys.stderr.write('infotree.json ')
-        def dbg(rid, info):
-            print(rid)
-            return rid
-        errors = []
         def errorfn(auth, msg):
             errors.append({
                 'auth': auth,
                 'msg': msg
             })
             sys.stderr.write("\nERROR: {0} {1}\n".format(msg, auth))
-        tree = rpc._infotree(
-            cik,
-            options={"description": True, "key": True, "basic": True, "aliases": True},
-            nodeidfn=treeprogress if not args['--silent'] else lambda rid, info: rid,
-            level=None,
-            raiseExceptions=True,
-            errorfn=errorfn)
-        sys.stderr.write('\n')
-
-        zf = zipfile.ZipFile(args['<filename>'], 'w', compression=zipfile.ZIP_DEFLATED)
-        tree['info']['key'] = cik
+        resuming = tree is not None
+        if not resuming:
+            sys.stderr.write('infotree.json ')
+            tree = rpc._infotree(
+                cik,
+                options={"description": True, "key": True, "basic": True, "aliases": True},
+                nodeidfn=treeprogress if not args['--silent'] else lambda rid, info: rid,
+                level=None,
+                raiseExceptions=True,
+                errorfn=errorfn,
+                compact=True)
+            sys.stderr.write('\n')
+            tree['info']['key'] = cik
+            checkpoint['resources'] = counts['resources']
+        else:
+            sys.stderr.write('resuming from {0}\n'.format(checkpointpath))
+            counts['resources'] = checkpoint['resources']
+
+        if fmt == 'columnar':
+            class DirectoryWriter():
+                '''Write files to a directory the way ZipFile writes
+                them to a zip'''
+                def __init__(self, path):
+                    self.path = path
+                    if not os.path.exists(path):
+                        os.makedirs(path)
+                def writestr(self, name, data):
+                    with open(os.path.join(self.path, name), 'w') as f:
+                        f.write(data)
+                def close(self):
+                    pass
+            zf = DirectoryWriter(filename)
+        else:
+            zf = zipfile.ZipFile(filename, 'a' if resuming else 'w',
+                                 compression=zipfile.ZIP_DEFLATED)
         try:
-            zf.writestr('infotree.json', json.dumps(tree))
+            if not resuming:
+                zf.writestr('infotree.json', json.dumps(tree, default=resourcenode.jsonable))
+                save_checkpoint()
             dumpTimeSeries(cik, tree, zf)
             sys.stderr.write('dump.json\n')
             sys.stderr.flush()
             zf.writestr('dump.json', json.dumps(
-                {'timestamp': now.isoformat(),
+                {'timestamp': checkpoint['timestamp'],
                  'version': '1.0',
                  'errors': errors}))
         finally:
             zf.close()
             counts['errors'] = errors
             print(json.dumps(counts))
+        # the dump is complete
+        os.remove(checkpointpath)
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+'''Keep a local index of client trees, for use with --useindex
+
+Usage:
+    exo [options] index refresh <cik> [--full]
+    exo [options] index stats
+    exo [options] index clear [<cik>]
+
+Command Options:
+    --full   List every client again, not just the ones that changed
+{{ helpoption }}
+
+    refresh adds the tree of resources under <cik> to the index in
+    --indexdir, or brings it up to date. It checks the modified time of
+    every client in the index in one batch of requests, and then lists
+    again only the clients that are new or have changed. Changes to a
+    dataport, datarule or dispatch that don't change its client's modified
+    time are picked up by refresh --full.
+
+    The index holds the CIK of every client under <cik>, so treat it like
+    your exoline config file. It's created readable only by you.
+
+    With --useindex, search, find and makeShortcuts read <cik>'s tree from
+    the index instead of fetching it, so they're only as current as the
+    last refresh. The index keeps the description, key, basic and aliases
+    info of each resource, so those are what find can match.
+
+    clear with <cik> drops only that client's tree.
+'''
+from __future__ import unicode_literals
+import sys
+import time
+
+import humanize
+
+
+class Plugin():
+    def command(self):
+        return 'index'
+
+    def run(self, cmd, args, options):
+        rpc = options['rpc']
+        index = rpc._metaindex()
+
+        if args['refresh']:
+            cik = options['cik']
+            start = time.time()
+            listed = rpc._refresh_index(cik, full=args['--full'])
+            sys.stderr.write('listed {0} client{1} in {2:.1f}s\n'.format(
+                listed, '' if listed == 1 else 's', time.time() - start))
+            print('resources: {0}'.format(index.count(cik)))
+        elif args['stats']:
+            stats = index.stats()
+            print('path:      {0}'.format(stats['path']))
+            print('clients:   {0} indexed'.format(stats['roots']))
+            print('resources: {0}'.format(stats['resources']))
+            print('size:      {0}'.format(humanize.naturalsize(stats['filebytes'])))
+        elif args['clear']:
+            count = index.clear(options['cik'])
+            print('cleared {0} resources'.format(count))
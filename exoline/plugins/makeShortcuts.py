@@ -83,7 +83,7 @@ class Plugin():
 
         # This craps out too easily.
         # TODO: Need to switch to using the nodeidfn
-        tree = rpc._infotree(cik, level=level)
+        tree = rpc._infotree(cik, level=level, useindex=True)
         tree['info']['key'] = cik
         if rpc.regex_rid.match(args['<cik>']) is None:
             alias = args['<cik>']
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+'''Restore a client from a zip file written by dump
+
+Usage:
+    exo [options] restore <cik> <filename>
+
+Command Options:
+    --chunksize=<points>  Record up to <points> points per record call
+                          [default: 1000]
+    --no-data             Recreate resources without their time series
+    --cikonly             show unlabeled CIK by itself
+{{ helpoption }}
+
+    Creates a copy of the dumped client as a child of <cik>, including its
+    children and aliases, and then records each dumped time series into its
+    copy. Record calls are sent several to a request, and with the global
+    --parallel option, several requests are sent at once.
+'''
+from __future__ import unicode_literals
+import os
+import sys
+import re
+import json
+import codecs
+import itertools
+import zipfile
+
+
+# whitespace and separators between list items
+SKIP = re.compile(r'[\s,]*')
+
+
+def iter_json_list(f, bufsize=65536):
+    '''Generate the items of the JSON list in the binary file f, reading
+    it bufsize bytes at a time rather than loading the whole list.'''
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    state = {'buf': '', 'pos': 0, 'eof': False}
+    def more():
+        data = f.read(bufsize)
+        state['eof'] = len(data) == 0
+        state['buf'] = state['buf'][state['pos']:] + utf8.decode(data, final=state['eof'])
+        state['pos'] = 0
+    started = False
+    while True:
+        buf, pos = state['buf'], SKIP.match(state['buf'], state['pos']).end()
+        state['pos'] = pos
+        if pos == len(buf):
+            if state['eof']:
+                raise ValueError('unexpected end of JSON list')
+            more()
+            continue
+        if not started:
+            if buf[pos] != '[':
+                raise ValueError('expected a JSON list')
+            started = True
+            state['pos'] = pos + 1
+            continue
+        if buf[pos] == ']':
+            return
+        try:
+            item, end = decoder.raw_decode(buf, pos)
+        except ValueError:
+            if state['eof']:
+                raise
+            # item continues past the end of the buffer
+            more()
+            continue
+        if end == len(buf) and not state['eof']:
+            # a number might have more digits
+            more()
+            continue
+        state['pos'] = end
+        yield item
+
+
+class Plugin():
+    def command(self):
+        return 'restore'
+
+    def run(self, cmd, args, options):
+        cik = options['cik']
+        rpc = options['rpc']
+        ExoException = options['exception']
+        filename = args['<filename>']
+        try:
+            chunksize = int(args['--chunksize'])
+        except ValueError:
+            chunksize = 0
+        if chunksize < 1:
+            raise ExoException('--chunksize must be a positive integer')
+        if os.path.isdir(filename):
+            raise ExoException('restore reads zip files written by dump (not --format=columnar)')
+
+        zf = zipfile.ZipFile(filename, 'r')
+        try:
+            tree = json.loads(zf.read('infotree.json').decode('utf-8'))
+            def check(node):
+                desc = node['info']['description']
+                if desc.get('subscribe') is not None and len(desc['subscribe']) > 0:
+                    raise ExoException('Restore does not support resources that use the "subscribe" feature, as RID {0} in the dump does.'.format(node['rid']))
+                for child in node['info'].get('children', []):
+                    check(child)
+            check(tree)
+            rpc._check_room(cik, tree)
+
+            sys.stderr.write('creating resources\n')
+            ridmap = {}
+            newrid, newcik = rpc._create_tree(cik, tree, ridmap=ridmap)
+            counts = {'resources': len(ridmap), 'points': 0}
+
+            if not args['--no-data']:
+                names = set(zf.namelist())
+                def timeseries(node):
+                    '''Generate (owner cik, new rid, member name) for each
+                    time series in the dump, a client at a time.'''
+                    for child in node['info'].get('children', []):
+                        name = '{0}.{1}.json'.format(child['info']['basic']['type'], child['rid'])
+                        if name in names:
+                            owner, rid = ridmap[child['rid']]
+                            yield owner, rid, name
+                    for child in node['info'].get('children', []):
+                        if child['info']['basic']['type'] == 'client':
+                            for s in timeseries(child):
+                                yield s
+                def points(name):
+                    f = zf.open(name)
+                    try:
+                        for p in iter_json_list(f):
+                            yield p
+                    finally:
+                        f.close()
+                recorded = {}
+                def progress(rid, count):
+                    counts['points'] += count - recorded.get(rid, 0)
+                    recorded[rid] = count
+                    sys.stderr.write('\rrecorded {0} points'.format(counts['points']))
+                    sys.stderr.flush()
+                for owner, group in itertools.groupby(timeseries(tree), lambda s: s[0]):
+                    rpc._record_batched(
+                        owner,
+                        ((rid, points(name)) for _, rid, name in group),
+                        chunksize=chunksize,
+                        progress=progress)
+                sys.stderr.write('\n')
+        finally:
+            zf.close()
+
+        sys.stderr.write(json.dumps(counts) + '\n')
+        if args['--cikonly']:
+            print(newcik)
+        else:
+            print('cik: ' + newcik)
@@ -5,10 +5,15 @@ Usage:
     exo [options] search <cik> <query-regex>
 
 Command Options:
-    --matchcase   Match case when searching
-    --nocolor     Turn off output color (implicit in Windows
-                  and Python < 2.7)
-    --silent      Don't show search progress
+    --matchcase          Match case when searching
+    --nocolor            Turn off output color (implicit in Windows
+                         and Python < 2.7)
+    --silent             Don't show search progress
+    --processes=<num>    Number of processes to search script content with
+                         [default: 1]
+    --max-results=<num>  Stop searching after <num> matches
+
+    Matches are printed as resources are fetched, breadth first.
 '''
 from __future__ import unicode_literals
 import os
@@ -16,6 +21,117 @@ import sys
 import re
 import json
 import platform
+import itertools
+import multiprocessing
+
+MATCH_COLOR = '\033[32m'
+RESET_COLOR = '\033[0m'
+
+# compiled query in script matching processes (see init_worker)
+worker_pattern = None
+
+
+def init_worker(query, flags):
+    global worker_pattern
+    worker_pattern = re.compile(query, flags)
+
+
+def script_spans(script):
+    '''Return the spans of worker_pattern's matches in script'''
+    return [m.span() for m in worker_pattern.finditer(script)]
+
+
+def find_spans(pattern, text, color):
+    '''Return the spans of pattern's matches in text, or None if it doesn't
+    match. Without color only the first match is needed.'''
+    if color:
+        spans = [m.span() for m in pattern.finditer(text)]
+        return spans if len(spans) > 0 else None
+    m = pattern.search(text)
+    return None if m is None else [m.span()]
+
+
+def highlight(text, spans, color):
+    '''Return text with spans highlighted if color is True'''
+    if not color:
+        return text
+    parts = []
+    last = 0
+    for start, end in spans:
+        parts.append(text[last:start])
+        parts.append(MATCH_COLOR + text[start:end] + RESET_COLOR)
+        last = end
+    parts.append(text[last:])
+    return ''.join(parts)
+
+
+def walk(node, path, aliases):
+    '''Generate (node, path, aliases) for node and its descendants, depth
+    first, where path is the list of CIKs of node's ancestors and aliases
+    are node's aliases in its parent. Children that failed are generated
+    as (child, None, None).'''
+    yield node, path, aliases
+    cik = node['info']['key'] if 'key' in node['info'] else None
+    for child in node['info'].get('children', []):
+        if 'exception' in child:
+            yield child, None, None
+        else:
+            rid = child['rid']
+            if rid in node['info']['aliases']:
+                childaliases = node['info']['aliases'][rid]
+            else:
+                childaliases = []
+            for n in walk(child, path + [cik], childaliases):
+                yield n
+
+
+def stream(rpc, cik, lookahead=500):
+    '''Generate (node, path, aliases) like walk, breadth first, as the
+    tree under cik is fetched. Resources whose info couldn't be read are
+    generated as ({'rid': <rid>, 'error': <response>}, None, None).'''
+    # path, CIK and aliases of clients, by RID
+    clients = {}
+    for treenode in rpc._iter_treenodes(
+            cik,
+            lookahead=lookahead,
+            options={"description": True, "key": True, "basic": True, "aliases": True}):
+        tree = treenode['tree']
+        info = tree['info']
+        if treenode['par'] is None:
+            path = []
+            aliases = []
+            if not ('error' in info and len(info) == 1):
+                # info doesn't contain key
+                info['key'] = cik
+        else:
+            parentpath, parentcik, parentaliases = clients[treenode['par']]
+            path = parentpath + [parentcik]
+            aliases = parentaliases.get(tree['rid'], [])
+        if 'error' in info and len(info) == 1:
+            yield {'rid': tree['rid'], 'error': info['error']}, None, None
+            continue
+        if tree['type'] == 'client':
+            clients[tree['rid']] = (path, info.get('key'), info.get('aliases', {}))
+        yield {'rid': tree['rid'], 'info': info}, path, aliases
+
+
+def serial_number(info):
+    '''Return model#sn for a client with Portals device metadata, or None
+    http://developers.exosite.com/display/POR/Developing+for+Portals'''
+    if 'key' not in info or info['key'] is None:
+        return None
+    try:
+        if len(info['description']['meta']) > 0:
+            meta = json.loads(info['description']['meta'])
+            if 'device' in meta:
+                device = meta['device']
+                if device['type'] == 'vendor':
+                    return device['model'] + '#' + device['sn']
+    except Exception as ex:
+        # ignore bad meta
+        pass
+    return None
+
 
 class Plugin():
     def command(self):
@@ -27,121 +143,178 @@ class Plugin():
         ExoException = options['exception']
         ExoUtilities = options['utils']
 
-        count = [0]
-        def progress(rid, info):
-            count[0] += 1
-            sys.stderr.write("\rSearched {0} resources".format(count[0]))
-            sys.stderr.flush()
-            return rid
-
-        reflags = re.IGNORECASE if args['--matchcase'] else 0
-        def searchnodes(node, path, aliases):
-            if platform.system() == 'Windows' or sys.version_info < (2, 7):
-                args['--nocolor'] = True
-            query = args['<query-regex>']
-            matches = False
+        try:
+            processes = int(args['--processes'])
+        except ValueError:
+            processes = 0
+        if processes < 1:
+            raise ExoException('--processes must be a positive integer')
+        maxresults = None
+        if args['--max-results'] is not None:
+            try:
+                maxresults = int(args['--max-results'])
+            except ValueError:
+                maxresults = 0
+            if maxresults < 1:
+                raise ExoException('--max-results must be a positive integer')
 
-            name = node['info']['description']['name']
-            matchColor = '\033[32m'
-            resetColor = '\033[0m'
+        if platform.system() == 'Windows' or sys.version_info < (2, 7):
+            args['--nocolor'] = True
+        color = not args['--nocolor']
+        query = args['<query-regex>']
+        reflags = 0 if args['--matchcase'] else re.IGNORECASE
+        try:
+            pattern = re.compile(query, reflags)
+        except re.error as ex:
+            raise ExoException('Bad query regex: {0}'.format(ex))
+
+        progress = [0, '']
+        def showprogress():
+            if not args['--silent']:
+                progress[1] = "\rSearched {0} resources".format(progress[0])
+                sys.stderr.write(progress[1])
+                sys.stderr.flush()
+        def clearprogress():
+            if len(progress[1]) > 0:
+                sys.stderr.write('\r' + ' ' * (len(progress[1]) - 1) + '\r')
+                sys.stderr.flush()
+                progress[1] = ''
+
+        def scriptof(node):
+            description = node['info']['description']
+            if 'rule' in description and 'script' in description['rule']:
+                return description['rule']['script']
+            return None
+
+        def searchnode(node, path, aliases, scriptspans):
+            '''Return the line to print for node if it matches, or None.
+            scriptspans are the spans of matches in node's script, or None
+            if it has no script or the script doesn't match.'''
+            matches = False
 
             # search name
-            if (re.search(query, name, flags=reflags)):
-                if not args['--nocolor']:
-                    name = re.sub('(' + query + ')', matchColor + r'\1' + resetColor, name, flags=reflags)
+            name = node['info']['description']['name']
+            spans = find_spans(pattern, name, color)
+            if spans is not None:
+                name = highlight(name, spans, color)
                 matches = True
 
             # search alias
             alias = aliases[0] if len(aliases) > 0 else None
-            for i in range(len(aliases)):
-                if re.search(query, aliases[i], flags=reflags):
-                    alias = aliases[i]
-                    if not args['--nocolor']:
-                        aliases[i] = re.sub('(' + query + ')', matchColor + r'\1' + resetColor, aliases[i], flags=reflags)
+            for a in aliases:
+                spans = find_spans(pattern, a, color)
+                if spans is not None:
+                    alias = highlight(a, spans, color)
                     matches = True
+                    break
 
             # search serial number
-            sn = None
-            if 'key' in node['info'] and node['info']['key'] is not None:
-                try:
-                    # search serial number in portals metadata if present
-                    # http://developers.exosite.com/display/POR/Developing+for+Portals
-                    if len(node['info']['description']['meta']) > 0:
-                        meta = json.loads(node['info']['description']['meta'])
-                        if 'device' in meta:
-                            device = meta['device']
-                            if device['type'] == 'vendor':
-                                sn = device['model'] + '#' + device['sn']
-                                m = re.search(query, sn, flags=reflags)
-                                if m is not None:
-                                    if not args['--nocolor']:
-                                        sn = re.sub('(' + query + ')', matchColor + r'\1' + resetColor, sn, flags=reflags)
-                                else:
-                                    sn = None
-
-                except Exception as ex:
-                    # ignore bad meta
-                    pass
+            sn = serial_number(node['info'])
+            if sn is not None:
+                spans = find_spans(pattern, sn, color)
+                if spans is not None:
+                    sn = highlight(sn, spans, color)
+                    matches = True
+                else:
+                    sn = None
 
             # search script content
             script = None
-            description = node['info']['description']
-            if 'rule' in description and 'script' in description['rule']:
-                if re.search(query, description['rule']['script'], flags=reflags):
-                    script = description['rule']['script']
-                    if not args['--nocolor']:
-                        script = re.sub('(' + query + ')', matchColor + r'\1' + resetColor, script, flags=reflags)
-                    matches = True
+            if scriptspans is not None:
+                script = highlight(scriptof(node), scriptspans, color)
+                matches = True
 
+            if not matches:
+                return None
             cik = node['info']['key'] if 'key' in node['info'] else None
-            if matches:
-                p = path[:]
+            p = path[:]
+            if cik is None:
+                p = ['cik:' + c[:5] + '...' for c in p[:-1]] + ['cik:' + p[-1]]
+            else:
+                p = ['cik:' + c[:5] + '...' for c in p]
+                p.append('cik:' + cik)
+            if len(aliases) == 0:
                 if cik is None:
-                    p = ['cik:' + c[:5] + '...' for c in p[:-1]] + ['cik:' + p[-1]]
-                else:
-                    p = ['cik:' + c[:5] + '...' for c in p]
-                    p.append('cik:' + cik)
-                if len(aliases) == 0:
-                    if cik is None:
-                        p.append('rid:' + node['rid'])
-                    a = ''
-                else:
-                    a = ' > alias:' + alias + ' '
-                print('{0}{1} name:{2}{3}{4}'.format(
-                    ' > '.join(p),
-                    a,
-                    name,
-                    ' sn:' + sn if sn is not None else '',
-                    '\n' + script if script is not None else ''))
-
-            children = node['info']['children']
-            for child in children:
-                if 'exception' in child:
-                    sys.stderr.write('Skipped a resource due to an exception: {0}\n'.format(str(child)))
+                    p.append('rid:' + node['rid'])
+                a = ''
+            else:
+                a = ' > alias:' + alias + ' '
+            return '{0}{1} name:{2}{3}{4}'.format(
+                ' > '.join(p),
+                a,
+                name,
+                ' sn:' + sn if sn is not None else '',
+                '\n' + script if script is not None else '')
+
+        def serialspans(chunk):
+            for node, path, aliases in chunk:
+                script = None if path is None else scriptof(node)
+                yield None if script is None else find_spans(pattern, script, color)
+
+        def poolspans(chunk):
+            '''Match the scripts in chunk in the process pool'''
+            scripts = [None if path is None else scriptof(node) for node, path, _ in chunk]
+            tomatch = [s for s in scripts if s is not None]
+            spans = iter(pool.map(script_spans, tomatch)) if len(tomatch) > 0 else iter([])
+            for script in scripts:
+                if script is None:
+                    yield None
                 else:
-                    rid = child['rid']
-                    if rid in node['info']['aliases']:
-                        aliases = node['info']['aliases'][rid]
-                    else:
-                        aliases = []
-                    p = path[:]
-                    p.append(cik)
-                    searchnodes(child, p, aliases)
-
-        # These are pretty slow
-        #info = rpc.info(cik, options={"counts": True})
-        #counts = info['counts']
-        #total = counts['client'] + counts['dispatch'] + counts['dataport'] + counts['datarule']
-        tree = rpc._infotree(
-            cik,
-            options={"description": True, "key": True, "basic": True, "aliases": True},
-            nodeidfn=progress if not args['--silent'] else lambda rid, info: rid,
-            level=None,
-            raiseExceptions=False)
-        sys.stderr.write('\r')
-        sys.stderr.flush()
-        if 'exception' in tree:
-            print('Exception was: ' + str(tree))
-        else:
+                    s = next(spans)
+                    yield s if len(s) > 0 else None
+
+        if rpc.useindex:
+            tree = rpc._infotree(
+                cik,
+                options={"description": True, "key": True, "basic": True, "aliases": True},
+                level=None,
+                raiseExceptions=False,
+                useindex=True)
             tree['info']['key'] = cik
-            searchnodes(tree, [], [])
+            nodes = walk(tree, [], [])
+        else:
+            nodes = stream(rpc, cik)
+
+        pool = None
+        if processes > 1:
+            # script content is the bulk of the text to search, and
+            # matching each script is independent, so spread it across
+            # processes, a chunk of nodes at a time. Spans are found for
+            # every script, since they're needed to highlight matches.
+            pool = multiprocessing.Pool(processes, init_worker, (query, reflags))
+            chunksize = 100 * processes
+            spansfn = poolspans
+        else:
+            chunksize = 1
+            spansfn = serialspans
+        results = 0
+        try:
+            while maxresults is None or results < maxresults:
+                chunk = list(itertools.islice(nodes, chunksize))
+                if len(chunk) == 0:
+                    break
+                for (node, path, aliases), spans in zip(chunk, spansfn(chunk)):
+                    progress[0] += 1
+                    if path is None:
+                        clearprogress()
+                        if progress[0] == 1:
+                            print('Exception was: ' + str(node))
+                            return
+                        sys.stderr.write('Skipped a resource due to an exception: {0}\n'.format(str(node)))
+                        continue
+                    line = searchnode(node, path, aliases, spans)
+                    if line is not None:
+                        clearprogress()
+                        print(line)
+                        sys.stdout.flush()
+                        results += 1
+                        if maxresults is not None and results >= maxresults:
+                            break
+                    showprogress()
+        finally:
+            clearprogress()
+            if pool is not None:
+                pool.terminate()
+            if hasattr(nodes, 'close'):
+                # stop fetching the tree
+                nodes.close()
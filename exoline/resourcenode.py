@@ -0,0 +1,240 @@
+'''Compact nodes for infotrees that are kept in memory.
+
+An infotree from ExoRPC._infotree is a nested dict for each resource:
+
+    {'rid': <rid>, 'info': {'basic': ..., 'description': ...,
+                            'children': [<node>, ...]}}
+
+With full info (activity, usage, counts, ...) this takes a few kilobytes
+per resource as Python dicts. A ResourceNode keeps the same information
+in slots: the RID, the type, format and name, the children, and the rest
+of the info as compressed JSON that's decoded when it's accessed.
+Type and format strings are shared between nodes.
+
+ResourceNodes look like the dicts they replace, so code that reads
+node['info']['description']['name'] or node['info'].get('children', [])
+works on either. The type in basic, and the name and format in
+description, come from the node's slots without decoding the rest of the
+info. Pass jsonable as the default parameter of json.dumps to serialize a
+tree of them.
+
+Setting keys of node['info'] updates the node, but changes to values
+nested in it (e.g. node['info']['aliases'][rid] = ...) are made to a
+decoded copy and lost. basic and description can't be changed in place.
+'''
+from __future__ import unicode_literals
+import json
+import zlib
+
+# strings shared between nodes
+_strings = {}
+
+
+def _intern(s):
+    if s is None:
+        return None
+    return _strings.setdefault(s, s)
+
+
+def _encode(info):
+    return zlib.compress(json.dumps(info, separators=(',', ':')).encode('utf-8'), 1)
+
+
+def _decode(data):
+    return json.loads(zlib.decompress(data).decode('utf-8'))
+
+
+class _DictLike(object):
+    '''Read methods of dict, implemented with keys() and __getitem__'''
+    __slots__ = ()
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return key in self.keys()
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def items(self):
+        return [(k, self[k]) for k in self.keys()]
+
+    def values(self):
+        return [self[k] for k in self.keys()]
+
+    def copy(self):
+        return dict(self.items())
+
+    def __eq__(self, other):
+        if isinstance(other, (dict, _DictLike)):
+            return self.copy() == dict(other.items())
+        return NotImplemented
+
+    def __ne__(self, other):
+        eq = self.__eq__(other)
+        return eq if eq is NotImplemented else not eq
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(self.copy())
+
+
+class ResourceNode(_DictLike):
+    '''A resource in an infotree. node['rid'] and node['info'] work as
+    they do for the dict version. children is a list of child nodes, or
+    None if the resource's children weren't listed (in which case its info
+    has no 'children' key).'''
+    __slots__ = ('rid', 'type', 'format', 'name', 'children', '_info')
+
+    def __init__(self, rid, info, children=None):
+        self.rid = rid
+        self.children = children
+        self._setinfo(info)
+
+    def _setinfo(self, info):
+        info = dict(info)
+        if 'children' in info:
+            self.children = info.pop('children')
+        self.type = _intern(info.get('basic', {}).get('type'))
+        description = info.get('description', {})
+        self.format = _intern(description.get('format'))
+        self.name = description.get('name')
+        self._info = _encode(info)
+
+    @property
+    def info(self):
+        return InfoView(self)
+
+    def keys(self):
+        return ['rid', 'info']
+
+    def __getitem__(self, key):
+        if key == 'rid':
+            return self.rid
+        if key == 'info':
+            return self.info
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key == 'rid':
+            self.rid = value
+        elif key == 'info':
+            self.children = None
+            self._setinfo(value)
+        else:
+            raise KeyError(key)
+
+
+class InfoView(_DictLike):
+    '''The info of a ResourceNode, as a dict. The info is decoded when it's
+    first needed and kept for as long as the view is. Setting or deleting
+    keys of the view updates the node (changing values inside them
+    doesn't).'''
+    __slots__ = ('_node', '_decoded')
+
+    def __init__(self, node):
+        self._node = node
+        self._decoded = None
+
+    def _info(self):
+        if self._decoded is None:
+            self._decoded = _decode(self._node._info)
+        return self._decoded
+
+    def copy(self):
+        info = dict(self._info())
+        if self._node.children is not None:
+            info['children'] = self._node.children
+        return info
+
+    def keys(self):
+        keys = list(self._info().keys())
+        if self._node.children is not None:
+            keys.append('children')
+        return keys
+
+    def __contains__(self, key):
+        if key == 'children':
+            return self._node.children is not None
+        return key in self._info()
+
+    def __getitem__(self, key):
+        if key == 'children':
+            if self._node.children is None:
+                raise KeyError(key)
+            return self._node.children
+        node = self._node
+        # a type, name or format in the slots means the part is there
+        if key == 'basic' and node.type is not None:
+            return PartView(self, key, {'type': node.type})
+        if key == 'description' and (node.name is not None or node.format is not None):
+            fields = {}
+            if node.name is not None:
+                fields['name'] = node.name
+            if node.format is not None:
+                fields['format'] = node.format
+            return PartView(self, key, fields)
+        return self._info()[key]
+
+    def __setitem__(self, key, value):
+        if key == 'children':
+            self._node.children = value
+        else:
+            info = self._info()
+            info[key] = value
+            self._node._setinfo(info)
+
+    def __delitem__(self, key):
+        if key == 'children':
+            if self._node.children is None:
+                raise KeyError(key)
+            self._node.children = None
+        else:
+            info = self._info()
+            del info[key]
+            self._node._setinfo(info)
+
+
+class PartView(_DictLike):
+    '''basic or description of an InfoView, read only. fields are the values
+    the node keeps in its slots, which are returned without decoding the
+    info. Pass dict(view) where a real dict is needed, e.g. to send it in
+    an RPC call.'''
+    __slots__ = ('_view', '_key', '_fields')
+
+    def __init__(self, view, key, fields):
+        self._view = view
+        self._key = key
+        self._fields = fields
+
+    def _part(self):
+        return self._view._info()[self._key]
+
+    def keys(self):
+        return list(self._part().keys())
+
+    def __contains__(self, key):
+        return key in self._fields or key in self._part()
+
+    def __getitem__(self, key):
+        if key in self._fields:
+            return self._fields[key]
+        return self._part()[key]
+
+
+def jsonable(obj):
+    '''Pass as the default parameter of json.dumps to serialize trees of
+    ResourceNodes.'''
+    if isinstance(obj, ResourceNode):
+        return {'rid': obj.rid, 'info': obj.info}
+    if isinstance(obj, (InfoView, PartView)):
+        return obj.copy()
+    raise TypeError('{0} is not JSON serializable'.format(repr(obj)))
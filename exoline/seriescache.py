@@ -0,0 +1,264 @@
+'''Local cache of time series data read from the One Platform.'''
+import os
+import json
+import time
+import sqlite3
+import threading
+
+
+class SeriesCache:
+    '''SQLite cache of points read from dataports and datarules, keyed by
+    auth (CIK or auth dict) and RID (or alias). Along with the points, the
+    cache records which time ranges of each series are complete, i.e. every
+    point in them has been read, so that a read only needs to ask the
+    platform for the gaps.
+
+    Each series counts toward maxbytes with an estimate of its size. When
+    the cache gets bigger than that, the least recently used series are
+    dropped.'''
+    filename = 'series.sqlite'
+    # per-point overhead, in bytes, beyond the length of the encoded value
+    pointbytes = 24
+
+    def __init__(self, cachedir, maxbytes=500 * 1024 * 1024):
+        cachedir = os.path.expanduser(cachedir)
+        if not os.path.exists(cachedir):
+            os.makedirs(cachedir)
+        self.path = os.path.join(cachedir, self.filename)
+        self.maxbytes = maxbytes
+        # the same connection is used from _imap_parallel worker threads,
+        # one at a time
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        with self.lock:
+            with self.db:
+                self.db.execute('''CREATE TABLE IF NOT EXISTS series (
+                    id INTEGER PRIMARY KEY,
+                    auth TEXT NOT NULL,
+                    rid TEXT NOT NULL,
+                    used REAL NOT NULL,
+                    bytes INTEGER NOT NULL DEFAULT 0,
+                    UNIQUE (auth, rid))''')
+                self.db.execute('''CREATE TABLE IF NOT EXISTS points (
+                    series INTEGER NOT NULL,
+                    t INTEGER NOT NULL,
+                    v TEXT NOT NULL,
+                    PRIMARY KEY (series, t))''')
+                # complete ranges are inclusive, and don't overlap or
+                # touch other ranges for the same series
+                self.db.execute('''CREATE TABLE IF NOT EXISTS ranges (
+                    series INTEGER NOT NULL,
+                    starttime INTEGER NOT NULL,
+                    endtime INTEGER NOT NULL)''')
+                self.db.execute('''CREATE INDEX IF NOT EXISTS ranges_series
+                    ON ranges (series, starttime)''')
+
+    def _key(self, value):
+        if isinstance(value, dict):
+            return json.dumps(value, sort_keys=True)
+        return value
+
+    def _series(self, auth, rid, create=True):
+        '''Get the id of the series for auth and rid, marking it used.
+        Returns None if it isn't cached and create is False.'''
+        auth, rid = self._key(auth), self._key(rid)
+        row = self.db.execute(
+            'SELECT id FROM series WHERE auth = ? AND rid = ?',
+            (auth, rid)).fetchone()
+        if row is None:
+            if not create:
+                return None
+            cur = self.db.execute(
+                'INSERT INTO series (auth, rid, used) VALUES (?, ?, ?)',
+                (auth, rid, time.time()))
+            return cur.lastrowid
+        self.db.execute('UPDATE series SET used = ? WHERE id = ?',
+                        (time.time(), row[0]))
+        return row[0]
+
+    def series(self, auth, rid):
+        '''Get the id of the series for auth and rid, adding it if needed.
+        Other methods take this id.'''
+        with self.lock:
+            with self.db:
+                return self._series(auth, rid)
+
+    def ranges(self, series, starttime, endtime):
+        '''Return complete ranges for series that overlap
+        [starttime, endtime], clipped to it and in ascending order.'''
+        with self.lock:
+            rows = self.db.execute(
+                '''SELECT starttime, endtime FROM ranges
+                   WHERE series = ? AND starttime <= ? AND endtime >= ?
+                   ORDER BY starttime''',
+                (series, endtime, starttime)).fetchall()
+        return [(max(s, starttime), min(e, endtime)) for s, e in rows]
+
+    def segments(self, series, starttime, endtime):
+        '''Split [starttime, endtime] into (start, end, complete) segments
+        in ascending order, where complete is False for gaps that need to
+        be read from the platform.'''
+        segments = []
+        t = starttime
+        for s, e in self.ranges(series, starttime, endtime):
+            if s > t:
+                segments.append((t, s - 1, False))
+            segments.append((s, e, True))
+            t = e + 1
+        if t <= endtime:
+            segments.append((t, endtime, False))
+        return segments
+
+    def count(self, series, starttime, endtime):
+        '''Number of cached points for series in [starttime, endtime]'''
+        with self.lock:
+            return self.db.execute(
+                '''SELECT COUNT(*) FROM points
+                   WHERE series = ? AND t >= ? AND t <= ?''',
+                (series, starttime, endtime)).fetchone()[0]
+
+    def add(self, series, points, starttime=None, endtime=None):
+        '''Add points, a list of [timestamp, value] in ascending or
+        descending order, that are all the points for series in
+        [starttime, endtime] (by default, the span of points). Cached points
+        in that span are replaced.'''
+        if starttime is None or endtime is None:
+            if len(points) == 0:
+                return
+            starttime = min(points[0][0], points[-1][0])
+            endtime = max(points[0][0], points[-1][0])
+        rows = [(series, t, json.dumps(v)) for t, v in points]
+        lo, hi = starttime, endtime
+        with self.lock:
+            with self.db:
+                count, replaced = self.db.execute(
+                    '''SELECT COUNT(*), COALESCE(SUM(LENGTH(v)), 0) FROM points
+                       WHERE series = ? AND t >= ? AND t <= ?''',
+                    (series, lo, hi)).fetchone()
+                self.db.execute(
+                    'DELETE FROM points WHERE series = ? AND t >= ? AND t <= ?',
+                    (series, lo, hi))
+                self.db.executemany(
+                    'INSERT OR REPLACE INTO points (series, t, v) VALUES (?, ?, ?)',
+                    rows)
+                nbytes = (sum([len(r[2]) + self.pointbytes for r in rows]) -
+                          replaced - count * self.pointbytes)
+                self.db.execute(
+                    'UPDATE series SET bytes = bytes + ? WHERE id = ?',
+                    (nbytes, series))
+
+    def complete(self, series, starttime, endtime):
+        '''Record that every point for series in [starttime, endtime] has
+        been added. Does nothing if starttime > endtime.'''
+        if starttime > endtime:
+            return
+        with self.lock:
+            with self.db:
+                # merge with any ranges this overlaps or touches
+                touching = self.db.execute(
+                    '''SELECT starttime, endtime FROM ranges
+                       WHERE series = ? AND starttime <= ? AND endtime >= ?''',
+                    (series, endtime + 1, starttime - 1)).fetchall()
+                for s, e in touching:
+                    starttime = min(starttime, s)
+                    endtime = max(endtime, e)
+                self.db.execute(
+                    '''DELETE FROM ranges
+                       WHERE series = ? AND starttime >= ? AND endtime <= ?''',
+                    (series, starttime, endtime))
+                self.db.execute(
+                    'INSERT INTO ranges (series, starttime, endtime) VALUES (?, ?, ?)',
+                    (series, starttime, endtime))
+
+    def store(self, series, points, starttime, endtime):
+        '''Add points, a list of [timestamp, value], and record that they
+        are all the points for series in [starttime, endtime].'''
+        self.add(series, points)
+        self.complete(series, starttime, endtime)
+
+    def points(self, series, starttime, endtime, sort='asc', limit=None, pagesize=10000):
+        '''Generate cached [timestamp, value] points for series in
+        [starttime, endtime], in sort order, up to limit points.'''
+        order = 'DESC' if sort == 'desc' else 'ASC'
+        remaining = limit
+        while remaining is None or remaining > 0:
+            n = pagesize if remaining is None else min(pagesize, remaining)
+            with self.lock:
+                rows = self.db.execute(
+                    '''SELECT t, v FROM points
+                       WHERE series = ? AND t >= ? AND t <= ?
+                       ORDER BY t {0} LIMIT ?'''.format(order),
+                    (series, starttime, endtime, n)).fetchall()
+            for t, v in rows:
+                yield [t, json.loads(v)]
+            if len(rows) < n:
+                return
+            if remaining is not None:
+                remaining -= len(rows)
+            if sort == 'desc':
+                endtime = rows[-1][0] - 1
+            else:
+                starttime = rows[-1][0] + 1
+
+    def _drop(self, ids):
+        for i in ids:
+            self.db.execute('DELETE FROM points WHERE series = ?', (i,))
+            self.db.execute('DELETE FROM ranges WHERE series = ?', (i,))
+            self.db.execute('DELETE FROM series WHERE id = ?', (i,))
+
+    def evict(self, keep=[]):
+        '''Drop least recently used series until the cache fits in
+        maxbytes. Series with ids in keep are not dropped.'''
+        with self.lock:
+            with self.db:
+                total = self.db.execute(
+                    'SELECT COALESCE(SUM(bytes), 0) FROM series').fetchone()[0]
+                if total <= self.maxbytes:
+                    return 0
+                drop = []
+                for i, nbytes in self.db.execute(
+                        'SELECT id, bytes FROM series ORDER BY used').fetchall():
+                    if total <= self.maxbytes:
+                        break
+                    if i in keep:
+                        continue
+                    drop.append(i)
+                    total -= nbytes
+                self._drop(drop)
+                return len(drop)
+
+    def clear(self, auth=None, rid=None):
+        '''Drop cached series for auth and rid. If rid is None, drop all
+        series for auth, and if auth is also None, drop everything.'''
+        with self.lock:
+            with self.db:
+                if auth is None:
+                    rows = self.db.execute('SELECT id FROM series').fetchall()
+                elif rid is None:
+                    rows = self.db.execute(
+                        'SELECT id FROM series WHERE auth = ?',
+                        (self._key(auth),)).fetchall()
+                else:
+                    rows = self.db.execute(
+                        'SELECT id FROM series WHERE auth = ? AND rid = ?',
+                        (self._key(auth), self._key(rid))).fetchall()
+                self._drop([r[0] for r in rows])
+            if auth is None:
+                # give the space back
+                self.db.execute('VACUUM')
+        return len(rows)
+
+    def stats(self):
+        '''Return a dict of cache statistics'''
+        with self.lock:
+            series, nbytes = self.db.execute(
+                'SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM series').fetchone()
+            points = self.db.execute('SELECT COUNT(*) FROM points').fetchone()[0]
+            ranges = self.db.execute('SELECT COUNT(*) FROM ranges').fetchone()[0]
+        return {'path': self.path,
+                'series': series,
+                'points': points,
+                'ranges': ranges,
+                'bytes': nbytes,
+                'maxbytes': self.maxbytes,
+                'filebytes': os.path.getsize(self.path)}
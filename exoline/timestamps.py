@@ -0,0 +1,134 @@
+'''Fast timestamp parsing for streams of timestamps, e.g. record input.
+
+ExoUtilities.parse_ts parses any timestamp dateutil understands, which is
+slow for large inputs. Rows in a stream almost always share a format, so
+TimestampParser works out the format from the first timestamp it can,
+then parses each later one with a precompiled regular expression. Any
+timestamp that doesn't match goes through dateutil, so the results are
+the same as parse_ts (or int() for Unix timestamps, as record does):
+timestamps without a time zone are local time, and the time zone of
+timestamps that have one is ignored.
+'''
+from __future__ import unicode_literals
+import re
+import time
+from datetime import datetime
+
+from dateutil import parser
+
+
+RE_EPOCH = re.compile(r'^[-+]?[0-9]+$')
+
+
+def _twodigityear(year):
+    '''Expand a two digit year to within 50 years of now, as dateutil
+    does'''
+    now = time.localtime().tm_year
+    year += now // 100 * 100
+    if year >= now + 50:
+        year -= 100
+    elif year < now - 50:
+        year += 100
+    return year
+
+
+def _mktime(year, month, day, hour, minute, second, hastz):
+    '''Return the Unix timestamp for local time, or None if the fields
+    aren't a valid time. dateutil gives timestamps with a time zone
+    tm_isdst 0, and those without -1 (let mktime decide).'''
+    try:
+        t = datetime(year, month, day, hour, minute, second).timetuple()
+    except ValueError:
+        return None
+    if hastz:
+        t = t[:8] + (0,)
+    return int(time.mktime(t))
+
+
+def _epoch(m):
+    return int(m.group(0))
+
+
+# 2015-10-06, 2015-10-06T12:34, 2015-10-06 12:34:56.789+00:00, ...
+RE_ISO8601 = re.compile(
+    r'^(\d{4})-(\d{2})-(\d{2})'
+    r'(?:[T ](\d{2}):(\d{2})(?::(\d{2})(?:[.,]\d+)?)?'
+    r'(Z|[+-]\d{2}(?::?\d{2})?)?)?$')
+
+
+def _iso8601(m):
+    year, month, day, hour, minute, second, tz = m.groups()
+    return _mktime(int(year), int(month), int(day),
+                   0 if hour is None else int(hour),
+                   0 if minute is None else int(minute),
+                   0 if second is None else int(second),
+                   tz is not None)
+
+
+# 10/6/15 12:34:56, 10/06/2015 12:34, 10/6/2015, ... (month first)
+RE_SLASHES = re.compile(
+    r'^(\d{1,2})/(\d{1,2})/(\d{4}|\d{2})'
+    r'(?: (\d{1,2}):(\d{2})(?::(\d{2}))?)?$')
+
+
+def _slashes(m):
+    month, day, year, hour, minute, second = m.groups()
+    month = int(month)
+    day = int(day)
+    if month > 12:
+        # dateutil reads this as day first
+        return None
+    year = int(year) if len(year) == 4 else _twodigityear(int(year))
+    return _mktime(year, month, day,
+                   0 if hour is None else int(hour),
+                   0 if minute is None else int(minute),
+                   0 if second is None else int(second),
+                   False)
+
+
+class TimestampParser(object):
+    '''Parse a stream of timestamps into Unix timestamps. The format is
+    detected from the first timestamp that's in one of formats, and used
+    as a fast path for the rest.'''
+    # (name, regular expression, function of the match that returns the
+    # timestamp or None to fall back to dateutil)
+    formats = [('epoch', RE_EPOCH, _epoch),
+               ('iso8601', RE_ISO8601, _iso8601),
+               ('slashes', RE_SLASHES, _slashes)]
+
+    def __init__(self):
+        # detected format, or None
+        self.format = None
+        self._regex = None
+        self._fn = None
+        # timestamps parsed by the fast path and by dateutil
+        self.fast = 0
+        self.slow = 0
+
+    def _detect(self, s):
+        for name, regex, fn in self.formats:
+            m = regex.match(s)
+            if m is not None:
+                ts = fn(m)
+                if ts is not None:
+                    self.format, self._regex, self._fn = name, regex, fn
+                    return ts
+        return None
+
+    def parse(self, s):
+        '''Return the Unix timestamp for s, or None if s is None. Raises
+        ValueError (or whatever dateutil raises) if s isn't a timestamp.'''
+        if s is None:
+            return None
+        if self._fn is None:
+            ts = self._detect(s)
+        else:
+            m = self._regex.match(s)
+            ts = None if m is None else self._fn(m)
+        if ts is not None:
+            self.fast += 1
+            return ts
+        self.slow += 1
+        if RE_EPOCH.match(s) is not None:
+            return int(s)
+        return int(time.mktime(parser.parse(s).timetuple()))
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""Exoline benchmarks
+   Measures exoline internals on synthetic data. Doesn't need a server.
+
+Usage:
+  benchmark.py infotree [--nodes=<n>] [--fanout=<n>]
+  benchmark.py timestamps [--rows=<n>]
+
+Options:
+  --nodes=<n>   number of resources in the synthetic tree [default: 100000]
+  --fanout=<n>  resources per client [default: 50]
+  --rows=<n>    number of timestamps to parse in each format [default: 100000]
+"""
+from __future__ import unicode_literals
+from __future__ import print_function
+
+import sys
+import os
+import re
+import json
+import time
+import random
+import gc
+from datetime import datetime
+
+from docopt import docopt
+from dateutil import parser as dateparser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from exoline import resourcenode
+from exoline import timestamps
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+def randomrid():
+    return '%040x' % random.getrandbits(160)
+
+
+def synthetic_info(typ, i):
+    '''Return info like info with all options for a resource'''
+    now = 1444000000 + i
+    info = {
+        'basic': {'type': typ,
+                  'status': 'activated',
+                  'modified': now,
+                  'subscribers': 0,
+                  'activity': [[now - 60 * j, 1] for j in range(10)]},
+        'description': {'name': '{0} {1}'.format(typ, i),
+                        'meta': json.dumps({'datasource': {'unit': 'C'}, 'index': i}),
+                        'public': False},
+        'counts': dict((t, 0) for t in ['client', 'dataport', 'datarule', 'dispatch',
+                                        'disk', 'email', 'http', 'share', 'sms', 'xmpp']),
+        'usage': dict((t, 0) for t in ['client', 'dataport', 'datarule', 'dispatch',
+                                       'disk', 'email', 'http', 'share', 'sms', 'xmpp']),
+        'comments': [],
+        'shares': [],
+        'subscribers': [],
+        'tags': [],
+        'storage': {'count': i, 'first': now - 86400, 'last': now, 'size': 16 * i},
+    }
+    if typ == 'client':
+        info['key'] = randomrid()
+        info['aliases'] = {}
+        info['description']['limits'] = dict(
+            (t, 'inherit') for t in ['client', 'dataport', 'datarule', 'dispatch', 'disk', 'io'])
+    else:
+        info['description']['format'] = random.choice(['float', 'integer', 'string'])
+        info['description']['retention'] = {'count': 'infinity', 'duration': 'infinity'}
+        info['aliases'] = []
+    return info
+
+
+def build_tree(nodes, fanout, makenode):
+    '''Build a tree of nodes resources using makenode(rid, info,
+    children). Each client has fanout children, up to 5 of which are
+    clients.'''
+    count = 1
+    root = makenode(randomrid(), synthetic_info('client', 0), [])
+    clients = [root]
+    while count < nodes:
+        nextclients = []
+        for client in clients:
+            children = client['info']['children']
+            for i in range(fanout):
+                if count == nodes:
+                    break
+                typ = 'client' if i < 5 else 'dataport'
+                child = makenode(randomrid(), synthetic_info(typ, count), [] if typ == 'client' else None)
+                children.append(child)
+                if typ == 'client':
+                    nextclients.append(child)
+                count += 1
+        clients = nextclients
+    return root
+
+
+def dictnode(rid, info, children):
+    if children is not None:
+        info['children'] = children
+    return {'rid': rid, 'info': info}
+
+
+def compactnode(rid, info, children):
+    return resourcenode.ResourceNode(rid, info, children=children)
+
+
+def measure(fn):
+    '''Return the result of fn, the bytes it allocated and kept, and the
+    time it took'''
+    gc.collect()
+    if tracemalloc is not None:
+        tracemalloc.start()
+    start = time.time()
+    result = fn()
+    elapsed = time.time() - start
+    gc.collect()
+    size = None
+    if tracemalloc is not None:
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+    return result, size, elapsed
+
+
+def infotree_benchmark(nodes, fanout):
+    if tracemalloc is None:
+        print('memory use is measured with tracemalloc, which needs Python 3.4 or later')
+    results = []
+    for name, makenode in [('dict', dictnode), ('ResourceNode', compactnode)]:
+        random.seed(0)
+        tree, size, elapsed = measure(lambda: build_tree(nodes, fanout, makenode))
+        start = time.time()
+        serialized = json.dumps(tree, default=resourcenode.jsonable, sort_keys=True)
+        dumptime = time.time() - start
+        results.append((name, size, elapsed, dumptime, serialized))
+        del tree
+    print('{0} resources, {1} per client'.format(nodes, fanout))
+    for name, size, elapsed, dumptime, _ in results:
+        print('{0:>13}: {1} {2:.1f}s to build, {3:.1f}s to serialize'.format(
+            name,
+            'memory not measured' if size is None else '{0:.1f} MB,'.format(size / 1e6),
+            elapsed,
+            dumptime))
+    if results[0][1] is not None:
+        print('ResourceNode tree is {0:.1f}x smaller'.format(float(results[0][1]) / results[1][1]))
+    if results[0][4] != results[1][4]:
+        print('ERROR: trees serialize differently')
+        sys.exit(1)
+
+
+def record_parse_ts(s):
+    '''Parse a timestamp the way record did before TimestampParser (with
+    ExoUtilities.parse_ts, which isn't imported to avoid loading exo's
+    plugins)'''
+    if s is not None and re.match('^[-+]?[0-9]+$', s) is not None:
+        return int(s)
+    return int(time.mktime(dateparser.parse(s).timetuple()))
+
+
+def timestamps_benchmark(rows):
+    random.seed(0)
+    start = 1262304000
+    times = [datetime.fromtimestamp(start + random.randint(0, 10 * 365 * 86400))
+             for i in range(rows)]
+    formats = [('epoch', lambda t: str(int(time.mktime(t.timetuple())))),
+               ('ISO-8601', lambda t: t.strftime('%Y-%m-%dT%H:%M:%S')),
+               ('ISO-8601 UTC', lambda t: t.strftime('%Y-%m-%dT%H:%M:%S.123Z')),
+               ('m/d/y', lambda t: t.strftime('%m/%d/%y %H:%M:%S'))]
+    print('{0} timestamps in each format'.format(rows))
+    for name, fmt in formats:
+        strings = [fmt(t) for t in times]
+        start = time.time()
+        expected = [record_parse_ts(s) for s in strings]
+        oldtime = time.time() - start
+        parser = timestamps.TimestampParser()
+        start = time.time()
+        parsed = [parser.parse(s) for s in strings]
+        newtime = time.time() - start
+        print('{0:>13}: parse_ts {1:.0f}/s, TimestampParser {2:.0f}/s ({3:.1f}x, {4} fast)'.format(
+            name,
+            rows / oldtime,
+            rows / newtime,
+            oldtime / newtime,
+            parser.fast))
+        if parsed != expected:
+            print('ERROR: TimestampParser and parse_ts differ')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+    if args['infotree']:
+        infotree_benchmark(int(args['--nodes']), int(args['--fanout']))
+    elif args['timestamps']:
+        timestamps_benchmark(int(args['--rows']))
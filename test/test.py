@@ -21,6 +21,7 @@ import string
 import filecmp
 import tempfile
 import zipfile
+import struct
 
 import ruamel.yaml as yaml
 from six import iteritems
@@ -30,6 +31,9 @@ from tzlocal import get_localzone
 
 from exoline import exo
 from exoline.exo import ExolineOnepV1
+from exoline import resourcenode
+from exoline.batchsizer import BatchSizer
+import pyonep
 from pyonep import provision
 
 NOTEARDOWN = False
@@ -66,6 +70,34 @@ def abbrev(s, length=1000):
         s = s[:length // 2] + '\n...\n' + s[-length // 2:]
     return s
 
+def read_columnar(path):
+    '''Load a --format=columnar directory as [[timestamp, [values]], ...]'''
+    with open(os.path.join(path, 'manifest.json')) as f:
+        manifest = json.load(f)
+    n = manifest['rows']
+    def load(filename):
+        with open(os.path.join(path, filename), 'rb') as f:
+            return f.read()
+    timestamps = struct.unpack('<{0}q'.format(n), load(manifest['timestamp']['file']))
+    columns = []
+    for c in manifest['columns']:
+        raw = load(c['file'])
+        if c['type'] == 'string':
+            values = []
+            i = 0
+            while i < len(raw):
+                length = struct.unpack('<I', raw[i:i + 4])[0]
+                values.append(raw[i + 4:i + 4 + length].decode('utf-8'))
+                i += 4 + length
+        else:
+            code = 'q' if c['type'] == 'int64' else 'd'
+            values = list(struct.unpack('<{0}{1}'.format(n, code), raw))
+        if 'valid' in c:
+            valid = bytearray(load(c['valid']))
+            values = [v if valid[i] else None for i, v in enumerate(values)]
+        columns.append(values)
+    return [[t, [c[i] for c in columns]] for i, t in enumerate(timestamps)]
+
 def argmatch(args, pattern):
     for a in args:
         if re.match(pattern, a):
@@ -528,6 +560,58 @@ class TestRPC(TestCase):
                 _recordAndVerify(r, on_stdin)
                 _flush(r)
 
+    def record_csv_test(self):
+        '''Record CSV from stdin in chunks'''
+        cik = self.client.cik()
+        ridInt, ridStr = self._createMultiple(cik, [
+            Resource(cik, 'dataport', {'format': 'integer', 'name': 'int_port'}),
+            Resource(cik, 'dataport', {'format': 'string', 'name': 'string_port'})])
+        # 7 rows is 3 requests of --chunksize=3
+        stdin = '\n'.join(['{0},{1},s{0}'.format(t, t * 10) for t in range(1, 8)])
+        r = rpc('--parallel=2', 'record', cik, ridInt, ridStr, '--chunksize=3', '-', stdin=stdin)
+        self.ok(r, 'record CSV in chunks')
+        r = rpc('read', cik, ridInt, '--start=1', '--end=7', '--timeformat=unix', '--limit=10', '--sort=asc')
+        self.ok(r, 'all rows recorded',
+                match='\n'.join(['{0},{1}'.format(t, t * 10) for t in range(1, 8)]))
+        r = rpc('read', cik, ridStr, '--start=1', '--end=7', '--timeformat=unix', '--limit=10')
+        self.ok(r, 'string column recorded', search='7,s7')
+
+        # timestamps in other formats are local time
+        rows = [(datetime(2015, 10, 6, 12, 34, 56), '2015-10-06T12:34:56'),
+                (datetime(2015, 10, 7, 1, 2, 3), '10/7/15 01:02:03')]
+        stdin = '\n'.join(['{0},{1},x'.format(s, i) for i, (dt, s) in enumerate(rows)])
+        r = rpc('record', cik, ridInt, ridStr, '-', stdin=stdin)
+        self.ok(r, 'record CSV with formatted timestamps')
+        for i, (dt, s) in enumerate(rows):
+            ts = int(time.mktime(dt.timetuple()))
+            r = rpc('read', cik, ridInt, '--start={0}'.format(ts), '--end={0}'.format(ts),
+                    '--timeformat=unix', '--limit=1')
+            self.ok(r, 'timestamp ' + s, match='{0},{1}'.format(ts, i))
+
+    def record_fanout_test(self):
+        '''Record CSV to several clients with --fanout'''
+        cik = self.client.cik()
+        childciks = []
+        for i in range(2):
+            r = rpc('create', cik, '--type=client', '--name=fanout' + str(i), '--cikonly')
+            self.ok(r, 'create child')
+            childcik = r.stdout.strip()
+            self._createMultiple(childcik, [
+                Resource(childcik, 'dataport', {'format': 'integer', 'name': 'temp'}, alias='temp')])
+            childciks.append(childcik)
+        header = ['timestamp'] + [c + ':temp' for c in childciks]
+        # client 1 has no value at time 2
+        stdin = '\n'.join([','.join(header), '1,10,100', '2,20,', '3,30,300'])
+        r = rpc('--parallel=2', 'record', '--fanout', '--chunksize=2', '-', stdin=stdin)
+        self.ok(r, 'record --fanout')
+        r = rpc('read', childciks[0], 'temp', '--start=1', '--end=3', '--timeformat=unix', '--limit=10')
+        self.ok(r, 'first client recorded', match='3,30\n2,20\n1,10')
+        r = rpc('read', childciks[1], 'temp', '--start=1', '--end=3', '--timeformat=unix', '--limit=10')
+        self.ok(r, 'empty cell skipped', match='3,300\n1,100')
+
+        r = rpc('record', '--fanout', '-', stdin='timestamp,nocolon\n1,2')
+        self.notok(r, 'bad header')
+
     def run_tree_tsts(self, treecmd='tree', options=[]):
         cik = self.client.cik()
 
@@ -592,6 +676,109 @@ class TestRPC(TestCase):
         '''Twee command'''
         self.run_tree_tsts('twee', ['--nocolor'])
 
+    def parallel_test(self):
+        '''Batched commands with --parallel'''
+        cik = self.client.cik()
+        self._createDataports()
+        for i in range(3):
+            r = rpc('create', cik, '--type=client', '--name=child' + str(i), '--cikonly')
+            self.ok(r, 'create child')
+            self._createDataports(r.stdout)
+        r = rpc('whee', cik)
+        self.ok(r, 'whee')
+        expected = json.loads(r.stdout)
+        r = rpc('--parallel=4', 'whee', cik)
+        self.ok(r, 'whee with --parallel')
+        self.assertEqual(json.loads(r.stdout), expected,
+                         'whee with --parallel should match serial output')
+        r = rpc('info', cik, '--recursive', '--include=aliases,description,key')
+        self.ok(r, 'info --recursive')
+        expected = json.loads(r.stdout)
+        r = rpc('--parallel=4', 'info', cik, '--recursive', '--include=aliases,description,key')
+        self.ok(r, 'info --recursive with --parallel')
+        self.assertEqual(json.loads(r.stdout), expected,
+                         'info --recursive with --parallel should match serial output')
+        r = rpc('--parallel=0', 'whee', cik)
+        self.notok(r, '--parallel=0 should fail')
+
+    def find_test(self):
+        '''Find descendants that match'''
+        cik = self.client.cik()
+        stdports = self._createDataports()
+        r = rpc('create', cik, '--type=client', '--name=child', '--cikonly', '-',
+                stdin=json.dumps({
+                    'limits': dict((t, 'inherit') for t in
+                                   ['client', 'dataport', 'datarule', 'dispatch', 'disk', 'io']),
+                    'meta': json.dumps({'device': {'model': 'findmodel'}})}))
+        self.ok(r, 'create child')
+        childcik = r.stdout
+        childports = self._createDataports(childcik)
+        r = rpc('find', cik, '--match', 'model=findmodel')
+        self.ok(r, 'find by meta', match=childcik)
+        r = rpc('find', cik, '--match', 'name=float_port', '--show', 'rid')
+        self.ok(r, 'find descendants')
+        self.assertEqual(sorted(r.stdout.splitlines()),
+                         sorted([stdports['float'].rid, childports['float'].rid]))
+        otherrid = self._createMultiple(childcik, [
+            Resource(childcik, 'dataport', {'format': 'integer', 'name': 'other_int_port'})])[0]
+        r = rpc('find', cik, '--match', 'format=integer,name^int_port', '--show', 'rid')
+        self.ok(r, 'find with ^')
+        self.assertEqual(r.stdout.splitlines(), [otherrid],
+                         'only the integer port not named int_port is found')
+
+    def index_test(self):
+        '''Local resource index with --useindex'''
+        cik = self.client.cik()
+        self._createDataports()
+        r = rpc('create', cik, '--type=client', '--name=child', '--cikonly')
+        self.ok(r, 'create child')
+        childcik = r.stdout
+        indexdir = tempfile.mkdtemp()
+        index = ['--indexdir=' + indexdir]
+        r = rpc(*(index + ['--useindex', 'search', cik, 'port', '--nocolor', '--silent']))
+        self.notok(r, 'search --useindex before refresh')
+        r = rpc(*(index + ['index', 'refresh', cik]))
+        self.ok(r, 'index refresh')
+        r = rpc('search', cik, 'port', '--nocolor', '--silent')
+        self.ok(r, 'search')
+        expected = r.stdout
+        r = rpc(*(index + ['--useindex', 'search', cik, 'port', '--nocolor', '--silent']))
+        self.ok(r, 'search --useindex', match=re.escape(expected))
+
+        self._createDataports(childcik)
+        r = rpc(*(index + ['index', 'refresh', cik]))
+        self.ok(r, 'index refresh after change')
+        r = rpc('find', cik, '--match', 'name=float_port', '--show', 'rid')
+        self.ok(r, 'find')
+        expected = sorted(r.stdout.splitlines())
+        self.assertEqual(len(expected), 2, 'find dataports in client and child')
+        r = rpc(*(index + ['--useindex', 'find', cik, '--match', 'name=float_port', '--show', 'rid']))
+        self.ok(r, 'find --useindex')
+        self.assertEqual(sorted(r.stdout.splitlines()), expected, 'refresh picked up new dataports')
+
+        r = rpc(*(index + ['index', 'clear', cik]))
+        self.ok(r, 'index clear')
+
+    def infotree_compact_test(self):
+        '''Compact infotrees work like dict infotrees'''
+        cik = self.client.cik()
+        self._createDataports()
+        r = rpc('create', cik, '--type=client', '--name=child', '--cikonly')
+        self.ok(r, 'create child')
+        self._createDataports(r.stdout)
+        er = makeRPC()
+        expected = er._infotree(cik)
+        tree = er._infotree(cik, compact=True)
+        self.assertEqual(json.loads(json.dumps(tree, default=resourcenode.jsonable)),
+                         json.loads(json.dumps(expected)),
+                         'compact infotree should serialize like dict infotree')
+        self.assertEqual(tree, expected, 'compact infotree should compare equal')
+        child = [c for c in tree['info']['children'] if c['info']['basic']['type'] == 'client'][0]
+        self.assertEqual(child['info']['description']['name'], 'child')
+        self.assertTrue('children' in child['info'], 'child client has children')
+        tree['info']['key'] = cik
+        self.assertEqual(tree['info']['key'], cik, 'info changes are kept')
+
     def map_test(self):
         '''Map/unmap commands'''
         stdports = self._createDataports()
@@ -1159,6 +1346,82 @@ class TestRPC(TestCase):
         r = rpc('read', cik, rid1, '--start=44', '--timeformat=unix', '--limit=2')
         self.ok(r, '--end has a default', match='[0-9]+,12.36')
 
+    @attr('read')
+    def read_shards_test(self):
+        '''Read --shards option'''
+        cik = self.client.cik()
+        rids = self._createMultiple(cik, [
+            Resource(cik, 'dataport', {'format': 'integer', 'name': 'dense'}),
+            Resource(cik, 'dataport', {'format': 'integer', 'name': 'sparse'})])
+        r = rpc('record', cik, rids[0], *['--value={0},{0}'.format(t) for t in range(1, 101)])
+        self.ok(r, 'record dense values')
+        r = rpc('record', cik, rids[1], '--value=5,1', '--value=50,2', '--value=95,3')
+        self.ok(r, 'record sparse values')
+        for sort in ['asc', 'desc']:
+            readcmd = ['read', cik, rids[0], rids[1], '--timeformat=unix',
+                       '--limit=90', '--sort=' + sort, '--chunksize=7']
+            r = rpc(*readcmd)
+            self.ok(r, 'read in chunks')
+            expected = r.stdout
+            # 90 dense points plus one sparse point at its own timestamp
+            self.assertEqual(len(expected.splitlines()), 91)
+            r = rpc(*(readcmd + ['--shards=4']))
+            self.ok(r, 'read in shards')
+            self.assertEqual(r.stdout, expected, 'sharded read should match')
+
+    @attr('read')
+    def read_cache_test(self):
+        '''Read with --cachedir'''
+        cik = self.client.cik()
+        rid = self._createMultiple(cik, [
+            Resource(cik, 'dataport', {'format': 'integer', 'name': 'cached'})])[0]
+        r = rpc('record', cik, rid, *['--value={0},{0}'.format(t) for t in range(1, 21)])
+        self.ok(r, 'record values')
+        cachedir = tempfile.mkdtemp()
+        readcmd = ['--cachedir=' + cachedir, 'read', cik, rid, '--timeformat=unix']
+        r = rpc(*(readcmd + ['--limit=5']))
+        self.ok(r, 'read into cache', match='20,20\r?\n19,19')
+        expected = r.stdout
+        r = rpc(*(readcmd + ['--limit=5']))
+        self.ok(r, 'read from cache')
+        self.assertEqual(r.stdout, expected, 'cached read should match')
+        r = rpc(*(readcmd + ['--sort=asc', '--limit=3']))
+        self.ok(r, 'read a range not in cache', match='1,1\r?\n2,2\r?\n3,3')
+        r = rpc('--cachedir=' + cachedir, 'cache', 'stats')
+        self.ok(r, 'cache stats', search='series: +1')
+        r = rpc('--cachedir=' + cachedir, 'write', cik, rid, '--value=21')
+        self.ok(r, 'write through cache')
+        r = rpc('--cachedir=' + cachedir, 'cache', 'stats')
+        self.ok(r, 'write clears series', search='series: +0')
+        r = rpc(*(readcmd + ['--limit=1']))
+        self.ok(r, 'written value read', search=',21')
+        r = rpc('--cachedir=' + cachedir, 'cache', 'clear')
+        self.ok(r, 'cache clear', match='cleared 1 series')
+        r = rpc('cache', 'stats', noconfig=True)
+        self.notok(r, 'cache stats with no cache')
+
+    @attr('read')
+    def read_columnar_test(self):
+        '''Read --format=columnar'''
+        cik = self.client.cik()
+        rids = self._createMultiple(cik, [
+            Resource(cik, 'dataport', {'format': 'integer', 'name': 'int_port'}),
+            Resource(cik, 'dataport', {'format': 'float', 'name': 'float_port'}),
+            Resource(cik, 'dataport', {'format': 'string', 'name': 'string_port'})])
+        self.ok(rpc('record', cik, rids[0], '--value=1,10', '--value=2,20'), 'record integers')
+        self.ok(rpc('record', cik, rids[1], '--value=2,2.5', '--value=3,3.5'), 'record floats')
+        self.ok(rpc('record', cik, rids[2], '--value=1,a', '--value=3,你好'), 'record strings')
+        outdir = tempfile.mkdtemp()
+        r = rpc('read', cik, rids[0], rids[1], rids[2], '--limit=10', '--sort=asc',
+                '--format=columnar', '--output=' + outdir)
+        self.ok(r, 'read columnar')
+        self.assertEqual(read_columnar(outdir), [
+            [1, [10, None, 'a']],
+            [2, [20, 2.5, None]],
+            [3, [None, 3.5, '你好']]])
+        r = rpc('read', cik, rids[0], '--format=columnar')
+        self.notok(r, 'columnar needs --output')
+
     @attr('read')
     def read_selection_test(self):
         '''Read --selection option'''
@@ -1213,6 +1476,72 @@ class TestRPC(TestCase):
         r = rpc('read', cik, rid, '--limit=3', '--format=raw', '--sort=desc')
         self.ok(r, 'read two points, descending', match="3.0\n2.0\n1.0")
 
+    def write_batched_test(self):
+        '''Write to many resources with --set and --ndjson'''
+        cik = self.client.cik()
+        self._createMultiple(cik, [
+            Resource(cik, 'dataport', {'format': 'integer', 'name': 'one'}, alias='one'),
+            Resource(cik, 'dataport', {'format': 'string', 'name': 'two'}, alias='two')])
+
+        r = rpc('write', cik, '--set=one=1', '--set=two=a=b')
+        self.ok(r, 'write with --set')
+        r = rpc('read', cik, 'one', '--format=raw')
+        self.ok(r, 'first value written', match='1')
+        r = rpc('read', cik, 'two', '--format=raw')
+        self.ok(r, 'value is after the first =', match='a=b')
+
+        stdin = '\n'.join([
+            json.dumps({'rid': 'one', 'value': 2}),
+            json.dumps({'cik': cik, 'rid': 'two', 'value': {'x': 1}}),
+            json.dumps({'rid': 'missing', 'value': 3})])
+        r = rpc('write', cik, '--ndjson', '-', stdin=stdin)
+        self.notok(r, 'one write fails')
+        self.assertTrue('missing' in r.stderr, 'failed write is reported')
+        r = rpc('read', cik, 'one', '--format=raw')
+        self.ok(r, 'other writes succeed', match='2')
+        r = rpc('read', cik, 'two', '--format=raw')
+        self.ok(r, 'non-string values written as JSON', match='{"x": 1}')
+
+        # without <cik>, each line names its client
+        r = rpc('create', cik, '--type=client', '--name=ndjsonchild', '--cikonly')
+        self.ok(r, 'create child')
+        childcik = r.stdout.strip()
+        self._createMultiple(childcik, [
+            Resource(childcik, 'dataport', {'format': 'integer', 'name': 'one'}, alias='one')])
+        stdin = '\n'.join([
+            json.dumps({'cik': cik, 'rid': 'one', 'value': 4}),
+            json.dumps({'cik': childcik, 'rid': 'one', 'value': 5})])
+        r = rpc('write', '--ndjson', '-', stdin=stdin)
+        self.ok(r, 'write --ndjson without <cik>')
+        r = rpc('read', cik, 'one', '--format=raw')
+        self.ok(r, 'first client written', match='4')
+        r = rpc('read', childcik, 'one', '--format=raw')
+        self.ok(r, 'second client written', match='5')
+        r = rpc('write', '--ndjson', '-', stdin=json.dumps({'rid': 'one', 'value': 6}))
+        self.notok(r, 'line without "cik" needs <cik>')
+
+    def batch_test(self):
+        '''Run several commands with batch'''
+        cik = self.client.cik()
+        self._createMultiple(cik, [
+            Resource(cik, 'dataport', {'format': 'integer', 'name': 'one'}, alias='one')])
+        stdin = '\n'.join([
+            '# comment',
+            'write {0} one --value=3'.format(cik),
+            'exo read {0} one --format=raw'.format(cik),
+            '',
+            'read {0} missing'.format(cik),
+            'read {0} one --format=raw'.format(cik)])
+        r = rpc('batch', stdin=stdin)
+        self.notok(r, 'batch with a failing command')
+        self.assertEqual(
+            r.stdout,
+            '# line 2 exit 0\n3\n# line 3 exit 0\n# line 5 exit 1\n3\n# line 6 exit 0',
+            'each command runs and is followed by its exit code')
+        r = rpc('batch', '--stoponerror', stdin=stdin)
+        self.notok(r, 'batch --stoponerror')
+        self.assertTrue(r.stdout.endswith('# line 5 exit 1'), 'stops at failing command')
+
     def stripcarriage_test(self):
         '''Read command handles carriage-returns correctly'''
         cik = self.client.cik()
@@ -2441,25 +2770,32 @@ class TestRPC(TestCase):
         # search with match case
         r = rpc('search', cik, 'Alias', '--matchcase')
         self.ok(r, 'no response with --matchcase', match='')
+        r = rpc('search', cik, 'FLOAT_ALIAS', '--silent', '--nocolor')
+        self.ok(r, 'ignore case without --matchcase', search='alias:float_alias')
 
         # search for script content
         r = rpc('search', cik, 'World', '--matchcase')
         self.ok(r, 'script matches', search='debug\("')
+        r = rpc('search', cik, 'World', '--matchcase', '--processes=2')
+        self.ok(r, 'script matches in processes', search='debug\("')
 
         # search for serial number
-        # why is this not working? It works at the command line.
-        #r = rpc('search', cik, sn, '--silent')
-        #self.l('stderr is: ' + r.stderr)
-        #self.l('stdout is: ' + r.stdout)
-        #self.ok(r, 'serial number found', search=sn)
-        #self.ok(r, 'correct cik in match', search=cik)
-        #self.assertEqual(len(r.stdout.split('\n')), 1, 'exactly one serial number match')
+        r = rpc('search', cik, sn, '--silent')
+        self.l('stderr is: ' + r.stderr)
+        self.l('stdout is: ' + r.stdout)
+        self.ok(r, 'serial number found', search=sn)
+        self.ok(r, 'correct cik in match', search=clonecik)
+        self.assertEqual(len(r.stdout.split('\n')), 1, 'exactly one serial number match')
 
         r = rpc('search', cik, '你.4')
         self.ok(r, search='你好4')
         self.l(r.stdout)
         self.assertEqual(len(r.stdout.split('\n')), 2, 'two matches: client model and clone')
 
+        r = rpc('search', cik, '你.4', '--max-results=1')
+        self.ok(r, 'stop after --max-results', search='你好4')
+        self.assertEqual(len(r.stdout.split('\n')), 1, 'one match with --max-results=1')
+
     def dump_test(self):
         '''Dump command'''
         cik = self.client.cik()
@@ -2542,6 +2878,38 @@ class TestRPC(TestCase):
         testChildResource(childit, rid=ridString, name='string_port', vals=valsString, alias='string_alias')
         testChildResource(childit, rid=ridInteger, name='integer_port', vals=valsInteger, alias='int3ger_alias')
         testChildResource(childit, rid=ridScript, name='script_port', vals=[])
+        self.assertFalse(os.path.exists(dumpfile + '.checkpoint.json'),
+                         'checkpoint is removed when dump finishes')
+
+        # --resume with no checkpoint is a full dump
+        r = rpc('dump', cik, dumpfile, '--resume')
+        self.ok(r, 'dump --resume')
+        resumed = extract_zip(dumpfile)
+        del resumed['dump.json']
+        del dumpzip['dump.json']
+        self.assertEqual(resumed, dumpzip, 'dump --resume with no checkpoint')
+
+        # restore makes a copy with the same time series
+        r = rpc('restore', cik, dumpfile, '--cikonly')
+        self.ok(r, 'restore', match=self.RE_RID)
+        restoredfile = 'testrestore.zip'
+        r = rpc('dump', r.stdout, restoredfile)
+        self.ok(r, 'dump restored client')
+        def series(dz):
+            return sorted([v for k, v in dz.items() if k not in ['infotree.json', 'dump.json']])
+        self.assertEqual(series(extract_zip(restoredfile)), series(dumpzip),
+                         'restored time series match')
+
+        # columnar dump has the same points
+        dumpdir = tempfile.mkdtemp()
+        os.rmdir(dumpdir)
+        r = rpc('dump', cik, dumpdir, '--format=columnar')
+        self.ok(r, 'dump --format=columnar')
+        for rid, vals in [(ridFloat, valsFloat), (ridString, valsString), (ridInteger, valsInteger)]:
+            self.assertEqual(
+                read_columnar(os.path.join(dumpdir, 'dataport.' + rid)),
+                [[t, [v]] for t, v in vals],
+                'columnar dump matches for ' + rid)
 
     def meta_test(self):
         '''Meta command'''
@@ -2667,6 +3035,184 @@ class TestRPC(TestCase):
         os.remove(file)
 
 
+class FakeOnep():
+    '''Stands in for an ExolineOnepV1 connection, without a server.
+    Requests with more than maxcalls calls fail as if they timed out, and
+    the others take seconds per call.'''
+    def __init__(self, maxcalls=1000, seconds=0.1, error='timed out'):
+        self.maxcalls = maxcalls
+        self.error = error
+        self.seconds = seconds
+        self.pending = []
+        # number of calls in each request sent
+        self.requests = []
+        self.last_perf = None
+        self.deferred = self
+
+    def reset(self, auth):
+        self.pending = []
+
+    def has_deferred(self, auth):
+        return len(self.pending) > 0
+
+    def __getattr__(self, procedure):
+        def call(auth, *args, **kwargs):
+            self.pending.append([procedure] + list(args))
+        return call
+
+    def send_deferred(self, auth):
+        calls, self.pending = self.pending, []
+        self.requests.append(len(calls))
+        if len(calls) > self.maxcalls:
+            raise pyonep.exceptions.JsonRPCRequestException(self.error)
+        self.last_perf = {'seconds': self.seconds * len(calls), 'bytes': 100 * len(calls)}
+        return [(c, True, 'ok') for c in calls]
+
+
+class TestBatching(TestCase):
+    '''Request sizing and retries, with a fake connection'''
+
+    def _rpc(self, fake):
+        er = exo.ExoRPC()
+        er._local.exo = fake
+        return er
+
+    def batchsizer_test(self):
+        '''BatchSizer follows the timings it observes'''
+        sizer = BatchSizer(initial=10, target_seconds=5.0, target_bytes=1000)
+        self.assertEqual(sizer.size('info'), 10)
+        # fast requests grow by at most a factor of two
+        sizer.observe('info', 10, 0.1)
+        self.assertEqual(sizer.size('info'), 20)
+        # slow ones shrink toward target_seconds
+        sizer.observe('info', 20, 20.0)
+        self.assertTrue(sizer.size('info') < 20)
+        # big responses are kept under target_bytes
+        sizer.observe('read', 10, 0.1, nbytes=1000)
+        self.assertEqual(sizer.size('read'), 10)
+        # sizes are kept per key
+        self.assertEqual(sizer.size('listing'), 10)
+
+    def batchsizer_timedout_test(self):
+        '''BatchSizer stays below sizes that timed out'''
+        sizer = BatchSizer(initial=100)
+        sizer.timedout('info', 100)
+        self.assertEqual(sizer.size('info'), 50)
+        for i in range(10):
+            sizer.observe('info', sizer.size('info'), 0.01)
+        self.assertEqual(sizer.size('info'), 75, 'ceiling is 3/4 of the size that timed out')
+
+    def split_retry_test(self):
+        '''A timed out request of repeatable calls is split and resent'''
+        fake = FakeOnep(maxcalls=3)
+        er = self._rpc(fake)
+        commands = [['info', {'alias': str(i)}, {}] for i in range(8)]
+        r = er._send_commands('cik', commands)
+        self.assertEqual([call for call, isok, response in r],
+                         [['info', {'alias': str(i)}, {}] for i in range(8)])
+        self.assertEqual(fake.requests, [8, 4, 2, 2, 4, 2, 2])
+        self.assertEqual(er.batchsizer.size(('info',)), 3,
+                         'later requests stay under 3/4 of the smallest that timed out')
+
+    def no_retry_test(self):
+        '''A timed out request with a record call isn't sent again'''
+        fake = FakeOnep(maxcalls=1)
+        er = self._rpc(fake)
+        commands = [['read', 'rid', {}], ['record', 'rid', [[1, 1]], {}]]
+        self.assertRaises(pyonep.exceptions.JsonRPCRequestException,
+                          er._send_commands, 'cik', commands)
+        self.assertEqual(fake.requests, [2])
+
+    def split_limit_test(self):
+        '''Timed out requests are split at most max_splits times'''
+        fake = FakeOnep(maxcalls=0)
+        er = self._rpc(fake)
+        commands = [['info', {'alias': str(i)}, {}] for i in range(64)]
+        self.assertRaises(pyonep.exceptions.JsonRPCRequestException,
+                          er._send_commands, 'cik', commands)
+        self.assertEqual(fake.requests, [64, 32, 16, 8])
+
+    def no_split_on_error_test(self):
+        '''Request errors other than timeouts are raised right away'''
+        fake = FakeOnep(maxcalls=0, error='Connection refused')
+        er = self._rpc(fake)
+        commands = [['info', {'alias': str(i)}, {}] for i in range(8)]
+        self.assertRaises(pyonep.exceptions.JsonRPCRequestException,
+                          er._send_commands, 'cik', commands)
+        self.assertEqual(fake.requests, [8])
+        self.assertEqual(er.batchsizer.size(('info',)), 25, 'batch size is unchanged')
+
+    def exobatch_chunkerrors_test(self):
+        '''A failed request only fails its own commands with chunkerrors'''
+        fake = FakeOnep(maxcalls=1)
+        er = self._rpc(fake)
+        commandsets = [{'commands': [['write', 'a', '1']]},
+                       {'commands': [['write', 'b', '2'], ['write', 'c', '3']]},
+                       {'commands': [['write', 'd', '4']]}]
+        r = list(er._exobatch('cik', commandsets, batchsize=1, chunkerrors=True))
+        self.assertEqual([[c['status'] for c in cs] for cs in r],
+                         [['ok'], ['timed out', 'timed out'], ['ok']])
+        self.assertRaises(pyonep.exceptions.JsonRPCRequestException,
+                          list, er._exobatch('cik', commandsets, batchsize=1))
+
+    def write_batched_test(self):
+        '''A failed request for one auth fails only its own writes'''
+        class FailingOnep(FakeOnep):
+            def send_deferred(self, auth):
+                if auth == 'bad':
+                    self.pending = []
+                    raise pyonep.exceptions.JsonRPCRequestException('bad auth')
+                return FakeOnep.send_deferred(self, auth)
+        er = self._rpc(FailingOnep())
+        writes = [('good', 'a', '1'), ('bad', 'b', '2'),
+                  ('good', 'c', '3'), ('bad', 'd', '4')]
+        self.assertEqual([r['status'] for r in er._write_batched(writes)],
+                         ['ok', 'bad auth', 'ok', 'bad auth'])
+
+
+class TestResourceNode(TestCase):
+    '''Compact infotree nodes, without a server'''
+
+    info = {'basic': {'type': 'dataport', 'status': 'activated'},
+            'description': {'name': 'temp', 'format': 'float', 'meta': '{"a": 1}'},
+            'aliases': {}}
+
+    def slots_test(self):
+        '''type, name and format are read without decoding the info'''
+        node = resourcenode.ResourceNode('rid', self.info)
+        decode = resourcenode._decode
+        decoded = []
+        resourcenode._decode = lambda data: decoded.append(1) or decode(data)
+        try:
+            self.assertEqual(node['info']['basic']['type'], 'dataport')
+            self.assertEqual(node['info']['description']['name'], 'temp')
+            self.assertEqual(node['info']['description'].get('format'), 'float')
+            self.assertEqual(len(decoded), 0, 'info should not be decoded')
+            self.assertEqual(node['info']['description']['meta'], '{"a": 1}')
+            self.assertEqual(len(decoded), 1, 'other keys are decoded')
+        finally:
+            resourcenode._decode = decode
+        self.assertEqual(dict(node['info']['description']), self.info['description'])
+        self.assertEqual(node['info'], self.info)
+        self.assertEqual(json.loads(json.dumps(node['info']['basic'], default=resourcenode.jsonable)),
+                         self.info['basic'])
+
+    def missing_test(self):
+        '''Parts that aren't in the info aren't made up from the slots'''
+        node = resourcenode.ResourceNode('rid', {'key': 'k'})
+        self.assertFalse('basic' in node['info'])
+        self.assertRaises(KeyError, lambda: node['info']['description'])
+
+    def readonly_test(self):
+        '''basic and description can't be changed in place'''
+        node = resourcenode.ResourceNode('rid', self.info)
+        def change():
+            node['info']['description']['name'] = 'other'
+        self.assertRaises(TypeError, change)
+        node['info']['description'] = dict(self.info['description'], name='other')
+        self.assertEqual(node['info']['description']['name'], 'other', 'top level changes are kept')
+
+
 def tearDownModule(self):
     '''Do some clean up after all tests are run'''
     if not NOTEARDOWN: